@@ -0,0 +1,74 @@
+import json
+import time
+import argparse
+from classes.client import Client
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Medicine Side Effects Batch Search")
+
+    parser.add_argument("endpoint", help="Batch query endpoint, e.g. https://127.0.0.1:8000/batch")
+    parser.add_argument(
+        "--patients",
+        required=True,
+        help='JSON file with a list of patients, each with "age", "gender", "medicines" and "side_effects"',
+    )
+    parser.add_argument("--outfile", type=str, help="Enable output to file")
+    parser.add_argument(
+        "--protocol",
+        choices=["json", "binary"],
+        default="json",
+        help="Wire protocol, binary sends raw length-prefixed ciphertexts instead of hex in JSON",
+    )
+    parser.add_argument(
+        "--fields",
+        type=lambda x: x.split(","),
+        help="Comma-separated fields of the found entries to fetch, all of them by default",
+    )
+    parser.add_argument(
+        "--decrypt-workers",
+        type=int,
+        default=0,
+        help="Decrypt the results in a pool of this size (0 decrypts on the main thread)",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with open(args.patients, "r") as f:
+        patients: list[dict] = json.load(f)
+
+    client: Client = Client(args.decrypt_workers)
+
+    print(f"[i] Supplied {len(patients)} patients")
+
+    start_time = time.time()
+
+    print("[*] Preparing batch query")
+    batch = client.prepare_batch_query(patients)
+
+    print("[*] Querying the information...")
+    results = client.search_batch(args.endpoint, batch, args.protocol, args.fields)
+
+    elapsed_time = time.time() - start_time
+
+    print(f"[i] Batch query finished after a total of {elapsed_time:.2f} seconds")
+    print(f"[+] Found entries for {sum(result.found for result in results)} patients")
+
+    output = json.dumps(
+        [{"patient": i, "entries": result.entries} for i, result in enumerate(results)], indent=4
+    )
+
+    if args.outfile:
+        with open(args.outfile, "w") as f:
+            f.write(output)
+            print(f"[*] Writing output to a file: {args.outfile}")
+    else:
+        print(f"[*] Output:\n\n{output}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+
+from classes.client import Client
+from classes.database import Database
+from classes.metrics import Summary
+from classes.parameters import PARAMETERS_FILE
+from classes.query import Query
+from server import IP_ADDRESS, Server
+
+
+def parse_list(value: str) -> list[int]:
+    return [int(i) for i in value.split(",")]
+
+
+def parse_vocabulary(value: str) -> list[tuple[int, int]]:
+    return [tuple(int(i) for i in pair.split(":")) for pair in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Medicine Side Effects Search Benchmark")
+
+    parser.add_argument(
+        "--entries", type=parse_list, default=[10000], help="Comma-separated dataset sizes"
+    )
+    parser.add_argument(
+        "--vocabulary",
+        type=parse_vocabulary,
+        default=[(200, 20), (20, 10), (2000, 1000)],
+        help="Comma-separated MEDICINES:SIDE_EFFECTS vocabulary sizes",
+    )
+    parser.add_argument(
+        "--radius", type=parse_list, default=[2], help="Comma-separated age radiuses"
+    )
+    parser.add_argument(
+        "--query-sizes",
+        type=parse_list,
+        default=[4],
+        help="Comma-separated numbers of medicines and side effects per query",
+    )
+    parser.add_argument("--queries", type=int, default=10, help="Measured queries per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured queries per case")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the datasets and queries")
+    parser.add_argument("--mode", choices=["auto", "entry", "packed"], default="entry")
+    parser.add_argument("--protocol", choices=["json", "binary"], default="binary")
+    parser.add_argument(
+        "--transport",
+        choices=["inprocess", "loopback", "both"],
+        default="both",
+        help="Search the database directly, over HTTPS on the loopback interface or both",
+    )
+    parser.add_argument(
+        "--workdir",
+        help="Directory for the keys of the benchmark, a temporary one by default",
+    )
+    parser.add_argument("--output", default="benchmark.json", help="File to write the results to")
+
+    return parser.parse_args()
+
+
+def generate_queries(
+    client: Client,
+    dataset: list[dict],
+    num_medicines: int,
+    num_side_effects: int,
+    query_size: int,
+    count: int,
+    mode: str,
+    seed: int,
+) -> list[Query]:
+    """
+    This function generates reproducible queries of `query_size` medicines and side effects.
+    Every query contains a medicine and a side effect of a random entry, so the optimized
+    dataset is never empty.
+    """
+
+    rng = random.Random(seed)
+    queries: list[Query] = []
+
+    for _ in range(count):
+        entry = rng.choice(dataset)
+
+        medicines = {rng.choice(entry["medicines"])}
+        while len(medicines) < min(query_size, num_medicines):
+            medicines.add(rng.randint(1, num_medicines))
+
+        side_effects = {rng.choice(entry["side_effects"])}
+        while len(side_effects) < min(query_size, num_side_effects):
+            side_effects.add(rng.randint(1, num_side_effects))
+
+        queries.append(
+            client.prepare_query(
+                sorted(medicines),
+                sorted(side_effects),
+                rng.randint(1, 99),
+                rng.choice(["male", "female"]),
+                mode,
+            )
+        )
+
+    return queries
+
+
+def serialize_query(query: Query, protocol: str) -> str | bytes:
+    return query.serialize_binary() if protocol == "binary" else query.serialize()
+
+
+def search_inprocess(client: Client, database: Database, query: Query, protocol: str) -> dict:
+    """
+    This function runs one query through the same steps as the server and the client,
+    without the network in between, including the fetch of the found entries.
+    """
+
+    data = serialize_query(query, protocol)
+    stats: dict = {"query_bytes": len(data)}
+
+    if protocol == "binary":
+        received = Query.deserialize_binary(data)
+    else:
+        received = Query.deserialize(data)
+
+    candidates = database.optimize_dataset(received)
+    header, ciphertexts = database.search_iter(received, candidates)
+
+    indexes, _ = client.decrypt_results(header, client.measure_results(ciphertexts, stats))
+
+    stats["candidates"] = len(candidates)
+
+    if indexes:
+        data = database.get_data(indexes, candidates)
+        stats["fetch_bytes"] = len(data)
+
+        client.decrypt_response_result(json.loads(data))
+
+    return stats
+
+
+def search_loopback(client: Client, endpoint: str, query: Query, protocol: str) -> dict:
+    # The size of the optimized dataset comes from the X-Candidates header of the server
+    return client.search(endpoint, serialize_query(query, protocol), protocol).stats
+
+
+def run_case(search, queries: list[Query], warmup: int) -> dict:
+    """
+    This function measures the latency of every query and returns the throughput,
+    latency percentiles, payload sizes and the peak memory of the process.
+    """
+
+    for query in queries[:warmup]:
+        search(query)
+
+    latency = Summary()
+    sizes: dict[str, Summary] = {}
+
+    start_time = time.perf_counter()
+
+    for query in queries[warmup:]:
+        query_start = time.perf_counter()
+        stats = search(query)
+        latency.observe(time.perf_counter() - query_start)
+
+        for key in ["candidates", "query_bytes", "ciphertext_bytes", "fetch_bytes"]:
+            if key in stats:
+                sizes.setdefault(key, Summary()).observe(stats[key])
+
+    elapsed_time = time.perf_counter() - start_time
+
+    return {
+        "throughput": latency.count / elapsed_time if elapsed_time > 0 else 0.0,
+        "latency": latency.to_dict(),
+        **{key: summary.to_dict() for key, summary in sizes.items()},
+        # Peak resident memory of the process of the case (kilobytes on Linux), see
+        # `benchmark_case`
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def benchmark_case(
+    dataset_file: str,
+    packed_file: str | None,
+    radius: int,
+    transport: str,
+    queries: list[Query],
+    args,
+) -> dict:
+    """
+    This function runs in a fresh process for every case, so the peak memory it reports
+    belongs to the case alone: the database with the dataset of `dataset_file`, the
+    client and, for the loopback transport, the server.
+    """
+
+    client = Client(generate=False)
+    database = Database()
+
+    with open(dataset_file, "r") as f:
+        dataset: list[dict] = json.load(f)
+
+    packed: dict | None = None
+    if packed_file is not None:
+        with open(packed_file, "r") as f:
+            packed = json.load(f)
+
+    database.load_records(dataset, packed)
+    del dataset, packed
+
+    database.radius = radius
+    database.check_noise_budget()
+
+    if transport == "inprocess":
+        search = lambda query: search_inprocess(client, database, query, args.protocol)
+    else:
+        httpd = Server(database=database).create_httpd(0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+        endpoint = f"https://{IP_ADDRESS}:{httpd.server_address[1]}/query"
+        search = lambda query: search_loopback(client, endpoint, query, args.protocol)
+
+    return run_case(search, queries, args.warmup)
+
+
+def run_isolated(*case_args) -> dict:
+    """
+    This function runs `benchmark_case` in a spawned process and returns its results.
+    """
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(benchmark_case, case_args)
+
+
+def main():
+    args = parse_args()
+
+    output = os.path.abspath(args.output)
+    transports = ["inprocess", "loopback"] if args.transport == "both" else [args.transport]
+
+    # Keys are generated in the work directory, with the parameters of the current one
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fhe-benchmark-")
+    if os.path.exists(PARAMETERS_FILE) and not os.path.exists(
+        os.path.join(workdir, PARAMETERS_FILE)
+    ):
+        shutil.copy(PARAMETERS_FILE, workdir)
+
+    os.chdir(workdir)
+    print(f"[i] Benchmark work directory: {workdir}")
+
+    client = Client(generate=False)
+
+    results = []
+
+    for num_entries in args.entries:
+        for num_medicines, num_side_effects in args.vocabulary:
+            print(
+                f"[*] Generating {num_entries} entries with {num_medicines} medicines "
+                f"and {num_side_effects} side effects"
+            )
+
+            dataset, m_values = client.generate_dataset(
+                num_entries, num_medicines, num_side_effects, args.seed
+            )
+
+            # Cases load the dataset in their own process, see `benchmark_case`
+            name = f"dataset-{num_entries}-{num_medicines}-{num_side_effects}"
+            dataset_file = f"{name}.json"
+
+            with open(dataset_file, "w") as f:
+                json.dump(dataset, f)
+
+            # The planner of the "auto" mode chooses between both evaluations
+            packed_file: str | None = None
+            if args.mode != "entry":
+                packed_file = f"{name}.packed.json"
+
+                with open(packed_file, "w") as f:
+                    json.dump(client.pack_dataset(m_values), f)
+
+            for radius in args.radius:
+                for query_size in args.query_sizes:
+                    queries = generate_queries(
+                        client,
+                        dataset,
+                        num_medicines,
+                        num_side_effects,
+                        query_size,
+                        args.warmup + args.queries,
+                        args.mode,
+                        args.seed,
+                    )
+
+                    for transport in transports:
+                        print(f"[*] Radius {radius}, query size {query_size}, {transport}")
+
+                        results.append(
+                            {
+                                "entries": num_entries,
+                                "medicines": num_medicines,
+                                "side_effects": num_side_effects,
+                                "radius": radius,
+                                "query_size": query_size,
+                                "mode": args.mode,
+                                "protocol": args.protocol,
+                                "transport": transport,
+                                **run_isolated(
+                                    dataset_file, packed_file, radius, transport, queries, args
+                                ),
+                            }
+                        )
+
+    with open(output, "w") as f:
+        f.write(json.dumps({"seed": args.seed, "results": results}, indent=4))
+
+    print(f"[+] Wrote benchmark results to a file: {output}")
+
+
+if __name__ == "__main__":
+    main()
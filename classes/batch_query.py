@@ -0,0 +1,68 @@
+import json
+
+from classes.query import Query
+from classes.wire import pack_frames, unpack_frames
+
+
+class BatchQuery:
+    def __init__(self, patients: list[dict], encrypted_ms: list[str | bytes]) -> None:
+        """
+        Query of many patients at once. Every patient holds its own "medicines" and
+        "side_effects", the `m` values of the patients are packed into the batching slots
+        of `encrypted_ms`, patient i lives in ciphertext i // slot_count, slot i % slot_count.
+
+        Entry ciphertexts are constant polynomials, so one evaluation of the match
+        polynomial against an entry answers every patient of a ciphertext at once.
+        """
+
+        self.patients = patients
+        # Hex strings when sent as JSON, raw bytes when sent in the binary protocol
+        self.encrypted_ms = encrypted_ms
+
+    def group_query(self, group: int) -> Query:
+        """
+        This function returns the packed ciphertext of a group of patients as a `Query`,
+        which is what the evaluation of the match polynomial expects.
+        """
+
+        return Query([], [], self.encrypted_ms[group])
+
+    @classmethod
+    def deserialize(cls, serialized_query: str) -> "BatchQuery":
+        data = json.loads(serialized_query)
+
+        return cls(patients=data["patients"], encrypted_ms=data["encrypted_ms"])
+
+    @classmethod
+    def deserialize_binary(cls, serialized_query: bytes) -> "BatchQuery":
+        """
+        This class method recreates a batch query from the binary POST data, see `serialize_binary`.
+        """
+
+        header, *encrypted_ms = unpack_frames(serialized_query)
+
+        return cls(patients=json.loads(header)["patients"], encrypted_ms=encrypted_ms)
+
+    def serialize(self) -> str:
+        encrypted_ms = [
+            encrypted_m.hex() if isinstance(encrypted_m, bytes) else encrypted_m
+            for encrypted_m in self.encrypted_ms
+        ]
+
+        return json.dumps({"patients": self.patients, "encrypted_ms": encrypted_ms})
+
+    def serialize_binary(self) -> bytes:
+        """
+        Serializes the batch query into a JSON header with the patients followed by one
+        frame per raw serialized ciphertext
+        """
+
+        header = json.dumps({"patients": self.patients}).encode("utf-8")
+
+        return pack_frames(
+            [header]
+            + [
+                bytes.fromhex(encrypted_m) if isinstance(encrypted_m, str) else encrypted_m
+                for encrypted_m in self.encrypted_ms
+            ]
+        )
@@ -0,0 +1,118 @@
+import time
+import threading
+import seal
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+from classes.metrics import Metrics
+
+
+class CiphertextStore:
+    def __init__(
+        self,
+        context: seal.SEALContext,
+        memory_budget: int,
+        metrics: Metrics | None = None,
+    ) -> None:
+        """
+        Cache of deserialized entry ciphertexts keyed by the `key` of the dataset, which
+        tells apart the ciphertexts of an entry before and after an ingest. Least recently
+        used ciphertexts are evicted once `memory_budget` (bytes) is exceeded.
+        """
+
+        self.context = context
+        self.memory_budget = memory_budget
+        self.metrics = metrics
+
+        self.ciphertexts: OrderedDict[Hashable, seal.Ciphertext] = OrderedDict()
+        self.sizes: dict[Hashable, int] = {}
+        self.memory_used = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def ciphertext_size(ciphertext: seal.Ciphertext) -> int:
+        """
+        This function returns the in-memory size of the ciphertext polynomials in bytes.
+        """
+
+        return (
+            ciphertext.size() * ciphertext.poly_modulus_degree() * ciphertext.coeff_modulus_size() * 8
+        )
+
+    def get(self, key: Hashable, load: Callable[[], bytes]) -> seal.Ciphertext:
+        """
+        This function returns the ciphertext cached under the supplied key. On a cache miss
+        `load` returns the serialized ciphertext, which is deserialized and cached.
+        """
+
+        with self.lock:
+            ciphertext = self.ciphertexts.get(key)
+
+            if ciphertext is not None:
+                self.ciphertexts.move_to_end(key)
+                self.hits += 1
+
+                return ciphertext
+
+            self.misses += 1
+
+        # Deserialize outside of the lock, so other queries are not blocked
+        start_time = time.perf_counter()
+        ciphertext = self.context.from_cipher_str(load())
+
+        # Per entry, the "deserialize" phase of the server times whole queries
+        if self.metrics is not None:
+            self.metrics.observe_phase("entry_deserialize", time.perf_counter() - start_time)
+
+        self.put(key, ciphertext)
+
+        return ciphertext
+
+    def put(self, key: Hashable, ciphertext: seal.Ciphertext) -> None:
+        size = self.ciphertext_size(ciphertext)
+
+        if size > self.memory_budget:
+            return
+
+        with self.lock:
+            if key in self.ciphertexts:
+                self.memory_used -= self.sizes[key]
+
+            self.ciphertexts[key] = ciphertext
+            self.ciphertexts.move_to_end(key)
+            self.sizes[key] = size
+            self.memory_used += size
+
+            # Evict the least recently used ciphertexts until the budget is met
+            while self.memory_used > self.memory_budget:
+                evicted, _ = self.ciphertexts.popitem(last=False)
+                self.memory_used -= self.sizes.pop(evicted)
+
+    def discard(self, key: Hashable) -> None:
+        with self.lock:
+            if self.ciphertexts.pop(key, None) is not None:
+                self.memory_used -= self.sizes.pop(key)
+
+    def stats(self) -> dict:
+        """
+        This function returns the hit and miss counts and the memory usage of the cache.
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached": len(self.ciphertexts),
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory_budget,
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.ciphertexts.clear()
+            self.sizes.clear()
+            self.memory_used = 0
@@ -1,16 +1,26 @@
 import os
+import glob
 import time
 import seal
 import json
-import numpy as np
-import random
 import urllib3
 import requests
 
-from faker import Faker
+from requests.adapters import HTTPAdapter
+from typing import Iterable, Iterator
+
+from classes.batch_query import BatchQuery
+from classes.decryption import DecryptionPool, find_zeros
+from classes.parameters import create_context
+from classes.profiling import Profiler
 from classes.query import Query
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+from classes.search_result import SearchResult
+from classes.wire import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    decode_results_json,
+    decode_results_stream,
+)
 
 
 # Disable SSL warnings
@@ -18,24 +28,23 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 class Client:
-    def __init__(self) -> None:
-        # initialize BFV scheme parameters
-        params = seal.EncryptionParameters(seal.scheme_type.bfv)
-
-        poly_modulus_degree = 8192
-        params.set_poly_modulus_degree(poly_modulus_degree)
-        params.set_coeff_modulus(seal.CoeffModulus.BFVDefault(poly_modulus_degree))
-        params.set_plain_modulus(seal.PlainModulus.Batching(poly_modulus_degree, 20))
-
-        self.context = seal.SEALContext(params)
+    def __init__(
+        self,
+        decrypt_workers: int = 0,
+        decrypt_pool: str = "process",
+        generate: bool = True,
+        profile_rate: float = 0.0,
+    ) -> None:
+        # initialize BFV scheme parameters, planned by `plan_parameters.py` if there is a parameter file
+        self.context = create_context()
 
         # initilize encoder that is used for encoding list of ints to `seal.Plaintext` and then decoding vice versa
         self.encoder = seal.BatchEncoder(self.context)
 
-        # initialize encryptor and decryptors with keys
-        keygen = seal.KeyGenerator(self.context)
-
+        # initialize encryptor and decryptors with keys, a key generator is only needed for new keys
         if not os.path.exists("public_key.bin") and not os.path.exists("secret_key.bin"):
+            keygen = seal.KeyGenerator(self.context)
+
             public_key = keygen.create_public_key()
             secret_key = keygen.secret_key()
             relin_keys = keygen.create_relin_keys()
@@ -54,12 +63,27 @@ class Client:
         self.encryptor = seal.Encryptor(self.context, public_key)
         self.decryptor = seal.Decryptor(self.context, secret_key)
 
+        # Optional pool of workers with their own decryptors, "process" or "thread"
+        self.decryption_pool: DecryptionPool | None = None
+        if decrypt_workers > 0:
+            self.decryption_pool = DecryptionPool(decrypt_pool, decrypt_workers)
+
+        # Persistent HTTPS connections, reused by the query and the fetch of every search
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+        # Share of the searches profiled with cProfile, see `search_patient`
+        self.profiler = Profiler(profile_rate)
+
         self.aes_key = b"4dd2498fcf9fd261614c9c608b8715c5"
         self.aes_nonce = b"x\x85\xa5\xd3\x19-\xd8CH\xb4Gck\x05\x99o"
 
-        self.generate_random()
+        # The dataset files are generated on the first run, unless the caller builds its own
+        if generate:
+            self.generate_random()
 
-    def generate_random(self) -> None:
+    def generate_random(self, num_entries: int | None = None, workers: int | None = None) -> None:
         """
         This function generates a random dataset. The dataset consist of the following:
         - Random name
@@ -75,145 +99,186 @@ class Client:
 
         This is achieved by aforementioined correlation matrix and multinomial distribution
         of the probabilities.
+
+        The entries are generated in batches by `DatasetGenerator` and streamed to the file,
+        so the dataset never has to fit in memory as a whole. Large datasets are encrypted
+        in a process pool of `workers` (all cores by default).
         """
 
         if not os.path.exists("dataset.json"):
-            # Parameters
-            NUM_MEDICINES = 200
-            NUM_SIDE_EFFECTS = 20
-            NUM_ENTRIES = 100
-            MAX_PATIENT_MEDICINES = 10
-            MAX_PATIENT_SIDE_EFFECTS = 5
+            # Changes ingested into a previous dataset do not apply to a fresh one, neither
+            # do the journals of its shards
+            for journal in glob.glob("dataset.journal") + glob.glob("dataset.*-of-*.journal"):
+                os.remove(journal)
 
-            # List of side effects
-            medicines_list = list(range(1, NUM_MEDICINES + 1))
+            # The server prefers the columnar dataset, which would still hold the old entries
+            if os.path.exists("dataset.bin"):
+                os.remove("dataset.bin")
+                print("[i] Removed the stale dataset.bin, convert the new one with convert_dataset.py")
 
-            # List of side effects
-            side_effect_list = list(range(1, NUM_SIDE_EFFECTS + 1))
+            # NumPy and Faker are only imported when a dataset is generated
+            from classes.generator import BATCH_ENTRIES, NUM_ENTRIES
 
-            # List of genders
-            genders = ["male", "female"]
+            num_entries = num_entries or NUM_ENTRIES
 
-            # List of treatments
-            treatments = ["Stop", "Drink", "Double"]
+            if workers is None:
+                workers = os.cpu_count() if num_entries >= BATCH_ENTRIES else 0
 
-            # Random names generator
-            fake = Faker()
+            # Plain `m` values of the entries, used for the packed dataset
+            m_values: list[int] = []
 
-            # Create a matrix representing the probability of each medicine causing each side effect
-            correlation_matrix = np.random.rand(NUM_MEDICINES + 1, NUM_SIDE_EFFECTS + 1)
+            # Save the dataset
+            with open("dataset.json", "w") as f:
+                separator = "["
 
-            # Create a random nonce (IV for CTR)
-            # aes_nonce = os.urandom(16)
+                for entries, batch_m_values in self.iter_dataset(num_entries, workers=workers):
+                    for entry in entries:
+                        f.write(separator + json.dumps(entry))
+                        separator = ", "
 
-            # AES CTR initialization
-            cipher = Cipher(
-                algorithms.AES(self.aes_key),
-                modes.CTR(self.aes_nonce),
-                backend=default_backend(),
-            )
+                    m_values.extend(batch_m_values)
 
-            random_dataset = []
+                f.write("]")
+                print("[i] Wrote a fresh dataset to file: dataset.json")
 
-            # Generate random dataset
-            for _ in range(NUM_ENTRIES):
-                name = fake.name()
+            # Save the packed representation of the same dataset
+            self.generate_packed(m_values)
+
+    def iter_dataset(
+        self,
+        num_entries: int | None = None,
+        num_medicines: int | None = None,
+        num_side_effects: int | None = None,
+        seed: int | None = None,
+        workers: int = 0,
+    ) -> Iterator[tuple[list[dict], list[int]]]:
+        """
+        This function yields the entries of a random dataset together with their plain
+        `m` values batch by batch, followed by the two known test entries. Sizes that
+        are not supplied default to the ones in `classes.generator`.
+        """
 
-                # AES CTR encryption for 'name'
-                encryptor = cipher.encryptor()
-                name_encrypted = encryptor.update(name.encode()) + encryptor.finalize()
+        from classes.generator import (
+            NUM_ENTRIES,
+            NUM_MEDICINES,
+            NUM_SIDE_EFFECTS,
+            DatasetGenerator,
+        )
 
-                age = random.randint(1, 99)
-                gender = random.choice(genders)
+        generator = DatasetGenerator(
+            self.encryptor,
+            self.aes_cipher(),
+            num_medicines or NUM_MEDICINES,
+            num_side_effects or NUM_SIDE_EFFECTS,
+            seed,
+            workers,
+        )
 
-                # FHE encryption for age and gender (m)
-                encrypted_m = self.prepare_m(gender, age).to_string().hex()
+        num_entries = num_entries or NUM_ENTRIES
 
-                ######### IMPORTANT #########
-                # Here we apply the above matrix for probability distribution of one medicine to cause a specific side effect
+        try:
+            yield from generator.batches(num_entries)
+        finally:
+            generator.shutdown()
 
-                # Generate random medicines
-                medicines = random.sample(
-                    medicines_list, k=random.randint(1, MAX_PATIENT_MEDICINES)
-                )
+        treatment_encrypted = generator.aes_encrypt(b"Stop 1")
 
-                # Generate random number of side effects
-                side_effect_count = random.randint(1, MAX_PATIENT_SIDE_EFFECTS)
+        tests: list[dict] = []
 
-                # Sum correlations of the generated medicines' side effects based on the correlation matrix
-                side_effect_probs = np.sum(correlation_matrix[medicines], axis=0)
+        for age in [41, 40]:
+            tests.append(
+                {
+                    "name": "test",
+                    "encrypted_m": self.prepare_m("male", age).to_string().hex(),
+                    "age": str(age),
+                    "medicines": [1, 2],
+                    "side_effects": [1, 2],
+                    "treatment": treatment_encrypted.hex(),
+                }
+            )
 
-                # Normalize probabilities to ensure they sum to 1
-                side_effect_probs /= side_effect_probs.sum()
+        yield tests, [self.compute_m("male", 41), self.compute_m("male", 40)]
 
-                # Use multinomial calculations to produce indexes of side effects based on probabilities calculated in "side_effect_probs"
-                side_effect_indices = np.random.multinomial(
-                    side_effect_count,
-                    side_effect_probs[: len(side_effect_list)],
-                    size=1,
-                ).nonzero()[1]
+    def generate_dataset(
+        self,
+        num_entries: int | None = None,
+        num_medicines: int | None = None,
+        num_side_effects: int | None = None,
+        seed: int | None = None,
+        workers: int = 0,
+    ) -> tuple[list[dict], list[int]]:
+        """
+        This function generates the entries of a random dataset (see `generate_random`)
+        in memory and returns them together with their plain `m` values.
 
-                side_effect = [side_effect_list[i] for i in side_effect_indices]
+        With a `seed` the plain content of the dataset is reproducible, only the FHE
+        ciphertexts differ between runs.
+        """
 
-                # AES CTR encryption for 'treatment'
-                encryptor_treatment = cipher.encryptor()
-                treatment = f"{random.choice(treatments)} {random.choice(medicines)}"
-                treatment_encrypted = (
-                    encryptor_treatment.update(treatment.encode()) + encryptor_treatment.finalize()
-                )
+        random_dataset: list[dict] = []
+        m_values: list[int] = []
 
-                entry = {
-                    "name": name_encrypted.hex(),
-                    "encrypted_m": encrypted_m,
-                    "age": age,
-                    "medicines": medicines,
-                    "side_effects": side_effect,
-                    "treatment": treatment_encrypted.hex(),
-                }
+        for entries, batch_m_values in self.iter_dataset(
+            num_entries, num_medicines, num_side_effects, seed, workers
+        ):
+            random_dataset.extend(entries)
+            m_values.extend(batch_m_values)
 
-                random_dataset.append(entry)
+        return random_dataset, m_values
 
-            test = {
-                "name": "test",
-                "encrypted_m": self.prepare_m("male", 41).to_string().hex(),
-                "age": "41",
-                "medicines": [1, 2],
-                "side_effects": [1, 2],
-                "treatment": treatment_encrypted.hex(),
-            }
+    def generate_packed(self, m_values: list[int]) -> None:
+        """
+        This function stores the `m` parameters of the dataset column-wise. Each block
+        is one ciphertext holding the `m` values of `slot_count` consecutive entries,
+        which lets the server evaluate a whole block with a single FHE operation.
+        """
 
-            random_dataset.append(test)
+        with open("packed_dataset.json", "w") as f:
+            f.write(json.dumps(self.pack_dataset(m_values)))
+            print("[i] Wrote a packed dataset to file: packed_dataset.json")
 
-            test = {
-                "name": "test",
-                "encrypted_m": self.prepare_m("male", 40).to_string().hex(),
-                "age": "40",
-                "medicines": [1, 2],
-                "side_effects": [1, 2],
-                "treatment": treatment_encrypted.hex(),
-            }
+    def pack_dataset(self, m_values: list[int]) -> dict:
+        """
+        This function returns the packed representation of the supplied `m` values,
+        in the format of `packed_dataset.json`.
+        """
 
-            random_dataset.append(test)
+        slot_count = self.encoder.slot_count()
 
-            # Save the dataset
-            with open("dataset.json", "w") as f:
-                f.write(json.dumps(random_dataset))
-                print("[i] Wrote a fresh dataset to file: dataset.json")
+        blocks: list[str] = []
 
-    def AES_decrypt(self, encrypted_treatment_hex: str) -> str:
+        for start in range(0, len(m_values), slot_count):
+            block = m_values[start : start + slot_count]
+
+            plain_block: seal.Plaintext = self.encoder.encode(block + [0] * (slot_count - len(block)))
+            blocks.append(self.encryptor.encrypt(plain_block).to_string().hex())
+
+        return {"slot_count": slot_count, "blocks": blocks}
+
+    def aes_cipher(self):
         """
-        Simple function for AES CTR decryption.
+        This function returns the AES CTR cipher of the dataset, cryptography is imported
+        on first use as most invocations never decrypt an entry.
         """
 
-        encrypted_treatment = bytes.fromhex(encrypted_treatment_hex)
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
 
-        cipher = Cipher(
+        # AES CTR initialization
+        return Cipher(
             algorithms.AES(self.aes_key),
             modes.CTR(self.aes_nonce),
             backend=default_backend(),
         )
 
-        decryptor = cipher.decryptor()
+    def AES_decrypt(self, encrypted_treatment_hex: str) -> str:
+        """
+        Simple function for AES CTR decryption.
+        """
+
+        encrypted_treatment = bytes.fromhex(encrypted_treatment_hex)
+
+        decryptor = self.aes_cipher().decryptor()
         decrypted_treatment = decryptor.update(encrypted_treatment) + decryptor.finalize()
 
         return decrypted_treatment
@@ -221,19 +286,20 @@ class Client:
     def decrypt_response_result(self, result: dict) -> dict:
         """
         This function takes the result dictionary received from the server
-        and decrypts the treatment information.
+        and decrypts the treatment information. Entries deleted since the query
+        are null and are kept as None, so the entries line up with the indexes.
         """
 
         for res in result:
-            # Decrypt AES encrypted treatment info
-            res["treatment"] = self.AES_decrypt(res["treatment"]).decode()
+            # Decrypt AES encrypted treatment info, unless it was not requested
+            if res is not None and "treatment" in res:
+                res["treatment"] = self.AES_decrypt(res["treatment"]).decode()
 
         return result
 
-    def prepare_m(self, gender: str, age: int) -> seal.Plaintext:
+    def compute_m(self, gender: str, age: int) -> int:
         """
-        This function merges age and gender to a sigle parameter based on the reserach paper,
-        then the function encrypts this parameter using FHE.
+        This function merges age and gender to a sigle parameter based on the reserach paper.
         """
 
         m = 0
@@ -244,6 +310,19 @@ class Client:
         elif gender == "female":
             m = age + 128 + R
 
+        return m
+
+    def prepare_m(self, gender: str, age: int) -> seal.Plaintext:
+        """
+        This function merges age and gender to a sigle parameter based on the reserach paper,
+        then the function encrypts this parameter using FHE.
+
+        The parameter is encoded as a constant polynomial, which the batch encoder sees as
+        the same value in every slot. That makes the query usable against packed blocks too.
+        """
+
+        m = self.compute_m(gender, age)
+
         plain_m: seal.Plaintext = seal.Plaintext(hex(m)[2::])
 
         # Encrypt m
@@ -251,7 +330,9 @@ class Client:
 
         return encrypted_m
 
-    def prepare_query(self, medicine: list, side_effects: list, age: int, gender: str) -> Query:
+    def prepare_query(
+        self, medicine: list, side_effects: list, age: int, gender: str, mode: str = "entry"
+    ) -> Query:
         """
         This function combines encrypted m with lists of medicines and side effects
         and returns a object representing the user query.
@@ -260,9 +341,125 @@ class Client:
         # Encrypt m
         encrypted_m: seal.Ciphertext = self.prepare_m(gender, age)
 
-        return Query(medicine, side_effects, encrypted_m.to_string().hex())
+        return Query(medicine, side_effects, encrypted_m.to_string().hex(), mode)
+
+    def search_patient(
+        self,
+        endpoint: str,
+        medicines: list[int],
+        side_effects: list[int],
+        age: int,
+        gender: str,
+        mode: str = "entry",
+        protocol: str = "json",
+        fields: list[str] | None = None,
+    ) -> SearchResult:
+        """
+        This function prepares the query of one patient and runs the search, it is the
+        entry point for long-lived callers that keep one warm `Client` for many queries.
+        The preparation and the total time are added to the timings of the result.
+
+        Profiled searches ask the server to profile its side under the same request ID,
+        the ID is added to the stats of the result.
+        """
+
+        start_time = time.time()
+
+        profile = self.profiler.start()
+        profiled = profile.enabled
+
+        try:
+            with profile.section():
+                query = self.prepare_query(medicines, side_effects, age, gender, mode)
+                prepare_time = time.time() - start_time
+
+                data = query.serialize_binary() if protocol == "binary" else query.serialize()
+                result = self.search(endpoint, data, protocol, fields, profile.headers())
+        finally:
+            profile.finish()
+
+        result.timings["prepare"] = prepare_time
+        result.timings["total"] = time.time() - start_time
+
+        if profiled:
+            result.stats["profile"] = profile.request_id
+
+        return result
 
-    def search(self, endpoint: str, data: str) -> str:
+    def decrypt_stream(
+        self, ciphertexts: Iterable[bytes], block_slots: list[list[int]] | None
+    ) -> Iterator[list[int]]:
+        """
+        This function decrypts the ciphertexts one by one on the calling thread.
+        """
+
+        for i, ciphertext in enumerate(ciphertexts):
+            slots = [block_slots[i]] if block_slots is not None else None
+
+            yield from find_zeros(self.context, self.encoder, self.decryptor, [ciphertext], slots)
+
+    def decrypt_results(self, header: dict, ciphertexts: Iterable[bytes]) -> tuple[list[int], int]:
+        """
+        This function decrypts the results and returns the indexes of the optimized dataset
+        that decrypted to zero, together with the number of received ciphertexts.
+
+        Entry results hold one index each in slot 0. Packed results hold one block each,
+        with the slots of its entries listed in the header in the order of the optimized
+        dataset. Indexes are tracked by position, the ciphertexts may still be arriving
+        from the server while the first ones are decrypted.
+        """
+
+        block_slots: list[list[int]] | None = header["slots"] if header["mode"] == "packed" else None
+
+        if self.decryption_pool is not None:
+            zeros = self.decryption_pool.find_zeros(ciphertexts, block_slots)
+        else:
+            zeros = self.decrypt_stream(ciphertexts, block_slots)
+
+        indexes: list[int] = []
+        offset = 0
+        count = 0
+
+        for positions in zeros:
+            for position in positions:
+                index: int = offset + position
+
+                print(f"[+] Entry found on index {index}")
+
+                indexes.append(index)
+
+            offset += len(block_slots[count]) if block_slots is not None else 1
+            count += 1
+
+        return indexes, count
+
+    def measure_results(self, ciphertexts: Iterable[bytes], stats: dict) -> Iterator[bytes]:
+        """
+        This function passes the received ciphertexts through while recording their sizes
+        and the invariant noise budget left in the first one, which is representative
+        because every result of a query went through the same circuit.
+        """
+
+        stats["ciphertext_bytes"] = 0
+
+        for ciphertext in ciphertexts:
+            if "noise_budget" not in stats:
+                stats["noise_budget"] = self.decryptor.invariant_noise_budget(
+                    self.context.from_cipher_str(ciphertext)
+                )
+
+            stats["ciphertext_bytes"] += len(ciphertext)
+
+            yield ciphertext
+
+    def search(
+        self,
+        endpoint: str,
+        data: str | bytes,
+        protocol: str = "json",
+        fields: list[str] | None = None,
+        headers: dict | None = None,
+    ) -> SearchResult:
         """
         This is the main search function for the client. This function communicates with
         the query endpoint and sends the query. After getting a response from the server
@@ -274,48 +471,288 @@ class Client:
 
         Then function requests data from the query endpoint based on the indexes found
         in the previous steps.
-        """
 
-        response: requests.Response = requests.post(endpoint, data=data, verify=False)
+        With the "binary" protocol, `data` is the output of `Query.serialize_binary` and
+        the ciphertexts travel as raw length-prefixed frames instead of hex in JSON.
 
-        results: list = json.loads(response.text)
+        With `fields`, only the selected fields of the found entries are fetched.
 
-        hit: bool = False
-        indexes: list = []
+        `headers` are added to the query request, e.g. to ask for a profile of it.
+
+        The function returns a `SearchResult` with the found indexes, the decrypted
+        entries, the timings of the query, decryption and fetch phases and the stats
+        of the received results.
+        """
+
+        timings: dict[str, float] = {}
+        stats: dict = {"query_bytes": len(data)}
 
         start_time = time.time()
 
-        for result in results:
-            # Deserialize ciphertext
-            entry = self.context.from_cipher_str(bytes.fromhex(result))
+        content_type = BINARY_CONTENT_TYPE if protocol == "binary" else JSON_CONTENT_TYPE
 
-            # Decrypt and decode ciphertext
-            decoded = self.encoder.decode(self.decryptor.decrypt(entry))[0]
+        # Binary results are streamed, so decryption starts with the first received ciphertext
+        response: requests.Response = self.session.post(
+            endpoint,
+            data=data,
+            headers={"Content-Type": content_type, "Accept": content_type, **(headers or {})},
+            stream=True,
+        )
 
-            if decoded == 0:
-                index: int = results.index(result)
+        # Rejected queries, e.g. above the query budget of the server
+        if response.status_code != 200:
+            raise ValueError(f"Server answered with status {response.status_code}: {response.text}")
 
-                print(f"[+] Entry found on index {index}")
+        # Evaluation strategy chosen by the server and its predicted cost
+        if "X-Query-Plan" in response.headers:
+            stats["plan"] = json.loads(response.headers["X-Query-Plan"])
 
-                indexes.append(index)
-                hit = True
+        # Size of the optimized dataset of the query
+        if "X-Candidates" in response.headers:
+            stats["candidates"] = int(response.headers["X-Candidates"])
 
-        if not hit:
-            print("[x] Entry not found")
-            exit(1)
+        # The server answers in JSON unless it supports the requested binary protocol
+        if response.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+            header, ciphertexts = decode_results_stream(response.iter_content(chunk_size=None))
+        else:
+            results: dict = decode_results_json(response.content)
+            header, ciphertexts = results, results["ciphertexts"]
+
+        timings["query"] = time.time() - start_time
+        start_time = time.time()
+
+        indexes, result_count = self.decrypt_results(
+            header, self.measure_results(ciphertexts, stats)
+        )
 
         end_time = time.time()
         elapsed_time = end_time - start_time
+        timings["decrypt"] = elapsed_time
 
         print(f"[i] FHE results decryption completed after: {elapsed_time:.2f} seconds")
 
-        data: str = json.dumps(indexes)
-        response: requests.Response = requests.get(endpoint + "?indexes=" + data, verify=False)
+        stats["mode"] = header["mode"]
+        stats["result_count"] = result_count
+
+        result = SearchResult(indexes, result_count, timings, stats)
+
+        if not result.found:
+            return result
+
+        start_time = time.time()
+
+        # The handle identifies the optimized dataset of this query on the server
+        handle: str = response.headers.get("X-Query-Handle", "")
+
+        self.fetch_entries(endpoint, result, handle, fields)
+
+        timings["fetch"] = time.time() - start_time
+
+        return result
+
+    def fetch_entries(
+        self, endpoint: str, result: SearchResult, handle: str, fields: list[str] | None = None
+    ) -> None:
+        """
+        This function requests the data of the found indexes from the server and stores
+        the decrypted entries on the result. The indexes travel in the body of a POST
+        request, so long lists of matches are not limited by the URL length. With
+        `fields` only the selected fields of the entries are returned.
+        """
+
+        data: str = json.dumps({"handle": handle, "indexes": result.indexes, "fields": fields})
+        response: requests.Response = self.session.post(
+            endpoint.rstrip("/") + "/fetch",
+            data=data,
+            headers={"Content-Type": JSON_CONTENT_TYPE},
+        )
+
+        result.stats["fetch_bytes"] = len(response.content)
+
+        # Rejected fetches, e.g. of an expired query handle
+        if response.status_code != 200:
+            raise ValueError(f"Server answered with status {response.status_code}: {response.text}")
+
+        # Load the response as dicitonary and decrypt it
+        result.entries = self.decrypt_response_result(json.loads(response.text))
+
+    def AES_encrypt(self, data: str) -> str:
+        encryptor = self.aes_cipher().encryptor()
+
+        return (encryptor.update(data.encode()) + encryptor.finalize()).hex()
+
+    def prepare_entries(self, records: list[dict]) -> list[dict]:
+        """
+        This function turns plain records with "name", "age", "gender", "medicines",
+        "side_effects" and "treatment" into entries in the format of `dataset.json`,
+        ready to be ingested by the server.
+        """
+
+        return [
+            {
+                "name": self.AES_encrypt(record["name"]),
+                "encrypted_m": self.prepare_m(record["gender"], record["age"]).to_string().hex(),
+                "age": record["age"],
+                "medicines": record["medicines"],
+                "side_effects": record["side_effects"],
+                "treatment": self.AES_encrypt(record["treatment"]),
+            }
+            for record in records
+        ]
+
+    def ingest(self, endpoint: str, change: dict, token: str) -> dict:
+        """
+        This function sends a change of the dataset (see `Database.ingest`) to the
+        ingest endpoint, authorized by the ingest `token` of the server, and returns
+        the answer of the server.
+        """
+
+        response: requests.Response = self.session.post(
+            endpoint,
+            data=json.dumps(change),
+            headers={"Content-Type": JSON_CONTENT_TYPE, "Authorization": f"Bearer {token}"},
+        )
+
+        result: dict = json.loads(response.text)
+
+        if response.status_code != 200:
+            raise ValueError(result["error"])
+
+        return result
+
+    def prepare_batch_query(self, patients: list[dict]) -> BatchQuery:
+        """
+        This function returns a query of many patients at once. Every patient is a dictionary
+        with "medicines", "side_effects", "age" and "gender". The `m` values of up to
+        `slot_count` patients are packed into the slots of one ciphertext.
+        """
+
+        slot_count = self.encoder.slot_count()
+
+        encrypted_ms: list[str] = []
+
+        for start in range(0, len(patients), slot_count):
+            m_values = [
+                self.compute_m(patient["gender"], patient["age"])
+                for patient in patients[start : start + slot_count]
+            ]
+
+            plain_ms: seal.Plaintext = self.encoder.encode(
+                m_values + [0] * (slot_count - len(m_values))
+            )
+            encrypted_ms.append(self.encryptor.encrypt(plain_ms).to_string().hex())
+
+        return BatchQuery(
+            [
+                {"medicines": patient["medicines"], "side_effects": patient["side_effects"]}
+                for patient in patients
+            ],
+            encrypted_ms,
+        )
+
+    def decrypt_batch_results(self, header: dict, ciphertexts: Iterable[bytes]) -> list[list[int]]:
+        """
+        This function decrypts the results of a batch query and returns the found indexes
+        of every patient, pointing into the optimized dataset of that patient.
+
+        A result ciphertext is shared by every patient of its group that has the entry
+        among its candidates, each of them reads its own slot.
+        """
+
+        slot_count = self.encoder.slot_count()
+        patients: list[dict] = header["patients"]
+
+        # Patients reading every result ciphertext, with the index of the result for them
+        readers: dict[int, list[tuple[int, int]]] = {}
+        for patient, patient_header in enumerate(patients):
+            for index, position in enumerate(patient_header["results"]):
+                readers.setdefault(position, []).append((patient, index))
+
+        block_slots = [
+            [patient % slot_count for patient, _ in readers[position]]
+            for position in range(len(readers))
+        ]
+
+        if self.decryption_pool is not None:
+            zeros = self.decryption_pool.find_zeros(ciphertexts, block_slots)
+        else:
+            zeros = self.decrypt_stream(ciphertexts, block_slots)
+
+        indexes: list[list[int]] = [[] for _ in patients]
+
+        for position, found in enumerate(zeros):
+            for reader in found:
+                patient, index = readers[position][reader]
+                indexes[patient].append(index)
+
+        return [sorted(patient_indexes) for patient_indexes in indexes]
+
+    def search_batch(
+        self,
+        endpoint: str,
+        batch: BatchQuery,
+        protocol: str = "json",
+        fields: list[str] | None = None,
+    ) -> list[SearchResult]:
+        """
+        This function sends a batch query to the batch endpoint and returns one
+        `SearchResult` per patient, in the order of the patients of the batch. The data
+        of the found entries is fetched patient by patient with the patient's handle.
+        """
+
+        timings: dict[str, float] = {}
+        stats: dict = {"patients": len(batch.patients)}
+
+        start_time = time.time()
+
+        content_type = BINARY_CONTENT_TYPE if protocol == "binary" else JSON_CONTENT_TYPE
+        data = batch.serialize_binary() if protocol == "binary" else batch.serialize()
+
+        stats["query_bytes"] = len(data)
+
+        response: requests.Response = self.session.post(
+            endpoint,
+            data=data,
+            headers={"Content-Type": content_type, "Accept": content_type},
+            stream=True,
+        )
+
+        # Rejected batches, e.g. above the query budget of the server
+        if response.status_code != 200:
+            raise ValueError(f"Server answered with status {response.status_code}: {response.text}")
+
+        if "X-Query-Plan" in response.headers:
+            stats["plan"] = json.loads(response.headers["X-Query-Plan"])
+
+        if response.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+            header, ciphertexts = decode_results_stream(response.iter_content(chunk_size=None))
+        else:
+            results: dict = decode_results_json(response.content)
+            header, ciphertexts = results, results["ciphertexts"]
+
+        timings["query"] = time.time() - start_time
+        start_time = time.time()
+
+        indexes = self.decrypt_batch_results(header, self.measure_results(ciphertexts, stats))
+
+        timings["decrypt"] = time.time() - start_time
+
+        print(
+            f"[i] Batch results decryption of {len(indexes)} patients completed after: {timings['decrypt']:.2f} seconds"
+        )
+
+        patient_results: list[SearchResult] = []
+
+        for patient_indexes, patient_header in zip(indexes, header["patients"]):
+            result = SearchResult(
+                patient_indexes, len(patient_header["results"]), dict(timings), dict(stats)
+            )
 
-        # Load the response as dicitonary, decrypt, then prepare for pretty print to the console
-        result = json.loads(response.text)
-        result = self.decrypt_response_result(result)
+            if result.found:
+                start_time = time.time()
+                self.fetch_entries(endpoint, result, patient_header["handle"], fields)
+                result.timings["fetch"] = time.time() - start_time
 
-        result_pretty = json.dumps(result, indent=4)
+            patient_results.append(result)
 
-        return result_pretty
+        return patient_results
@@ -0,0 +1,278 @@
+import mmap
+import json
+import struct
+import numpy as np
+
+from collections.abc import Mapping
+
+MAGIC = b"FHEDB001"
+
+# Column name -> numpy dtype, every column is stored as one contiguous little endian array
+COLUMNS = {
+    "ages": "<i2",
+    "medicines_offsets": "<i8",
+    "medicines_values": "<i4",
+    "side_effects_offsets": "<i8",
+    "side_effects_values": "<i4",
+    "names_offsets": "<i8",
+    "names": "u1",
+    "treatments_offsets": "<i8",
+    "treatments": "u1",
+    "ciphertexts_offsets": "<i8",
+    "ciphertexts": "u1",
+}
+
+ALIGNMENT = 8
+
+# Fields of a record, in the order of the JSON dataset without "encrypted_m"
+RECORD_FIELDS = ("name", "age", "medicines", "side_effects", "treatment")
+
+
+def pack_csr(lists: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function packs a list of int lists into a flat values array and an offsets array,
+    the values of list `i` are `values[offsets[i]:offsets[i + 1]]`.
+    """
+
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.fromiter((value for values in lists for value in values), dtype=np.int32)
+
+    return offsets, values
+
+
+def pack_blobs(blobs: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function concatenates byte strings into one blob with an offset table.
+    """
+
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+
+    return offsets, np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+
+def hex_to_bytes(value: str) -> bytes:
+    """
+    This function decodes a hex encoded field. Hand-made entries (e.g. the test entries
+    with name "test") are not hex encoded and are stored as their UTF-8 bytes instead.
+    """
+
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return value.encode()
+
+
+def build_columns(dataset: list[dict]) -> dict[str, np.ndarray]:
+    """
+    This function packs the entries of a JSON dataset into the columns of `COLUMNS`.
+    Ciphertexts are stored as raw SEAL serialized bytes, not as hex strings.
+    """
+
+    columns: dict[str, np.ndarray] = {"ages": np.array([int(e["age"]) for e in dataset], "<i2")}
+
+    columns["medicines_offsets"], columns["medicines_values"] = pack_csr(
+        [entry["medicines"] for entry in dataset]
+    )
+    columns["side_effects_offsets"], columns["side_effects_values"] = pack_csr(
+        [entry["side_effects"] for entry in dataset]
+    )
+    columns["names_offsets"], columns["names"] = pack_blobs(
+        [hex_to_bytes(entry["name"]) for entry in dataset]
+    )
+    columns["treatments_offsets"], columns["treatments"] = pack_blobs(
+        [hex_to_bytes(entry["treatment"]) for entry in dataset]
+    )
+    columns["ciphertexts_offsets"], columns["ciphertexts"] = pack_blobs(
+        [bytes.fromhex(entry["encrypted_m"]) for entry in dataset]
+    )
+
+    return {name: columns[name].astype(dtype, copy=False) for name, dtype in COLUMNS.items()}
+
+
+def write_columnar(dataset: list[dict], path: str) -> None:
+    """
+    This function writes the dataset in the binary columnar format. The file starts with
+    the magic, the length of a JSON header and the header itself. The header maps every
+    column to its offset, dtype and length. Columns follow, each aligned to 8 bytes.
+    """
+
+    write_columns(build_columns(dataset), len(dataset), path)
+
+
+def write_columns(columns: dict[str, np.ndarray], count: int, path: str) -> None:
+    """
+    This function writes columns of `count` entries in the binary columnar format,
+    see `write_columnar`.
+    """
+
+    # Lay out the columns after the header
+    header: dict = {"count": count, "columns": {}}
+    position = 0
+
+    for name, dtype in COLUMNS.items():
+        header["columns"][name] = [position, dtype, len(columns[name])]
+        position += -(-columns[name].nbytes // ALIGNMENT) * ALIGNMENT
+
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+
+        for name in COLUMNS:
+            f.seek(data_start + header["columns"][name][0])
+            f.write(columns[name].tobytes())
+
+        # Make sure the last column is padded to its full aligned size
+        f.truncate(data_start + position)
+
+
+class RecordView(Mapping):
+    __slots__ = ("dataset", "index")
+
+    def __init__(self, dataset: "ColumnarDataset", index: int) -> None:
+        """
+        Read-only entry of a `ColumnarDataset`. It behaves like the dict of the JSON dataset
+        (without "encrypted_m"), but holds only its position and decodes a field from the
+        columns when it is accessed.
+        """
+
+        self.dataset = dataset
+        self.index = index
+
+    def __getitem__(self, key: str):
+        if key == "name":
+            return self.dataset.blob("names", self.index).hex()
+        if key == "age":
+            return int(self.dataset.ages[self.dataset.start + self.index])
+        if key in ["medicines", "side_effects"]:
+            return self.dataset.csr(key, self.index)
+        if key == "treatment":
+            return self.dataset.blob("treatments", self.index).hex()
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def __len__(self) -> int:
+        return len(RECORD_FIELDS)
+
+
+class ColumnarDataset:
+    def __init__(self, path: str) -> None:
+        """
+        Read-only view of a dataset in the binary columnar format. The file is memory-mapped,
+        so ciphertexts are paged in only when a query touches them.
+        """
+
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a columnar dataset")
+
+        (header_length,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self.mm[header_start : header_start + header_length])
+
+        data_start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+
+        columns: dict[str, np.ndarray] = {}
+
+        for name, (offset, dtype, length) in header["columns"].items():
+            columns[name] = np.frombuffer(
+                self.mm, dtype=dtype, count=length, offset=data_start + offset
+            )
+
+        self.set_columns(columns, header["count"])
+
+    @classmethod
+    def from_records(cls, dataset: list[dict]) -> "ColumnarDataset":
+        """
+        This class method packs a JSON dataset into in-memory columns, e.g. right after
+        `dataset.json` was loaded. A handful of arrays replace a dict, hex strings and
+        int lists per entry.
+        """
+
+        columnar = cls.__new__(cls)
+        columnar.path = None
+        columnar.file = None
+        columnar.mm = None
+
+        columnar.set_columns(build_columns(dataset), len(dataset))
+
+        return columnar
+
+    def set_columns(self, columns: dict[str, np.ndarray], count: int) -> None:
+        self.count = count
+        self.columns = columns
+
+        self.ages = self.columns["ages"]
+
+        # Position of the first entry, see `select`
+        self.start = 0
+
+    def select(self, start: int, stop: int) -> None:
+        """
+        This function restricts the view to the entries from `start` to `stop`, which are
+        then addressed from 0. Pages of the other entries are never touched.
+        """
+
+        self.start += start
+        self.count = stop - start
+
+    def csr_columns(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        This function returns the offsets and values of a CSR column for the selected
+        entries, with the offsets rebased to the values.
+        """
+
+        offsets = self.columns[f"{name}_offsets"][self.start : self.start + self.count + 1]
+
+        return offsets - offsets[0], self.columns[f"{name}_values"][offsets[0] : offsets[-1]]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> RecordView:
+        if not 0 <= index < self.count:
+            raise IndexError(f"Dataset position {index} out of range")
+
+        return RecordView(self, index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield RecordView(self, index)
+
+    def csr(self, name: str, index: int) -> list[int]:
+        offsets = self.columns[f"{name}_offsets"]
+        index += self.start
+
+        return self.columns[f"{name}_values"][offsets[index] : offsets[index + 1]].tolist()
+
+    def blob(self, name: str, index: int) -> bytes:
+        offsets = self.columns[f"{name}_offsets"]
+        index += self.start
+
+        return self.columns[name][offsets[index] : offsets[index + 1]].tobytes()
+
+    def key(self, index: int) -> int:
+        """
+        This function returns the key of the entry's ciphertext in the `CiphertextStore`.
+        Entries of a columnar dataset never change, so the position is enough.
+        """
+
+        return index
+
+    def ciphertext(self, index: int) -> bytes:
+        """
+        This function returns the raw serialized ciphertext of the entry.
+        """
+
+        return self.blob("ciphertexts", index)
@@ -1,22 +1,50 @@
+import os
 import time
 import json
 import seal
+import contextlib
 import random
+import functools
+import threading
+import numpy as np
 
+from typing import Callable, Iterator
+from classes.batch_query import BatchQuery
+from classes.cipher_store import CiphertextStore
+from classes.columnar import ColumnarDataset
+from classes.filter_cache import FilterCache
+from classes.index import InvertedIndex
+from classes.metrics import Metrics
+from classes.overlay import DatasetOverlay, DatasetSnapshot
+from classes.noise import MIN_REMAINING_BITS, match_depth, remaining_budget, switch_target
+from classes.parallel import ParallelEvaluator
+from classes.parameters import create_context, load_parameters
+from classes.plain_cache import MaskPool, PlaintextCache
+from classes.planner import QueryPlan, QueryPlanner
 from classes.query import Query
 
 
-class Database:
-    def __init__(self):
-        # initialize BFV scheme parameters
-        params = seal.EncryptionParameters(seal.scheme_type.bfv)
+# Changes applied by `Database.ingest` since the dataset files were written, one JSON per line
+JOURNAL_FILE = "dataset.journal"
+
+
+def is_int(value) -> bool:
+    # JSON booleans are parsed as bools, which are ints to Python
+    return isinstance(value, int) and not isinstance(value, bool)
 
-        poly_modulus_degree = 8192
-        params.set_poly_modulus_degree(poly_modulus_degree)
-        params.set_coeff_modulus(seal.CoeffModulus.BFVDefault(poly_modulus_degree))
-        params.set_plain_modulus(seal.PlainModulus.Batching(poly_modulus_degree, 20))
 
-        self.context = seal.SEALContext(params)
+class Database:
+    def __init__(
+        self,
+        cache_budget: int = 1024**3,
+        metrics: Metrics | None = None,
+        shard: tuple[int, int] | None = None,
+        query_budget: float | None = None,
+    ):
+        # initialize BFV scheme parameters, planned by `plan_parameters.py` if there is a parameter file
+        parameters = load_parameters()
+
+        self.context = create_context(parameters)
 
         # initilize encoder that is used for encoding list of ints to `seal.Plaintext` and then decoding vice versa
         self.encoder = seal.BatchEncoder(self.context)
@@ -24,33 +52,508 @@ class Database:
         # initialize evaluator that is used for evaluating operations on `seal.Ciphertext`
         self.evaluator = seal.Evaluator(self.context)
 
-        self.random_dataset = []
-        self.optimized_dataset = []
+        # Entries, their medicine and side effect posting lists used by the plaintext
+        # pre-filter and the column-wise packed `m` values, replaced as a whole by
+        # `load_dataset` and `ingest`
+        self.snapshot = DatasetSnapshot(ColumnarDataset.from_records([]), InvertedIndex())
+
+        # Candidates of repeated medicine and side effect sets, tied to the current index
+        self.filters = FilterCache()
+
+        # Each packed block holds the `m` values of `slot_count` consecutive entries
+        self.slot_count = self.encoder.slot_count()
+        self.plain_modulus = self.context.first_context_data().parms().plain_modulus().value()
+
+        # Relinearization keys are large, they are loaded by the first multiplication
+        self.loaded_relin_keys: seal.RelinKeys | None = None
+
+        # Shift offsets of the match polynomial, encoded once
+        self.plaintexts = PlaintextCache()
+
+        # Random slot pads, drawn ahead on a background thread
+        self.pads: MaskPool[list[int]] = MaskPool(self.random_pad)
+
+        # Per-phase timings and sizes of the queries
+        self.metrics = metrics or Metrics()
+
+        # Deserialized entry ciphertexts, kept across queries within `cache_budget` bytes
+        self.ciphertexts = CiphertextStore(self.context, cache_budget, self.metrics)
+
+        # Age radius of the match polynomial
+        self.radius = parameters["radius"]
+
+        # Evaluate the match polynomial as a balanced product tree instead of a serial chain
+        self.product_tree = True
+
+        self.check_noise_budget()
+
+        # Switch results down the modulus chain as far as the noise budget allows
+        self.mod_switch = True
+
+        # Process pool for the parallel search mode, see `enable_parallel`
+        self.parallel: ParallelEvaluator | None = None
+        self.parallel_threshold = 64
+        self.cache_budget = cache_budget
+
+        # Queries between planning and their last result, see `evaluating`
+        self.running_queries = 0
+        self.running_lock = threading.Lock()
+
+        # Serializes the changes of `ingest`, queries never wait for it
+        self.ingest_lock = threading.Lock()
+
+        # Shard (index, count) of the dataset served by this database, see `shard_range`
+        self.shard = shard
+        self.shard_start = 0
+        self.journal_file = JOURNAL_FILE
+
+        if shard is not None:
+            self.journal_file = f"dataset.{shard[0]}-of-{shard[1]}.journal"
+
+        # Chooses the evaluation strategy of every query and enforces the `query_budget`
+        parms = self.context.first_context_data().parms()
+        result_bytes = 2 * parms.poly_modulus_degree() * len(parms.coeff_modulus()) * 8
+        self.planner = QueryPlanner(result_bytes, query_budget)
 
-        self.relin_keys = seal.RelinKeys()
-        self.relin_keys.load(self.context, "relin_keys.bin")
+    @property
+    def relin_keys(self) -> seal.RelinKeys:
+        if self.loaded_relin_keys is None:
+            relin_keys = seal.RelinKeys()
+            relin_keys.load(self.context, "relin_keys.bin")
+
+            self.loaded_relin_keys = relin_keys
+
+        return self.loaded_relin_keys
 
     def load_dataset(self) -> None:
-        print("[i] Loading dataset from a file: dataset.json")
+        if os.path.exists("dataset.bin"):
+            dataset = self.load_columnar_dataset()
+        else:
+            print("[i] Loading dataset from a file: dataset.json")
+
+            # Load dataset from file
+            with open("dataset.json", "r") as f:
+                content = "".join(f.readlines())
+
+            records: list[dict] = json.loads(content)
+
+            # Only the shard's range is packed
+            if self.shard is not None:
+                start, stop = self.shard_range(len(records))
+                records = records[start:stop]
+
+            # Packed into columns, the dicts of the entries are dropped right away
+            dataset = ColumnarDataset.from_records(records)
+
+        packed: dict | None = None
+
+        # Packed blocks can only be used by shards that start on a block boundary
+        if os.path.exists("packed_dataset.json") and self.shard_start % self.slot_count == 0:
+            packed = self.load_packed_dataset()
+
+        self.publish_dataset(dataset, packed)
+
+        if os.path.exists(self.journal_file):
+            self.replay_journal()
+
+    def shard_range(self, count: int) -> tuple[int, int]:
+        """
+        This function returns the range of dataset positions served by the shard. Shards
+        get consecutive ranges of whole packed blocks, so every shard evaluates its own
+        blocks. Datasets with fewer blocks than shards are split entry by entry instead,
+        and the shards evaluate every entry on its own.
+        """
+
+        shard, shards = self.shard
+
+        unit = self.slot_count if os.path.exists("packed_dataset.json") else 1
+        if count < unit * shards:
+            unit = 1
+
+        size = -(-count // unit // shards) * unit
+
+        self.shard_start = min(count, shard * size)
+        stop = min(count, self.shard_start + size)
+
+        print(f"[i] Serving shard {shard + 1} of {shards}: entries {self.shard_start} to {stop}")
+
+        return self.shard_start, stop
+
+    def load_columnar_dataset(self) -> ColumnarDataset:
+        """
+        This function memory-maps the binary columnar dataset (see `convert_dataset.py`).
+        Entries are materialized only when accessed and ciphertexts are read straight
+        from the mapping on a cache miss.
+        """
 
-        # Load dataset from file
-        with open("dataset.json", "r") as f:
-            content = "".join(f.readlines())
-            self.random_dataset = json.loads(content)
+        print("[i] Loading dataset from a file: dataset.bin")
 
-    def optimize_dataset(self, query) -> None:
+        dataset = ColumnarDataset("dataset.bin")
+
+        if self.shard is not None:
+            dataset.select(*self.shard_range(len(dataset)))
+
+        return dataset
+
+    def load_packed_dataset(self) -> dict:
+        """
+        This function loads the slot-packed representation of the dataset. Every block
+        is a single ciphertext holding the `m` values of `slot_count` consecutive entries,
+        one entry per batching slot.
+        """
+
+        print("[i] Loading packed dataset from a file: packed_dataset.json")
+
+        with open("packed_dataset.json", "r") as f:
+            return json.load(f)
+
+    def load_records(self, dataset: list[dict], packed: dict | None = None) -> None:
+        """
+        This function loads a dataset that is already in memory, in the format of
+        `dataset.json` (and `packed_dataset.json` for `packed`), e.g. one generated
+        by the benchmark.
+        """
+
+        self.publish_dataset(ColumnarDataset.from_records(dataset), packed)
+
+    def publish_dataset(self, dataset: ColumnarDataset, packed: dict | None = None) -> None:
+        """
+        This function indexes a freshly loaded dataset and replaces the snapshot with it,
+        along with the blocks of `packed` (in the format of `packed_dataset.json`).
+        """
+
+        packed_blocks = self.load_packed_blocks(packed, len(dataset)) if packed else []
+
+        self.ciphertexts.clear()
+        self.snapshot = DatasetSnapshot(
+            dataset, InvertedIndex.build_columnar(dataset), packed_blocks
+        )
+
+        # Workers map the dataset they were started with
+        if self.parallel is not None:
+            self.restart_parallel()
+
+    def load_packed_blocks(self, packed: dict, count: int) -> list[seal.Ciphertext]:
+        if packed["slot_count"] != self.slot_count:
+            print("[x] Packed dataset does not match the encryption parameters, ignoring it")
+            return []
+
+        blocks: list[str] = packed["blocks"]
+
+        # Blocks of the shard's range of `count` entries
+        if self.shard is not None:
+            first = self.shard_start // self.slot_count
+            blocks = blocks[first : first + -(-count // self.slot_count)]
+
+        return [self.context.from_cipher_str(bytes.fromhex(block)) for block in blocks]
+
+    def enable_parallel(self, workers: int | None = None) -> None:
+        """
+        This function switches the search to the parallel mode. Optimized datasets with at
+        least `parallel_threshold` entries are split into chunks and evaluated in a process
+        pool, and so is every query planned while others are running, see `plan_query`.
+        Smaller queries of an otherwise idle server are still evaluated inline.
+        """
+
+        self.parallel = ParallelEvaluator(
+            self.base_dataset(), workers, cache_budget=self.cache_budget
+        )
+
+        print(f"[i] Parallel search enabled with {self.parallel.workers} workers")
+
+    def entry_ciphertext(
+        self, dataset: ColumnarDataset | DatasetOverlay, index: int
+    ) -> seal.Ciphertext:
+        """
+        This function returns the ciphertext of the entry on the supplied position of
+        `dataset`, deserialized by the ciphertext cache on the first use.
+        """
+
+        return self.ciphertexts.get(
+            dataset.key(index), functools.partial(dataset.ciphertext, index)
+        )
+
+    def replay_journal(self) -> None:
+        print(f"[i] Replaying dataset changes from a file: {self.journal_file}")
+
+        with open(self.journal_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    self.ingest(json.loads(line), journal=False)
+
+    def ingest(self, change: dict, journal: bool = True) -> list[int]:
+        """
+        This function applies a change of the dataset without reloading it. The change
+        holds any of "append" (list of entries in the format of `dataset.json`), "update"
+        (list of {"index", "entry"}), "delete" (list of positions) and "packed_blocks"
+        ({block: hex ciphertext} re-encrypted by the data owner).
+
+        Positions never move, appended entries get the next free positions and deleted
+        ones are left empty, so handles of earlier queries keep pointing to the same
+        entries. The change is applied to copies of the dataset, the index and the packed
+        blocks, which are published as a new snapshot at once. Queries that already
+        filtered keep evaluating and fetching the snapshot they got.
+
+        Packed blocks with a changed `m` cannot be re-encrypted here, their candidates are
+        evaluated one by one until the data owner sends a fresh block.
+
+        With `journal` the change is appended to the journal file, which is replayed
+        by `load_dataset`. The function returns the positions of the appended entries.
+        """
+
+        appended, updated, deleted = self.check_change(change)
+
+        with self.ingest_lock:
+            snapshot = self.snapshot
+
+            if isinstance(snapshot.dataset, DatasetOverlay):
+                dataset = snapshot.dataset.copy()
+            else:
+                dataset = DatasetOverlay(snapshot.dataset)
+
+            for index in [update["index"] for update in updated] + deleted:
+                if not 0 <= index < len(dataset):
+                    raise IndexError(f"Dataset position {index} out of range")
+
+            blocks = self.parse_packed_blocks(
+                change.get("packed_blocks", {}), len(snapshot.packed_blocks)
+            )
+
+            removed: list[tuple[int, dict]] = []
+            added: list[tuple[int, dict]] = []
+            changed: set[int] = set()
+
+            for update in updated:
+                index = update["index"]
+
+                if dataset[index] is not None:
+                    removed.append((index, dataset[index]))
+
+                dataset.set(index, update["entry"])
+                added.append((index, update["entry"]))
+                changed.add(index)
+
+            for index in deleted:
+                if dataset[index] is not None:
+                    removed.append((index, dataset[index]))
+
+                dataset.set(index, None)
+                changed.add(index)
+
+            positions = [dataset.append(entry) for entry in appended]
+            added.extend(zip(positions, appended))
+
+            packed_blocks, stale_blocks = self.update_packed_blocks(
+                snapshot, changed | set(positions), deleted, blocks
+            )
+
+            index = snapshot.index.updated(removed, added)
+
+            # Journaled only once the change applied, a journal that fails to replay
+            # would keep the server from starting
+            if journal:
+                with open(self.journal_file, "a") as f:
+                    f.write(json.dumps(change) + "\n")
+
+            self.snapshot = DatasetSnapshot(dataset, index, packed_blocks, stale_blocks)
+
+            # New queries never read the replaced ciphertexts, queries of the previous
+            # snapshot deserialize them again if they were evicted
+            for index in changed:
+                self.ciphertexts.discard(snapshot.dataset.key(index))
+
+        print(
+            f"[i] Ingested {len(appended)} appended, {len(updated)} updated "
+            f"and {len(deleted)} deleted entries"
+        )
+
+        return positions
+
+    def check_change(self, change: dict) -> tuple[list[dict], list[dict], list[int]]:
+        """
+        This function validates a change of `ingest` before it is applied and returns its
+        appended entries, updates and deleted positions. Every entry needs lists of
+        medicine and side effect IDs and a ciphertext of the server's parameters, a
+        broken entry would only fail later in the queries that evaluate it.
+        """
+
+        if not isinstance(change, dict):
+            raise ValueError("Change must be a JSON object")
+
+        appended = change.get("append", [])
+        updated = change.get("update", [])
+        deleted = change.get("delete", [])
+
+        for key, value in [("append", appended), ("update", updated), ("delete", deleted)]:
+            if not isinstance(value, list):
+                raise ValueError(f"Field {key} must be a list")
+
+        for update in updated:
+            if not isinstance(update, dict) or not is_int(update.get("index")):
+                raise ValueError("Update must be an object with an integer index and an entry")
+
+        if not all(is_int(index) for index in deleted):
+            raise ValueError("Deleted positions must be integers")
+
+        for entry in appended + [update.get("entry") for update in updated]:
+            if not isinstance(entry, dict):
+                raise ValueError("Entry must be a JSON object")
+
+            for key in ["encrypted_m", "medicines", "side_effects"]:
+                if key not in entry:
+                    raise ValueError(f"Entry is missing the field: {key}")
+
+            for key in ["medicines", "side_effects"]:
+                if not isinstance(entry[key], list) or not all(is_int(i) for i in entry[key]):
+                    raise ValueError(f"Field {key} must be a list of integers")
+
+            if "age" in entry and not is_int(entry["age"]):
+                raise ValueError("Field age must be an integer")
+
+            if not isinstance(entry["encrypted_m"], str):
+                raise ValueError("Field encrypted_m must be a hex encoded ciphertext")
+
+            try:
+                self.context.from_cipher_str(bytes.fromhex(entry["encrypted_m"]))
+            except (ValueError, RuntimeError) as e:
+                raise ValueError(f"Field encrypted_m is not a valid ciphertext: {e}") from e
+
+        return appended, updated, deleted
+
+    def parse_packed_blocks(
+        self, blocks: dict[str, str], block_count: int
+    ) -> dict[int, seal.Ciphertext]:
+        parsed: dict[int, seal.Ciphertext] = {}
+
+        for block, serialized in sorted(blocks.items(), key=lambda item: int(item[0])):
+            block = int(block)
+
+            if block > block_count + len(parsed):
+                raise ValueError(f"Packed block {block} does not follow the last block")
+
+            parsed[block] = self.context.from_cipher_str(bytes.fromhex(serialized))
+
+        return parsed
+
+    def update_packed_blocks(
+        self,
+        snapshot: DatasetSnapshot,
+        changed: set[int],
+        deleted: list[int],
+        blocks: dict[int, seal.Ciphertext],
+    ) -> tuple[list[seal.Ciphertext], frozenset[int]]:
+        """
+        This function returns the packed blocks of the snapshot with the blocks supplied
+        by the data owner replaced, along with the blocks that are stale because their
+        entries changed. A deleted entry is never a candidate again, so it alone does
+        not make its block stale. The blocks of the snapshot are left unchanged.
+        """
+
+        if not snapshot.packed_blocks:
+            return snapshot.packed_blocks, snapshot.stale_blocks
+
+        packed_blocks = list(snapshot.packed_blocks)
+
+        stale = set(snapshot.stale_blocks)
+        stale.update(index // self.slot_count for index in changed if index not in deleted)
+
+        for block, ciphertext in blocks.items():
+            if block == len(packed_blocks):
+                packed_blocks.append(ciphertext)
+            else:
+                packed_blocks[block] = ciphertext
+
+            stale.discard(block)
+
+        return packed_blocks, frozenset(stale)
+
+    def restart_parallel(self) -> None:
+        """
+        This function replaces the process pool with one that maps a freshly loaded
+        dataset. Running evaluations finish on the old pool, which is shut down in the
+        background. Ingested changes do not need a new pool, see `parallel_overrides`.
+        """
+
+        old = self.parallel
+        self.parallel = ParallelEvaluator(
+            self.base_dataset(), old.workers, cache_budget=self.cache_budget
+        )
+
+        threading.Thread(target=old.shutdown, daemon=True).start()
+
+    def base_dataset(self) -> ColumnarDataset:
+        """
+        This function returns the dataset as it was loaded, without the ingested changes.
+        """
+
+        dataset = self.snapshot.dataset
+
+        return dataset.base if isinstance(dataset, DatasetOverlay) else dataset
+
+    def parallel_overrides(
+        self, snapshot: DatasetSnapshot, candidates: np.ndarray
+    ) -> dict[int, bytes]:
+        """
+        This function returns the serialized ciphertexts of the candidates that changed
+        since the dataset was loaded. Workers only map the loaded dataset, so these are
+        sent along with the chunks.
+        """
+
+        dataset = snapshot.dataset
+
+        if not isinstance(dataset, DatasetOverlay):
+            return {}
+
+        return {
+            index: dataset.ciphertext(index)
+            for index in candidates.tolist()
+            if dataset.overlaid(index)
+        }
+
+    def evaluation_settings(self) -> dict:
+        """
+        This function returns the settings of the match polynomial, which the workers
+        of the parallel mode apply to every chunk.
+        """
+
+        return {
+            "radius": self.radius,
+            "product_tree": self.product_tree,
+            "mod_switch": self.mod_switch,
+        }
+
+    def optimize_dataset(self, query, snapshot: DatasetSnapshot | None = None) -> np.ndarray:
         """
         This function takes the user supplied query and uses non-FHE parameters
         (list of medicines and side effects) to filter the randomly generated dataset.
         This enusres that the exhaustive FHE operations are performed on a smaller
         sample lowering computing and memory complexity.
+
+        The filter is answered from the inverted index, as the intersection of the union
+        of the medicine posting lists and the union of the side effect posting lists.
+        Results of repeated sets of IDs come from `filters`.
+
+        The function returns the sorted dataset positions of the optimized dataset as an
+        array and keeps no state, so concurrent queries never see each other's candidates.
+        The positions belong to `snapshot`, the current one by default, which the query
+        is then evaluated and fetched from.
         """
 
-        # Check if there is at least on medicine and side effect in the optimized dataset
-        for entry in self.random_dataset:
-            if any(medicine in entry["medicines"] for medicine in query.medicines):
-                if any(effect in entry["side_effects"] for effect in query.side_effects):
-                    self.optimized_dataset.append(entry)
+        return self.filter_candidates(query.medicines, query.side_effects, snapshot)
+
+    def filter_candidates(
+        self, medicines: list[int], side_effects: list[int], snapshot: DatasetSnapshot | None = None
+    ) -> np.ndarray:
+        snapshot = snapshot or self.snapshot
+
+        # Positions of entries with at least one medicine and side effect from the query,
+        # kept as the read-only array of the filter cache
+        with self.metrics.phase("filter"):
+            candidates = self.filters.filter(snapshot.index, medicines, side_effects)
+
+        self.metrics.observe("candidates", len(candidates))
+
+        return candidates
 
     def prepare_ciphertexts(self, query: Query, radius: int) -> list[seal.Ciphertext]:
         """
@@ -58,10 +561,10 @@ class Database:
         that represent the users age from range +- radius
         """
 
-        ciphertext = self.context.from_cipher_str(bytes.fromhex(query.encrypted_m))
+        ciphertext = query.ciphertext(self.context)
 
         ciphertexts: list[seal.Ciphertext] = []
-        plain_one = seal.Plaintext("1")
+        plain_one = self.plaintexts.constant(1)
 
         new_ciphertext = ciphertext
 
@@ -80,7 +583,7 @@ class Database:
 
         return ciphertexts
 
-    def FHE_difference(self, query: Query, entry: dict) -> seal.Ciphertext:
+    def FHE_difference(self, query: Query, index: int) -> seal.Ciphertext:
         """
         This function performs the FHE subtraction on the user supplied ciphertext in the query.
         More precisely, the function subtracts encrypted 'm' parameter from a database entry
@@ -88,8 +591,8 @@ class Database:
         ciphertexts.
         """
 
-        query_m = self.context.from_cipher_str(bytes.fromhex(query.encrypted_m))
-        entry_m = self.context.from_cipher_str(bytes.fromhex(entry["encrypted_m"]))
+        query_m = query.ciphertext(self.context)
+        entry_m = self.entry_ciphertext(self.snapshot.dataset, index)
 
         diff = self.evaluator.sub(query_m, entry_m)
 
@@ -99,10 +602,14 @@ class Database:
 
         return result
 
-    def FHE_difference_radius(
-        self, ciphertexts: list[seal.Ciphertext], entry: dict
+    def radius_product(
+        self, ciphertexts: list[seal.Ciphertext], entry_m: seal.Ciphertext
     ) -> seal.Ciphertext:
-        entry_m = self.context.from_cipher_str(bytes.fromhex(entry["encrypted_m"]))
+        """
+        This function subtracts `entry_m` from every ciphertext of the radius and multiplies
+        the differences together. The product is zero in every slot where the entry lies
+        within the radius.
+        """
 
         diffs: list[seal.Ciphertext] = []
 
@@ -119,49 +626,668 @@ class Database:
 
         return result
 
-    def search(self, query: Query) -> list[str]:
+    def FHE_difference_radius_tree(
+        self, query_m: seal.Ciphertext, entry_m: seal.Ciphertext, radius: int
+    ) -> seal.Ciphertext:
+        """
+        This function evaluates the same match polynomial as `radius_product`, but the
+        difference is computed only once and the shifted factors are derived from it with
+        plaintext additions. The factors are then multiplied in a balanced tree, which
+        lowers the multiplicative depth from 2*radius to ceil(log2(2*radius + 1)).
+
+        The offset plaintexts come from `plaintexts`, so an entry costs one ciphertext
+        subtraction and 2*radius plaintext additions before the product tree.
+        """
+
+        diff = self.evaluator.sub(query_m, entry_m)
+
+        factors: list[seal.Ciphertext] = [diff]
+
+        for offset in range(1, radius + 1):
+            plain_offset = self.plaintexts.constant(offset)
+
+            factors.append(self.evaluator.sub_plain(diff, plain_offset))
+            factors.append(self.evaluator.add_plain(diff, plain_offset))
+
+        return self.product_tree_multiply(factors)
+
+    def product_tree_multiply(self, factors: list[seal.Ciphertext]) -> seal.Ciphertext:
+        """
+        This function multiplies the ciphertexts pairwise, level by level, and relinearizes
+        every product so the result stays a two-polynomial ciphertext.
+        """
+
+        while len(factors) > 1:
+            level: list[seal.Ciphertext] = []
+
+            for i in range(0, len(factors) - 1, 2):
+                product = self.evaluator.multiply(factors[i], factors[i + 1])
+                self.evaluator.relinearize_inplace(product, self.relin_keys)
+                level.append(product)
+
+            # Odd factor is carried over to the next level as is
+            if len(factors) % 2 == 1:
+                level.append(factors[-1])
+
+            factors = level
+
+        return factors[0]
+
+    def check_noise_budget(self) -> None:
+        """
+        This function warns when the estimated noise budget does not cover the depth
+        of the match polynomial, in which case the client would decrypt garbage.
+        """
+
+        depth = match_depth(self.radius, self.product_tree)
+        budget = remaining_budget(self.context, depth)
+
+        if budget < MIN_REMAINING_BITS:
+            print(
+                f"[x] Radius {self.radius} needs multiplicative depth {depth}, the estimated noise "
+                f"budget left is {budget:.0f} bits. Plan new parameters with plan_parameters.py"
+            )
+
+    def result_level(self):
+        """
+        This function returns the `parms_id` results of the current match polynomial can be
+        switched to before they are sent, or None when switching is disabled or the
+        estimated noise budget leaves no headroom for it.
+        """
+
+        if not self.mod_switch:
+            return None
+
+        depth = match_depth(self.radius, self.product_tree)
+        target = switch_target(self.context, depth)
+
+        if target is None:
+            print(
+                f"[x] Estimated noise budget after depth {depth} is "
+                f"{remaining_budget(self.context, depth):.0f} bits, results are not mod switched"
+            )
+
+        return target
+
+    def finalize_result(self, result: seal.Ciphertext, level) -> bytes:
+        """
+        This function drops the unneeded primes of the result and serializes it. Both the
+        response size and the client's decryption cost scale with the number of primes.
+        """
+
+        if level is not None:
+            self.evaluator.mod_switch_to_inplace(result, level)
+
+        return result.to_string()
+
+    def prepare_evaluation(self, query: Query) -> Callable[[seal.Ciphertext], seal.Ciphertext]:
+        """
+        This function prepares the query side of the match polynomial and returns
+        a function that evaluates it against an encrypted `m` of an entry or a block.
+        """
+
+        if self.product_tree:
+            # Deserialized once and shared by every candidate
+            query_m = query.ciphertext(self.context)
+
+            return functools.partial(self.FHE_difference_radius_tree, query_m, radius=self.radius)
+
+        # Shifted query ciphertexts of the serial chain, computed once per query
+        ciphertexts_radius: list[seal.Ciphertext] = self.prepare_ciphertexts(query, self.radius)
+
+        return functools.partial(self.radius_product, ciphertexts_radius)
+
+    def FHE_difference_radius_packed(
+        self,
+        evaluate: Callable[[seal.Ciphertext], seal.Ciphertext],
+        block: seal.Ciphertext,
+        slots: list[int],
+    ) -> seal.Ciphertext:
+        """
+        This function evaluates the radius polynomial on a whole packed block at once.
+        Slots that do not belong to the optimized dataset are overwritten with random
+        values, so the client learns nothing about entries that were filtered out.
+        """
+
+        result = evaluate(block)
+
+        self.pad_slots(result, slots)
+
+        return result
+
+    def pad_slots(self, result: seal.Ciphertext, slots: list[int]) -> None:
+        """
+        This function keeps the supplied slots of the result and overwrites every other
+        slot with a uniformly random value (0 is added to the kept slots).
+        """
+
+        pad = self.pads.take()
+
+        for slot in slots:
+            pad[slot] = 0
+
+        # The kept slots differ per block, so the pad can only be encoded here
+        self.evaluator.add_plain_inplace(result, self.encoder.encode(pad))
+
+    def random_pad(self) -> list[int]:
+        # A generator per pad, so the pool thread and inline fallbacks share no state
+        return np.random.default_rng().integers(0, self.plain_modulus, self.slot_count).tolist()
+
+    @contextlib.contextmanager
+    def evaluating(self) -> Iterator[None]:
+        """
+        This context covers a query from its planning to its last result. The SEAL bindings
+        hold the GIL, so queries evaluated inline at the same time share one core.
+        """
+
+        with self.running_lock:
+            self.running_queries += 1
+
+        try:
+            yield
+        finally:
+            with self.running_lock:
+                self.running_queries -= 1
+
+    def plan_query(
+        self, query: Query, candidates: np.ndarray, snapshot: DatasetSnapshot | None = None
+    ) -> QueryPlan:
+        """
+        This function plans the evaluation of the query against its optimized dataset,
+        see `QueryPlanner.plan`. It raises `BudgetExceeded` when even the cheapest
+        strategy is predicted to take longer than the query budget.
+
+        While other queries are running (see `evaluating`), the inline evaluation would
+        compete with them for the GIL, so queries of any size go to the process pool.
+        """
+
+        snapshot = snapshot or self.snapshot
+
+        blocks: int | None = None
+        if snapshot.packed_blocks:
+            blocks = len(self.packed_groups(candidates, snapshot))
+
+        with self.running_lock:
+            concurrent = self.running_queries > 1
+
+        workers: int | None = None
+        if self.parallel is not None and (
+            concurrent or len(candidates) >= self.parallel_threshold
+        ):
+            workers = self.parallel.workers
+
+        estimated_candidates = self.planner.estimate_candidates(
+            snapshot.index, len(snapshot.dataset), query.medicines, query.side_effects
+        )
+
+        plan = self.planner.plan(
+            query.mode, len(candidates), estimated_candidates, blocks, workers, concurrent
+        )
+
+        self.metrics.increment(f"plan_{plan.strategy}")
+
+        print(
+            f"[i] Planned {plan.strategy} evaluation of {plan.candidates} candidates, "
+            f"{plan.results} results in an estimated {plan.seconds:.2f} seconds"
+        )
+
+        return plan
+
+    def search(self, query: Query, candidates: np.ndarray | None = None) -> dict:
         """
         This is the main search function. Function takes the user supplied query and returns
         an array of ouputs of FHE opereations. These outputs represent whether to query
         actually got a result back on a specific index (computed on the client side).
+
+        The outputs are returned as raw serialized ciphertexts under "ciphertexts", the
+        encoding for the wire is left to the server (see `classes.wire`).
+
+        The optimized dataset can be supplied as `candidates`, otherwise it is computed
+        from the query.
+        """
+
+        header, ciphertexts = self.search_iter(query, candidates)
+
+        return {**header, "ciphertexts": list(ciphertexts)}
+
+    def search_iter(
+        self,
+        query: Query,
+        candidates: np.ndarray | None = None,
+        plan: QueryPlan | None = None,
+        snapshot: DatasetSnapshot | None = None,
+    ) -> tuple[dict, Iterator[bytes]]:
+        """
+        This is the streaming variant of `search`. The function returns the result header
+        (mode and, for packed results, the slots of every block) right away, together with
+        a generator that yields every serialized ciphertext as soon as it is computed.
+
+        The query is evaluated as decided by `plan`, which is made by `plan_query`
+        unless the caller already planned it. Supplied `candidates` must come from
+        the same `snapshot` (the current one by default).
         """
 
-        self.optimize_dataset(query)
-        ciphertexts_radius: list[seal.Ciphertext] = self.prepare_ciphertexts(query, 2)
+        snapshot = snapshot or self.snapshot
+
+        if candidates is None:
+            candidates = self.optimize_dataset(query, snapshot)
+
+        if plan is None:
+            plan = self.plan_query(query, candidates, snapshot)
+
+        with self.metrics.phase("radius_preparation"):
+            evaluate = self.prepare_evaluation(query)
 
-        results: list[str] = []
+        if plan.strategy == "packed":
+            return self.search_packed(evaluate, candidates, snapshot)
 
+        return {"mode": "entry"}, self.evaluate_entries(
+            query, evaluate, candidates, snapshot, plan.strategy == "parallel"
+        )
+
+    def evaluate_entries(
+        self,
+        query: Query,
+        evaluate: Callable[[seal.Ciphertext], seal.Ciphertext],
+        candidates: np.ndarray,
+        snapshot: DatasetSnapshot,
+        parallel: bool = False,
+    ) -> Iterator[bytes]:
         start_time = time.time()
 
-        for entry in self.optimized_dataset:
-            # result: seal.Ciphertext = self.FHE_difference(query, entry)
-            result: seal.Ciphertext = self.FHE_difference_radius(ciphertexts_radius, entry)
-            results.append(result.to_string().hex())
+        # Per-query totals, the time spent by the consumer between results is not included
+        evaluation_time = 0.0
+        serialization_time = 0.0
+        response_bytes = 0
+
+        if parallel:
+            results = self.parallel.evaluate_iter(
+                query,
+                self.evaluation_settings(),
+                candidates,
+                self.parallel_overrides(snapshot, candidates),
+            )
+
+            for serialized in results:
+                self.metrics.observe("result_bytes", len(serialized))
+                response_bytes += len(serialized)
+                yield serialized
+        else:
+            level = self.result_level()
+
+            for index in candidates:
+                phase_start = time.perf_counter()
+
+                # result: seal.Ciphertext = self.FHE_difference(query, index)
+                entry_m = self.entry_ciphertext(snapshot.dataset, index)
+                result: seal.Ciphertext = evaluate(entry_m)
 
-            # for res in result:
-            #     results.append(res.to_string().hex())
+                serialize_start = time.perf_counter()
+                serialized = self.finalize_result(result, level)
+
+                evaluation_time += serialize_start - phase_start
+                serialization_time += time.perf_counter() - serialize_start
+
+                self.metrics.observe("result_bytes", len(serialized))
+                response_bytes += len(serialized)
+                yield serialized
+
+                # for res in result:
+                #     yield res.to_string()
 
         end_time = time.time()
         elapsed_time = end_time - start_time
 
+        if parallel:
+            self.metrics.observe_phase("fhe_evaluation", elapsed_time)
+            self.planner.observe(
+                "parallel", len(candidates), elapsed_time, response_bytes, self.parallel.workers
+            )
+        else:
+            self.metrics.observe_phase("fhe_evaluation", evaluation_time)
+            self.metrics.observe_phase("serialization", serialization_time)
+            self.planner.observe(
+                "entry", len(candidates), evaluation_time + serialization_time, response_bytes
+            )
+
         print(f"[i] FHE subtraction completed after: {elapsed_time:.2f} seconds")
 
-        return results
+    def search_packed(
+        self,
+        evaluate: Callable[[seal.Ciphertext], seal.Ciphertext],
+        candidates: np.ndarray,
+        snapshot: DatasetSnapshot,
+    ) -> tuple[dict, Iterator[bytes]]:
+        """
+        This is the packed variant of the search. Instead of one ciphertext per entry,
+        the function returns one ciphertext per packed block that contains at least one
+        entry of the optimized dataset, along with the slots of those entries.
+
+        Slots are listed in the order of the optimized dataset, so the client can map
+        zero slots back to the indexes expected by `get_data`.
 
-    def get_data(self, indexes: list) -> str:
+        Candidates in stale blocks (see `ingest`) or past the last block are evaluated on
+        their own entry ciphertext, which is sent as a block with the single slot 0.
+        """
+
+        groups = self.packed_groups(candidates, snapshot)
+
+        return {"mode": "packed", "slots": [slots for *_, slots in groups]}, self.evaluate_blocks(
+            evaluate, groups, snapshot
+        )
+
+    def packed_groups(
+        self, candidates: np.ndarray, snapshot: DatasetSnapshot
+    ) -> list[tuple[str, int, list[int]]]:
+        """
+        This function groups the optimized dataset by packed block, keeping the order of
+        the candidates. A group is ("block", block, slots) or ("entry", position, [0]).
+
+        Candidates are sorted positions (see `filter_candidates`), so the candidates of
+        a block are consecutive and the blocks are found as runs of the array.
+        """
+
+        stale_blocks = snapshot.stale_blocks
+        block_count = len(snapshot.packed_blocks)
+
+        blocks = candidates // self.slot_count
+        slots = candidates % self.slot_count
+
+        # Start and end of every run of candidates in the same block
+        bounds = [0, *(np.flatnonzero(np.diff(blocks)) + 1).tolist(), len(candidates)]
+
+        groups: list[tuple[str, int, list[int]]] = []
+
+        for start, stop in zip(bounds, bounds[1:]):
+            if start == stop:
+                continue
+
+            block = int(blocks[start])
+
+            if block in stale_blocks or block >= block_count:
+                groups.extend(("entry", index, [0]) for index in candidates[start:stop].tolist())
+            else:
+                groups.append(("block", block, slots[start:stop].tolist()))
+
+        return groups
+
+    def evaluate_blocks(
+        self,
+        evaluate: Callable[[seal.Ciphertext], seal.Ciphertext],
+        groups: list[tuple[str, int, list[int]]],
+        snapshot: DatasetSnapshot,
+    ) -> Iterator[bytes]:
+        start_time = time.time()
+
+        evaluation_time = 0.0
+        serialization_time = 0.0
+        response_bytes = 0
+
+        level = self.result_level()
+
+        for kind, position, slots in groups:
+            phase_start = time.perf_counter()
+
+            if kind == "block":
+                result: seal.Ciphertext = self.FHE_difference_radius_packed(
+                    evaluate, snapshot.packed_blocks[position], slots
+                )
+            else:
+                result = evaluate(self.entry_ciphertext(snapshot.dataset, position))
+                self.pad_slots(result, slots)
+
+            serialize_start = time.perf_counter()
+            serialized = self.finalize_result(result, level)
+
+            evaluation_time += serialize_start - phase_start
+            serialization_time += time.perf_counter() - serialize_start
+
+            self.metrics.observe("result_bytes", len(serialized))
+            response_bytes += len(serialized)
+            yield serialized
+
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+
+        self.metrics.observe_phase("fhe_evaluation", evaluation_time)
+        self.metrics.observe_phase("serialization", serialization_time)
+        self.planner.observe(
+            "packed", len(groups), evaluation_time + serialization_time, response_bytes
+        )
+
+        print(
+            f"[i] Packed FHE subtraction of {len(groups)} blocks completed after: {elapsed_time:.2f} seconds"
+        )
+
+    def batch_candidates(
+        self, batch: BatchQuery, snapshot: DatasetSnapshot | None = None
+    ) -> list[np.ndarray]:
+        """
+        This function returns the optimized dataset of every patient of the batch. Patients
+        with the same medicines and side effects share a single filter of the index.
+        """
+
+        filters: dict[tuple, np.ndarray] = {}
+        candidates: list[np.ndarray] = []
+
+        for patient in batch.patients:
+            key = (
+                tuple(sorted(set(patient["medicines"]))),
+                tuple(sorted(set(patient["side_effects"]))),
+            )
+
+            if key not in filters:
+                filters[key] = self.filter_candidates(list(key[0]), list(key[1]), snapshot)
+
+            candidates.append(filters[key])
+
+        return candidates
+
+    def batch_groups(
+        self, batch: BatchQuery, candidates: list[np.ndarray]
+    ) -> tuple[list[dict], list[tuple[np.ndarray, list[list[int]]]]]:
+        """
+        This function groups the patients of the batch, one group per packed query
+        ciphertext. A group is the sorted union of the optimized datasets of its patients
+        with the patient slots to keep in the result of every entry of the union.
+
+        For every patient the function returns the positions of its results in the stream
+        of result ciphertexts, in the order of its optimized dataset.
+        """
+
+        groups: list[tuple[np.ndarray, list[list[int]]]] = []
+        patients: list[dict] = []
+        offset = 0
+
+        for start in range(0, len(batch.patients), self.slot_count):
+            group_candidates = candidates[start : start + self.slot_count]
+
+            # Union of the optimized datasets of the group, sorted
+            order = np.unique(np.concatenate(group_candidates))
+
+            # Patient slots to keep in the result of every entry of the union
+            entry_slots: list[list[int]] = [[] for _ in range(len(order))]
+
+            for slot, patient_candidates in enumerate(group_candidates):
+                positions = np.searchsorted(order, patient_candidates)
+
+                for position in positions.tolist():
+                    entry_slots[position].append(slot)
+
+                patients.append({"results": (offset + positions).tolist()})
+
+            groups.append((order, entry_slots))
+            offset += len(order)
+
+        return patients, groups
+
+    def plan_batch(
+        self,
+        batch: BatchQuery,
+        candidates: list[np.ndarray],
+        snapshot: DatasetSnapshot | None = None,
+    ) -> QueryPlan:
+        """
+        This function plans the evaluation of a batch query, see `QueryPlanner.plan_batch`.
+        It raises `BudgetExceeded` when the batch is predicted to take longer than the
+        query budget.
+        """
+
+        snapshot = snapshot or self.snapshot
+
+        estimated_candidates = sum(
+            self.planner.estimate_candidates(
+                snapshot.index, len(snapshot.dataset), patient["medicines"], patient["side_effects"]
+            )
+            for patient in batch.patients
+        )
+
+        # One result per entry of the union of the optimized datasets of every group
+        results = sum(
+            len(np.unique(np.concatenate(candidates[start : start + self.slot_count])))
+            for start in range(0, len(candidates), self.slot_count)
+        )
+
+        plan = self.planner.plan_batch(
+            sum(len(patient_candidates) for patient_candidates in candidates),
+            estimated_candidates,
+            results,
+        )
+
+        self.metrics.increment("plan_batch")
+
+        print(
+            f"[i] Planned batch evaluation of {len(batch.patients)} patients, "
+            f"{plan.results} results in an estimated {plan.seconds:.2f} seconds"
+        )
+
+        return plan
+
+    def search_batch_iter(
+        self,
+        batch: BatchQuery,
+        candidates: list[np.ndarray] | None = None,
+        plan: QueryPlan | None = None,
+        snapshot: DatasetSnapshot | None = None,
+    ) -> tuple[dict, Iterator[bytes]]:
+        """
+        This is the batch variant of `search_iter`. Patients are evaluated group by group,
+        one group per packed query ciphertext (see `batch_groups`). Every entry in the
+        union of the optimized datasets of a group is evaluated once and yields one result
+        ciphertext, in which only the slots of the patients that have the entry among
+        their candidates are kept, every other slot is padded with random values.
+
+        For every patient the header lists the positions of its results in the stream of
+        result ciphertexts, in the order of its optimized dataset.
+
+        The batch is planned by `plan_batch` unless the caller already planned it, so it
+        is rejected with `BudgetExceeded` like a single query.
+        """
+
+        snapshot = snapshot or self.snapshot
+
+        if candidates is None:
+            candidates = self.batch_candidates(batch, snapshot)
+
+        if plan is None:
+            plan = self.plan_batch(batch, candidates, snapshot)
+
+        self.metrics.observe("batch_patients", len(batch.patients))
+
+        patients, groups = self.batch_groups(batch, candidates)
+
+        return {"mode": "batch", "patients": patients}, self.evaluate_batch(batch, groups, snapshot)
+
+    def evaluate_batch(
+        self,
+        batch: BatchQuery,
+        groups: list[tuple[np.ndarray, list[list[int]]]],
+        snapshot: DatasetSnapshot,
+    ) -> Iterator[bytes]:
+        start_time = time.time()
+
+        evaluation_time = 0.0
+        serialization_time = 0.0
+        response_bytes = 0
+
+        level = self.result_level()
+
+        for group, (order, entry_slots) in enumerate(groups):
+            with self.metrics.phase("radius_preparation"):
+                evaluate = self.prepare_evaluation(batch.group_query(group))
+
+            for index, slots in zip(order.tolist(), entry_slots):
+                phase_start = time.perf_counter()
+
+                result: seal.Ciphertext = evaluate(self.entry_ciphertext(snapshot.dataset, index))
+                self.pad_slots(result, slots)
+
+                serialize_start = time.perf_counter()
+                serialized = self.finalize_result(result, level)
+
+                evaluation_time += serialize_start - phase_start
+                serialization_time += time.perf_counter() - serialize_start
+
+                self.metrics.observe("result_bytes", len(serialized))
+                response_bytes += len(serialized)
+                yield serialized
+
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+
+        self.metrics.observe_phase("fhe_evaluation", evaluation_time)
+        self.metrics.observe_phase("serialization", serialization_time)
+        self.planner.observe(
+            "batch",
+            sum(len(order) for order, _ in groups),
+            evaluation_time + serialization_time,
+            response_bytes,
+        )
+
+        print(
+            f"[i] Batch FHE subtraction of {len(batch.patients)} patients completed after: {elapsed_time:.2f} seconds"
+        )
+
+    def get_data(
+        self,
+        indexes: list,
+        candidates: np.ndarray,
+        fields: list[str] | None = None,
+        snapshot: DatasetSnapshot | None = None,
+    ) -> str:
         """
         This function serves to retrieve data from the optimized dataset based on
         user supplied indexes (results from FHE operations on client side).
+        The indexes point into `candidates`, the optimized dataset of the query
+        filtered from `snapshot` (the current one by default).
+        With `fields` only the selected fields of every entry are returned.
+
+        Entries are returned in the order of `indexes`, entries that are deleted in
+        the snapshot are returned as null.
         """
 
-        result: list[dict] = []
+        snapshot = snapshot or self.snapshot
+
+        result: list[dict | None] = []
 
-        # Filter keys so no personal info is disclosed
+        # Filter keys so no personal info is disclosed, fields of columnar entries are
+        # only decoded when they are selected
         for index in indexes:
+            # Negative indexes would silently count from the end of the array
+            if not 0 <= index < len(candidates):
+                raise IndexError(f"Index {index} out of range")
+
+            entry = snapshot.dataset[int(candidates[index])]
+
+            # Deleted, still reported so the entries line up with the indexes
+            if entry is None:
+                result.append(None)
+                continue
+
             filtered_entry = {
-                key: value
-                for key, value in self.optimized_dataset[index].items()
-                if key not in ["name", "encrypted_m"]
+                key: entry[key]
+                for key in entry
+                if key not in ["name", "encrypted_m"] and (fields is None or key in fields)
             }
             result.append(filtered_entry)
 
@@ -0,0 +1,126 @@
+import os
+import seal
+import threading
+import multiprocessing
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator
+from classes.parameters import create_context
+
+# Context, encoder and decryptor of the current worker, created once by `init_worker`
+worker_state = threading.local()
+
+
+def init_worker(secret_key_path: str) -> None:
+    """
+    This function runs once in every worker and gives it its own `Decryptor`.
+    """
+
+    context = create_context()
+
+    secret_key = seal.SecretKey()
+    secret_key.load(context, secret_key_path)
+
+    worker_state.context = context
+    worker_state.encoder = seal.BatchEncoder(context)
+    worker_state.decryptor = seal.Decryptor(context, secret_key)
+
+
+def find_zeros(
+    context: seal.SEALContext,
+    encoder: seal.BatchEncoder,
+    decryptor: seal.Decryptor,
+    ciphertexts: list[bytes],
+    block_slots: list[list[int]] | None,
+) -> list[list[int]]:
+    """
+    This function decrypts the ciphertexts and returns, for each of them, the positions
+    that decrypted to zero. Without `block_slots` every ciphertext is one entry result
+    read from slot 0, otherwise the positions index into the slots of its block.
+    """
+
+    zeros: list[list[int]] = []
+
+    for i, ciphertext in enumerate(ciphertexts):
+        # Deserialize, decrypt and decode ciphertext
+        entry = context.from_cipher_str(ciphertext)
+        decoded = encoder.decode(decryptor.decrypt(entry))
+
+        slots = block_slots[i] if block_slots is not None else [0]
+
+        zeros.append([position for position, slot in enumerate(slots) if decoded[slot] == 0])
+
+    return zeros
+
+
+def find_zeros_in_worker(
+    ciphertexts: list[bytes], block_slots: list[list[int]] | None
+) -> list[list[int]]:
+    return find_zeros(
+        worker_state.context,
+        worker_state.encoder,
+        worker_state.decryptor,
+        ciphertexts,
+        block_slots,
+    )
+
+
+class DecryptionPool:
+    def __init__(
+        self,
+        kind: str = "process",
+        workers: int | None = None,
+        batch_size: int = 32,
+        secret_key_path: str = "secret_key.bin",
+    ) -> None:
+        """
+        Thread or process pool decrypting result batches, every worker holds its own
+        `Decryptor` loaded from `secret_key_path`.
+        """
+
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+
+        if kind == "thread":
+            self.pool: Executor = ThreadPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(secret_key_path,)
+            )
+        else:
+            self.pool: Executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(secret_key_path,),
+            )
+
+    def find_zeros(
+        self, ciphertexts: Iterable[bytes], block_slots: list[list[int]] | None
+    ) -> Iterator[list[int]]:
+        """
+        This function submits the ciphertexts in batches as they arrive and yields the
+        zero positions of every ciphertext in the original order.
+        """
+
+        futures = []
+        batch: list[bytes] = []
+        start = 0
+
+        for ciphertext in ciphertexts:
+            batch.append(ciphertext)
+
+            if len(batch) == self.batch_size:
+                slots = block_slots[start : start + len(batch)] if block_slots is not None else None
+                futures.append(self.pool.submit(find_zeros_in_worker, batch, slots))
+
+                start += len(batch)
+                batch = []
+
+        if batch:
+            slots = block_slots[start : start + len(batch)] if block_slots is not None else None
+            futures.append(self.pool.submit(find_zeros_in_worker, batch, slots))
+
+        for future in futures:
+            yield from future.result()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
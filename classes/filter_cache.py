@@ -0,0 +1,210 @@
+import time
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from classes.index import InvertedIndex
+
+# Default bounds of the cache, results above `FILTER_CACHE_BUDGET` bytes in total are evicted
+FILTER_CACHE_ENTRIES = 4096
+FILTER_CACHE_BUDGET = 64 * 1024**2
+FILTER_CACHE_TTL = 600
+
+
+class FilterCache:
+    def __init__(
+        self,
+        max_entries: int = FILTER_CACHE_ENTRIES,
+        memory_budget: int = FILTER_CACHE_BUDGET,
+        ttl: float = FILTER_CACHE_TTL,
+    ) -> None:
+        """
+        Cache of the plaintext pre-filter, keyed by the sorted and deduplicated medicine
+        and side effect IDs of a query. Besides the candidates of whole queries, the
+        medicine and side effect unions are cached on their own. The union of a new
+        set of IDs is built from the cached unions of its subsets, so only the posting
+        lists of the remaining IDs have to be merged.
+
+        Least recently used results are evicted above `max_entries` results or
+        `memory_budget` bytes, and every result expires after `ttl` seconds. The cache
+        belongs to one `InvertedIndex`, it is cleared as soon as it is used with
+        another one (e.g. after `Database.ingest` swapped the index).
+        """
+
+        self.max_entries = max_entries
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+
+        # Key -> (creation time, sorted positions), the key is ("filter", medicines,
+        # side_effects), ("medicines", ids) or ("side_effects", ids)
+        self.results: OrderedDict[tuple, tuple[float, np.ndarray]] = OrderedDict()
+        self.memory_used = 0
+
+        self.index: InvertedIndex | None = None
+
+        self.hits = 0
+        self.subset_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        result = self.results.get(key)
+
+        if result is None:
+            return None
+
+        if result[0] < time.monotonic() - self.ttl:
+            self.remove(key)
+            return None
+
+        self.results.move_to_end(key)
+
+        return result[1]
+
+    def put(self, key: tuple, positions: np.ndarray) -> None:
+        if positions.nbytes > self.memory_budget:
+            return
+
+        if key in self.results:
+            self.remove(key)
+
+        # Shared by all queries, nobody may change it in place
+        positions.flags.writeable = False
+
+        self.results[key] = (time.monotonic(), positions)
+        self.memory_used += positions.nbytes
+
+        # Evict the least recently used results until both bounds are met
+        while len(self.results) > self.max_entries or self.memory_used > self.memory_budget:
+            self.remove(next(iter(self.results)))
+
+    def remove(self, key: tuple) -> None:
+        _, positions = self.results.pop(key)
+        self.memory_used -= positions.nbytes
+
+    def filter(
+        self, index: InvertedIndex, medicines: list[int], side_effects: list[int]
+    ) -> np.ndarray:
+        """
+        This function returns the same positions as `index.filter`, from the cache if
+        the same sets of IDs were filtered before.
+        """
+
+        medicine_ids = tuple(sorted(set(medicines)))
+        effect_ids = tuple(sorted(set(side_effects)))
+        key = ("filter", medicine_ids, effect_ids)
+
+        with self.lock:
+            if index is not self.index:
+                self.clear_results()
+                self.index = index
+
+            candidates = self.get(key)
+
+            if candidates is not None:
+                self.hits += 1
+                return candidates
+
+            self.misses += 1
+
+        medicine_hits = self.union(index, "medicines", medicine_ids)
+
+        if len(medicine_hits) == 0:
+            candidates = index.empty
+        else:
+            effect_hits = self.union(index, "side_effects", effect_ids)
+            candidates = np.intersect1d(medicine_hits, effect_hits, assume_unique=True)
+
+        with self.lock:
+            if index is self.index:
+                self.put(key, candidates)
+
+        return candidates
+
+    def union(self, index: InvertedIndex, field: str, ids: tuple[int, ...]) -> np.ndarray:
+        """
+        This function returns the union of the posting lists of `ids`. The largest cached
+        unions of subsets of `ids` are reused first, the posting lists of the IDs they do
+        not cover are merged in.
+        """
+
+        key = (field, ids)
+
+        wanted = set(ids)
+        parts: list[np.ndarray] = []
+
+        with self.lock:
+            # A query of an earlier snapshot may still run after another one switched the
+            # cache to a newer index, it must not read the unions of that index
+            subsets: list[tuple] = []
+
+            if index is self.index:
+                positions = self.get(key)
+
+                if positions is not None:
+                    return positions
+
+                # Cached unions of subsets of the IDs, largest first
+                subsets = sorted(
+                    (
+                        cached
+                        for cached in self.results
+                        if cached[0] == field
+                        and len(cached[1]) > 1
+                        and wanted.issuperset(cached[1])
+                    ),
+                    key=lambda cached: len(cached[1]),
+                    reverse=True,
+                )
+
+            for subset in subsets:
+                covered = wanted.intersection(subset[1])
+
+                # Only worth it while it covers more than one of the missing IDs
+                if len(covered) > 1 and (cached := self.get(subset)) is not None:
+                    parts.append(cached)
+                    wanted -= covered
+
+            if parts:
+                self.subset_hits += 1
+
+        postings = index.medicines if field == "medicines" else index.side_effects
+        parts.append(index.union(postings, list(wanted)))
+
+        positions = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+        # Single IDs are already posting lists of the index
+        if len(ids) > 1:
+            with self.lock:
+                if index is self.index:
+                    self.put(key, positions)
+
+        return positions
+
+    def stats(self) -> dict:
+        """
+        This function returns the hit and miss counts and the memory usage of the cache.
+        """
+
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "subset_hits": self.subset_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "cached": len(self.results),
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory_budget,
+            }
+
+    def clear_results(self) -> None:
+        self.results.clear()
+        self.memory_used = 0
+
+    def clear(self) -> None:
+        with self.lock:
+            self.clear_results()
+            self.index = None
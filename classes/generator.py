@@ -0,0 +1,251 @@
+import seal
+import numpy as np
+import multiprocessing
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Iterator
+from faker import Faker
+from classes.parameters import create_context
+
+# Default size of the generated dataset
+NUM_MEDICINES = 200
+NUM_SIDE_EFFECTS = 20
+NUM_ENTRIES = 100
+MAX_PATIENT_MEDICINES = 10
+MAX_PATIENT_SIDE_EFFECTS = 5
+
+TREATMENTS = ["Stop", "Drink", "Double"]
+
+# Entries generated per batch, fewer for large vocabularies so that the per-entry
+# rows of random sort keys and probabilities stay at a few tens of megabytes
+BATCH_ENTRIES = 4096
+BATCH_CELLS = 4 * 1024**2
+
+# Names are combined from pools of Faker first and last names, calling Faker per entry is slow
+NAME_POOL_SIZE = 1000
+
+# Encryptor of the current worker, created once by `init_worker`
+worker_encryptor: seal.Encryptor | None = None
+
+
+def init_worker(public_key_path: str) -> None:
+    """
+    This function runs once in every worker and gives it its own `Encryptor`.
+    """
+
+    global worker_encryptor
+
+    context = create_context()
+
+    public_key = seal.PublicKey()
+    public_key.load(context, public_key_path)
+
+    worker_encryptor = seal.Encryptor(context, public_key)
+
+
+def encrypt_m_values(encryptor: seal.Encryptor, m_values: list[int]) -> list[str]:
+    """
+    This function encrypts every `m` as a constant polynomial (see `Client.prepare_m`)
+    and returns the hex encoded ciphertexts.
+    """
+
+    return [encryptor.encrypt(seal.Plaintext(hex(m)[2::])).to_string().hex() for m in m_values]
+
+
+def encrypt_m_values_in_worker(m_values: list[int]) -> list[str]:
+    return encrypt_m_values(worker_encryptor, m_values)
+
+
+class DatasetGenerator:
+    def __init__(
+        self,
+        encryptor: seal.Encryptor,
+        cipher,
+        num_medicines: int = NUM_MEDICINES,
+        num_side_effects: int = NUM_SIDE_EFFECTS,
+        seed: int | None = None,
+        workers: int = 0,
+        public_key_path: str = "public_key.bin",
+    ) -> None:
+        """
+        Bulk generator of random datasets (see `Client.generate_random`). The plain columns
+        of a whole batch are drawn with NumPy at once and the FHE encryptions of `m` are
+        spread over a process pool of `workers` (0 encrypts inline with `encryptor`).
+
+        `cipher` is the AES CTR cipher of the client. Every field is encrypted from the
+        start of the same key stream, so it is computed once and XORed with the fields.
+        """
+
+        self.encryptor = encryptor
+        self.cipher = cipher
+        self.num_medicines = num_medicines
+        self.num_side_effects = num_side_effects
+
+        self.rng = np.random.default_rng(seed)
+
+        if seed is not None:
+            Faker.seed(seed)
+
+        fake = Faker()
+        self.first_names = [fake.first_name() for _ in range(NAME_POOL_SIZE)]
+        self.last_names = [fake.last_name() for _ in range(NAME_POOL_SIZE)]
+
+        # Probability of each medicine causing each side effect
+        self.correlation_matrix = self.rng.random((num_medicines + 1, num_side_effects + 1))
+
+        self.keystream = b""
+
+        self.workers = workers
+        self.pool: Executor | None = None
+
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(public_key_path,),
+            )
+
+    def aes_encrypt(self, data: bytes) -> bytes:
+        if len(data) > len(self.keystream):
+            self.keystream = self.cipher.encryptor().update(bytes(max(len(data), 256)))
+
+        key = int.from_bytes(self.keystream[: len(data)], "big")
+
+        return (int.from_bytes(data, "big") ^ key).to_bytes(len(data), "big")
+
+    def batch_size(self) -> int:
+        width = max(self.num_medicines, self.num_side_effects) + 1
+
+        return max(1, min(BATCH_ENTRIES, BATCH_CELLS // width))
+
+    def sample_medicines(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        This function draws the medicines of `count` entries without replacement. It returns
+        a matrix whose rows hold random distinct medicine positions and the number of
+        medicines of every entry, which is the length of the used prefix of its row.
+        """
+
+        max_medicines = min(MAX_PATIENT_MEDICINES, self.num_medicines)
+
+        # The positions of the smallest random keys form a uniformly random subset,
+        # ordering them by their keys makes every prefix of it uniform as well
+        keys = self.rng.random((count, self.num_medicines))
+        chosen = np.argpartition(keys, max_medicines - 1, axis=1)[:, :max_medicines]
+        order = np.argsort(np.take_along_axis(keys, chosen, axis=1), axis=1)
+
+        sizes = self.rng.integers(1, max_medicines + 1, count)
+
+        return np.take_along_axis(chosen, order, axis=1), sizes
+
+    def sample_side_effects(self, medicines: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        This function draws the side effects of every entry from a multinomial distribution
+        given by the summed correlations of its medicines, for all entries at once.
+        """
+
+        count = len(sizes)
+
+        # Indicator matrix of the medicines of every entry, row i selects its correlations
+        indicator = np.zeros((count, self.num_medicines + 1))
+        used = np.arange(medicines.shape[1]) < sizes[:, None]
+        rows = np.repeat(np.arange(count), sizes)
+        indicator[rows, medicines[used] + 1] = 1
+
+        probabilities = indicator @ self.correlation_matrix
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        side_effect_counts = self.rng.integers(1, MAX_PATIENT_SIDE_EFFECTS + 1, count)
+
+        # The last slot absorbs the probability of the dropped column, as in the original loop
+        return self.rng.multinomial(side_effect_counts, probabilities[:, : self.num_side_effects])
+
+    def plain_batch(self, count: int) -> dict:
+        """
+        This function draws the plain columns of `count` entries.
+        """
+
+        ages = self.rng.integers(1, 100, count)
+        genders = self.rng.integers(0, 2, count)
+
+        medicines, sizes = self.sample_medicines(count)
+
+        return {
+            "ages": ages,
+            # Same as `Client.compute_m`, female entries are offset by 128
+            "m_values": ages + 128 * genders,
+            "medicines": medicines,
+            "sizes": sizes,
+            "side_effects": self.sample_side_effects(medicines, sizes),
+            "first_names": self.rng.integers(0, NAME_POOL_SIZE, count),
+            "last_names": self.rng.integers(0, NAME_POOL_SIZE, count),
+            "treatments": self.rng.integers(0, len(TREATMENTS), count),
+            "treated": self.rng.integers(0, sizes),
+        }
+
+    def encrypt_batch(self, m_values: list[int]) -> list[Future] | list[str]:
+        if self.pool is None:
+            return encrypt_m_values(self.encryptor, m_values)
+
+        chunk_size = -(-len(m_values) // self.workers)
+
+        return [
+            self.pool.submit(encrypt_m_values_in_worker, m_values[start : start + chunk_size])
+            for start in range(0, len(m_values), chunk_size)
+        ]
+
+    def build_entries(self, batch: dict, encrypted: list[Future] | list[str]) -> list[dict]:
+        if self.pool is not None:
+            encrypted = [ciphertext for future in encrypted for ciphertext in future.result()]
+
+        entries: list[dict] = []
+
+        for i, encrypted_m in enumerate(encrypted):
+            first_name = self.first_names[batch["first_names"][i]]
+            last_name = self.last_names[batch["last_names"][i]]
+            name = f"{first_name} {last_name}"
+
+            medicines = (batch["medicines"][i, : batch["sizes"][i]] + 1).tolist()
+            side_effects = (np.flatnonzero(batch["side_effects"][i]) + 1).tolist()
+
+            treatment = f"{TREATMENTS[batch['treatments'][i]]} {medicines[batch['treated'][i]]}"
+
+            entries.append(
+                {
+                    "name": self.aes_encrypt(name.encode()).hex(),
+                    "encrypted_m": encrypted_m,
+                    "age": int(batch["ages"][i]),
+                    "medicines": medicines,
+                    "side_effects": side_effects,
+                    "treatment": self.aes_encrypt(treatment.encode()).hex(),
+                }
+            )
+
+        return entries
+
+    def batches(self, num_entries: int) -> Iterator[tuple[list[dict], list[int]]]:
+        """
+        This function yields the entries and plain `m` values batch by batch. The next
+        batch is drawn while the workers are still encrypting the previous one.
+        """
+
+        pending: deque = deque()
+
+        for start in range(0, num_entries, self.batch_size()):
+            batch = self.plain_batch(min(self.batch_size(), num_entries - start))
+            m_values = batch["m_values"].tolist()
+
+            pending.append((batch, m_values, self.encrypt_batch(m_values)))
+
+            if len(pending) > 1:
+                batch, m_values, encrypted = pending.popleft()
+                yield self.build_entries(batch, encrypted), m_values
+
+        while pending:
+            batch, m_values, encrypted = pending.popleft()
+            yield self.build_entries(batch, encrypted), m_values
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class InvertedIndex:
+    def __init__(self) -> None:
+        # Posting lists, ID -> sorted array of dataset positions
+        self.medicines: dict[int, np.ndarray] = {}
+        self.side_effects: dict[int, np.ndarray] = {}
+
+        self.empty = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def build_columnar(cls, dataset) -> "InvertedIndex":
+        """
+        This class method builds the posting lists directly from the CSR columns
+        of a `ColumnarDataset` without materializing the entries.
+        """
+
+        index = cls()
+
+        index.medicines = cls.postings_from_csr(*dataset.csr_columns("medicines"))
+        index.side_effects = cls.postings_from_csr(*dataset.csr_columns("side_effects"))
+
+        return index
+
+    @staticmethod
+    def postings_from_csr(offsets: np.ndarray, values: np.ndarray) -> dict[int, np.ndarray]:
+        """
+        This function groups the dataset positions by value. Positions are sorted
+        within each value and duplicate IDs of the same entry are dropped.
+        """
+
+        positions = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+        values = values.astype(np.int64)
+
+        # Sort by value first and position second
+        order = np.lexsort((positions, values))
+        values, positions = values[order], positions[order]
+
+        keep = np.ones(len(values), dtype=bool)
+        keep[1:] = (values[1:] != values[:-1]) | (positions[1:] != positions[:-1])
+        values, positions = values[keep], positions[keep]
+
+        keys, starts = np.unique(values, return_index=True)
+
+        return {
+            int(key): chunk for key, chunk in zip(keys, np.split(positions, starts[1:]))
+        }
+
+    def updated(
+        self, removed: list[tuple[int, dict]], added: list[tuple[int, dict]]
+    ) -> "InvertedIndex":
+        """
+        This function returns a copy of the index without the `removed` and with the
+        `added` (position, entry) pairs. Only the posting lists of the touched IDs are
+        rebuilt, the others are shared with this index, which is left unchanged for
+        the queries that are still using it.
+        """
+
+        index = InvertedIndex()
+        index.medicines = dict(self.medicines)
+        index.side_effects = dict(self.side_effects)
+
+        for field, postings in [("medicines", index.medicines), ("side_effects", index.side_effects)]:
+            changes: dict[int, tuple[list[int], list[int]]] = {}
+
+            for position, entry in removed:
+                for i in set(entry[field]):
+                    changes.setdefault(i, ([], []))[0].append(position)
+
+            for position, entry in added:
+                for i in set(entry[field]):
+                    changes.setdefault(i, ([], []))[1].append(position)
+
+            for i, (drop, add) in changes.items():
+                current = postings.get(i, self.empty)
+
+                if drop:
+                    current = np.setdiff1d(current, np.array(drop, dtype=np.int64))
+                if add:
+                    current = np.union1d(current, np.array(add, dtype=np.int64))
+
+                if len(current) > 0:
+                    postings[i] = current
+                else:
+                    postings.pop(i, None)
+
+        return index
+
+    def union(self, postings: dict[int, np.ndarray], ids: list[int]) -> np.ndarray:
+        """
+        This function merges the posting lists of the supplied IDs into one sorted
+        array of unique dataset positions.
+        """
+
+        lists = [postings[i] for i in set(ids) if i in postings]
+
+        if not lists:
+            return self.empty
+        if len(lists) == 1:
+            return lists[0]
+
+        return np.unique(np.concatenate(lists))
+
+    def filter(self, medicines: list[int], side_effects: list[int]) -> np.ndarray:
+        """
+        This function returns the sorted positions of the entries that share at least one
+        medicine and at least one side effect with the query.
+        """
+
+        medicine_hits = self.union(self.medicines, medicines)
+        if len(medicine_hits) == 0:
+            return self.empty
+
+        effect_hits = self.union(self.side_effects, side_effects)
+
+        return np.intersect1d(medicine_hits, effect_hits, assume_unique=True)
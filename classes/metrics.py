@@ -0,0 +1,100 @@
+import time
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+
+# Number of recent samples kept per metric for the percentiles
+WINDOW_SIZE = 1024
+
+
+class Summary:
+    def __init__(self) -> None:
+        """
+        Running statistics of one metric, totals over the whole lifetime and
+        percentiles over the most recent `WINDOW_SIZE` samples.
+        """
+
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.window: deque[float] = deque(maxlen=WINDOW_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.window.append(value)
+
+    def percentile(self, q: float) -> float:
+        values = sorted(self.window)
+
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def to_dict(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """
+        Thread-safe registry of phase timings (seconds), observed values such as
+        candidate set or ciphertext sizes, and counters.
+        """
+
+        self.phases: dict[str, Summary] = {}
+        self.values: dict[str, Summary] = {}
+        self.counters: dict[str, int] = {}
+
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager measuring the duration of a phase.
+        """
+
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe_phase(name, time.perf_counter() - start_time)
+
+    def observe_phase(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases.setdefault(name, Summary()).observe(seconds)
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            self.values.setdefault(name, Summary()).observe(value)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        """
+        This function returns all metrics as a JSON serializable dictionary.
+        """
+
+        with self.lock:
+            return {
+                "phases": {name: summary.to_dict() for name, summary in self.phases.items()},
+                "values": {name: summary.to_dict() for name, summary in self.values.items()},
+                "counters": dict(self.counters),
+            }
@@ -0,0 +1,101 @@
+import math
+import seal
+
+# Conservative BFV noise model in bits of noise budget. The constants overestimate the
+# noise of SEAL's defaults slightly, so estimates err on the side of keeping more primes.
+FRESH_NOISE_BITS = 10
+MULTIPLY_EXTRA_BITS = 4
+SWITCH_EXTRA_BITS = 2
+
+# Budget that has to be left for the client to decrypt reliably
+MIN_REMAINING_BITS = 8
+
+
+def match_depth(radius: int, product_tree: bool = True) -> int:
+    """
+    This function returns the multiplicative depth of the radius match polynomial,
+    ceil(log2(2r + 1)) for the product tree and 2r for the serial chain.
+    """
+
+    factors = 2 * radius + 1
+
+    if product_tree:
+        return math.ceil(math.log2(factors))
+
+    return factors - 1
+
+
+def level_bits(context_data) -> int:
+    """
+    This function returns the size of the coefficient modulus of a level in bits.
+    """
+
+    return sum(modulus.bit_count() for modulus in context_data.parms().coeff_modulus())
+
+
+def estimate_remaining_budget(
+    data_bits: int, plain_bits: int, poly_modulus_degree: int, depth: int
+) -> float:
+    """
+    This function estimates the noise budget left after `depth` levels of ciphertext
+    multiplication followed by relinearization, for a coefficient modulus of `data_bits`
+    (without the special prime) and a plain modulus of `plain_bits`.
+    """
+
+    fresh = data_bits - plain_bits - FRESH_NOISE_BITS
+    multiply = plain_bits + math.log2(poly_modulus_degree) + MULTIPLY_EXTRA_BITS
+
+    return fresh - depth * multiply
+
+
+def remaining_budget(context: seal.SEALContext, depth: int) -> float:
+    parms = context.first_context_data().parms()
+
+    return estimate_remaining_budget(
+        level_bits(context.first_context_data()),
+        parms.plain_modulus().bit_count(),
+        parms.poly_modulus_degree(),
+        depth,
+    )
+
+
+def switch_capacity(context: seal.SEALContext, context_data) -> float:
+    """
+    This function estimates the largest noise budget a ciphertext can keep after being
+    switched to the level of `context_data`, which is bounded by the rounding noise
+    the switch itself introduces.
+    """
+
+    parms = context_data.parms()
+
+    return (
+        level_bits(context_data)
+        - parms.plain_modulus().bit_count()
+        - math.log2(parms.poly_modulus_degree())
+        - SWITCH_EXTRA_BITS
+    )
+
+
+def switch_target(context: seal.SEALContext, depth: int):
+    """
+    This function returns the `parms_id` of the lowest level a result of the given depth
+    can be switched to while keeping `MIN_REMAINING_BITS` of noise budget, or None if
+    the estimated budget does not allow switching at all.
+    """
+
+    budget = remaining_budget(context, depth)
+
+    if budget < MIN_REMAINING_BITS:
+        return None
+
+    target = None
+    context_data = context.first_context_data()
+
+    while context_data is not None:
+        if min(budget, switch_capacity(context, context_data)) < MIN_REMAINING_BITS:
+            break
+
+        target = context_data.parms_id()
+        context_data = context_data.next_context_data()
+
+    return target
@@ -0,0 +1,120 @@
+from classes.columnar import ColumnarDataset
+from classes.index import InvertedIndex
+
+
+class DatasetOverlay:
+    def __init__(self, base) -> None:
+        """
+        View over a loaded dataset (a read-only `ColumnarDataset`) with the changes of
+        `Database.ingest`. Changed and deleted entries are kept next to the base and
+        appended entries after it, so positions never move and handles of earlier
+        queries stay valid. Deleted entries read as None.
+
+        An overlay is never changed once it is published in a `DatasetSnapshot`, every
+        ingest works on a `copy`. Every changed or appended entry gets a new version,
+        which keeps its ciphertext apart from older ones in the ciphertext cache.
+        """
+
+        self.base = base
+        self.base_count = len(base)
+
+        # Position -> (version, entry)
+        self.changed: dict[int, tuple[int, dict | None]] = {}
+        self.appended: list[tuple[int, dict | None]] = []
+
+        self.version = 0
+
+    def copy(self) -> "DatasetOverlay":
+        overlay = DatasetOverlay(self.base)
+        overlay.changed = dict(self.changed)
+        overlay.appended = list(self.appended)
+        overlay.version = self.version
+
+        return overlay
+
+    def __len__(self) -> int:
+        return self.base_count + len(self.appended)
+
+    def __getitem__(self, index: int) -> dict | None:
+        if index < 0 or index >= len(self):
+            raise IndexError(f"Dataset position {index} out of range")
+
+        if index >= self.base_count:
+            return self.appended[index - self.base_count][1]
+
+        if index in self.changed:
+            return self.changed[index][1]
+
+        return self.base[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def overlaid(self, index: int) -> bool:
+        return index >= self.base_count or index in self.changed
+
+    def key(self, index: int):
+        """
+        This function returns the key of the entry's ciphertext in the `CiphertextStore`,
+        the position for entries of the base and (position, version) for the others.
+        """
+
+        if index >= self.base_count:
+            return index, self.appended[index - self.base_count][0]
+
+        if index in self.changed:
+            return index, self.changed[index][0]
+
+        return index
+
+    def ciphertext(self, index: int) -> bytes:
+        """
+        This function returns the raw serialized ciphertext of the entry, unchanged
+        entries are read straight from the columns of the base.
+        """
+
+        if not self.overlaid(index):
+            return self.base.ciphertext(index)
+
+        entry = self[index]
+
+        if entry is None:
+            raise IndexError(f"Entry on position {index} was deleted")
+
+        return bytes.fromhex(entry["encrypted_m"])
+
+    def append(self, entry: dict) -> int:
+        self.version += 1
+        self.appended.append((self.version, entry))
+
+        return len(self) - 1
+
+    def set(self, index: int, entry: dict | None) -> None:
+        self.version += 1
+
+        if index >= self.base_count:
+            self.appended[index - self.base_count] = (self.version, entry)
+        else:
+            self.changed[index] = (self.version, entry)
+
+
+class DatasetSnapshot:
+    def __init__(
+        self,
+        dataset: ColumnarDataset | DatasetOverlay,
+        index: InvertedIndex,
+        packed_blocks: list | None = None,
+        stale_blocks: frozenset[int] = frozenset(),
+    ) -> None:
+        """
+        State of the dataset that a query is answered from: the entries, their index and
+        the packed blocks, with the blocks whose entries changed since they were
+        encrypted. A snapshot is never changed, `Database.ingest` publishes a new one, so
+        a query that captured it filters and evaluates the same entries.
+        """
+
+        self.dataset = dataset
+        self.index = index
+        self.packed_blocks = packed_blocks or []
+        self.stale_blocks = stale_blocks
@@ -0,0 +1,159 @@
+import os
+import tempfile
+import multiprocessing
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+from classes.columnar import ColumnarDataset, write_columns
+from classes.query import Query
+
+# Database of the worker process, created once by `init_worker`
+worker_database = None
+
+
+def init_worker(path: str, start: int, stop: int, cache_budget: int) -> None:
+    """
+    This function runs once in every worker process. It builds the `SEALContext` and
+    the `Evaluator` and maps the entries from `start` to `stop` of the columnar dataset
+    in `path`, so the tasks only carry the query and the positions to evaluate. The
+    index and the journal are never loaded, the server filters and sends the changed
+    entries along.
+    """
+
+    # Imported here, the database module imports this one
+    from classes.database import Database
+    from classes.index import InvertedIndex
+    from classes.overlay import DatasetSnapshot
+
+    global worker_database
+
+    dataset = ColumnarDataset(path)
+    dataset.select(start, stop)
+
+    worker_database = Database(cache_budget)
+    worker_database.snapshot = DatasetSnapshot(dataset, InvertedIndex())
+
+
+def evaluate_chunk(
+    encrypted_m: bytes, settings: dict, indexes: list[int], overrides: dict[int, bytes]
+) -> list[bytes]:
+    """
+    This function evaluates the match polynomial for a chunk of the optimized dataset
+    with the `settings` of the server (radius, product tree and mod switching) and
+    returns the serialized results in the order of `indexes`. Entries changed since
+    the dataset was loaded are evaluated on their ciphertexts in `overrides`.
+    """
+
+    for name, value in settings.items():
+        setattr(worker_database, name, value)
+
+    query = Query([], [], encrypted_m)
+    evaluate = worker_database.prepare_evaluation(query)
+    level = worker_database.result_level()
+
+    dataset = worker_database.snapshot.dataset
+    results: list[bytes] = []
+
+    for index in indexes:
+        if index in overrides:
+            entry_m = worker_database.context.from_cipher_str(overrides[index])
+        else:
+            entry_m = worker_database.entry_ciphertext(dataset, index)
+
+        results.append(worker_database.finalize_result(evaluate(entry_m), level))
+
+    return results
+
+
+class ParallelEvaluator:
+    def __init__(
+        self,
+        dataset: ColumnarDataset,
+        workers: int | None = None,
+        min_chunk_size: int = 16,
+        cache_budget: int = 1024**3,
+    ) -> None:
+        """
+        Process pool that splits the optimized dataset into chunks and evaluates them
+        on all cores. The workers map the same entries as the loaded `dataset`, from its
+        file or from a temporary copy of in-memory columns, and share `cache_budget`
+        bytes for their ciphertext caches.
+        """
+
+        self.workers = workers or os.cpu_count()
+        self.min_chunk_size = min_chunk_size
+
+        self.temporary_path: str | None = None
+        path = dataset.path
+
+        if path is None:
+            fd, self.temporary_path = tempfile.mkstemp(suffix=".bin")
+            os.close(fd)
+
+            write_columns(dataset.columns, len(dataset.ages), self.temporary_path)
+            path = self.temporary_path
+
+        # Workers are spawned, forking a threaded server is not safe
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(
+                path, dataset.start, dataset.start + len(dataset), cache_budget // self.workers
+            ),
+        )
+
+    def split(self, candidates: np.ndarray) -> list[list[int]]:
+        """
+        This function splits the candidates into a few chunks per worker, so a slow
+        chunk does not leave the other workers idle.
+        """
+
+        chunk_size = max(self.min_chunk_size, -(-len(candidates) // (self.workers * 4)))
+
+        return [
+            candidates[start : start + chunk_size].tolist()
+            for start in range(0, len(candidates), chunk_size)
+        ]
+
+    def evaluate_iter(
+        self,
+        query: Query,
+        settings: dict,
+        candidates: np.ndarray,
+        overrides: dict[int, bytes] | None = None,
+    ) -> Iterator[bytes]:
+        """
+        This function submits all chunks at once and yields the results in the original
+        order, every chunk as soon as it and all chunks before it are done. Every chunk
+        carries the `overrides` (serialized ciphertexts of changed entries) of its
+        candidates.
+        """
+
+        overrides = overrides or {}
+
+        futures = [
+            self.pool.submit(
+                evaluate_chunk,
+                query.ciphertext_bytes(),
+                settings,
+                chunk,
+                {index: overrides[index] for index in chunk if index in overrides},
+            )
+            for chunk in self.split(candidates)
+        ]
+
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            # Do not waste workers on a result nobody reads anymore
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+        if self.temporary_path is not None:
+            os.remove(self.temporary_path)
@@ -0,0 +1,166 @@
+import os
+import math
+import json
+import seal
+
+from classes.noise import MIN_REMAINING_BITS, estimate_remaining_budget, match_depth
+
+POLY_MODULUS_DEGREE = 8192
+PLAIN_MODULUS_BITS = 20
+
+# Written by `plan_parameters.py`, loaded by both the client and the server
+PARAMETERS_FILE = "parameters.json"
+
+POLY_MODULUS_DEGREES = [4096, 8192, 16384, 32768]
+MAX_PRIME_BITS = 60
+
+# The plain modulus has to hold every `m` (gender offset 128 + age) plus the radius
+MAX_M_BITS = 9
+
+SECURITY_LEVELS = {
+    128: seal.sec_level_type.tc128,
+    192: seal.sec_level_type.tc192,
+    256: seal.sec_level_type.tc256,
+}
+
+DEFAULT_PARAMETERS = {
+    "poly_modulus_degree": POLY_MODULUS_DEGREE,
+    "coeff_modulus_bits": None,
+    "plain_modulus_bits": PLAIN_MODULUS_BITS,
+    "security": 128,
+    "radius": 2,
+}
+
+
+def load_parameters(path: str = PARAMETERS_FILE) -> dict:
+    """
+    This function returns the planned parameters from the parameter file, or the
+    defaults (8192 with SEAL's default coefficient modulus) when there is none.
+    """
+
+    if not os.path.exists(path):
+        return dict(DEFAULT_PARAMETERS)
+
+    with open(path, "r") as f:
+        return {**DEFAULT_PARAMETERS, **json.load(f)}
+
+
+def create_parameters(parameters: dict | None = None) -> seal.EncryptionParameters:
+    """
+    This function returns the BFV scheme parameters shared by the client and the server.
+    """
+
+    if parameters is None:
+        parameters = load_parameters()
+
+    poly_modulus_degree = parameters["poly_modulus_degree"]
+    security = SECURITY_LEVELS[parameters["security"]]
+
+    params = seal.EncryptionParameters(seal.scheme_type.bfv)
+    params.set_poly_modulus_degree(poly_modulus_degree)
+
+    if parameters["coeff_modulus_bits"] is None:
+        params.set_coeff_modulus(seal.CoeffModulus.BFVDefault(poly_modulus_degree, security))
+    else:
+        params.set_coeff_modulus(
+            seal.CoeffModulus.Create(poly_modulus_degree, parameters["coeff_modulus_bits"])
+        )
+
+    params.set_plain_modulus(
+        seal.PlainModulus.Batching(poly_modulus_degree, parameters["plain_modulus_bits"])
+    )
+
+    return params
+
+
+def create_context(parameters: dict | None = None) -> seal.SEALContext:
+    if parameters is None:
+        parameters = load_parameters()
+
+    return seal.SEALContext(
+        create_parameters(parameters), True, SECURITY_LEVELS[parameters["security"]]
+    )
+
+
+def coeff_modulus_chain(data_bits: float) -> list[int]:
+    """
+    This function splits the required data modulus into as few primes as possible
+    (at most 60 bits each) and appends the special prime used for key switching.
+    """
+
+    count = max(1, math.ceil(data_bits / MAX_PRIME_BITS))
+    size = math.ceil(data_bits / count)
+
+    return [size] * count + [size]
+
+
+def minimum_plain_modulus_bits(poly_modulus_degree: int) -> int:
+    """
+    This function returns the smallest plain modulus size that still holds every `m`
+    and leaves room for a batching prime (congruent to 1 modulo 2 * degree).
+    """
+
+    return max(MAX_M_BITS, int(math.log2(2 * poly_modulus_degree)) + 3)
+
+
+def plan_parameters(
+    radius: int,
+    packing_density: int = 1,
+    security: int = 128,
+    plain_modulus_bits: int | None = None,
+    product_tree: bool = True,
+) -> dict:
+    """
+    This function picks the smallest polynomial modulus degree and the shortest coefficient
+    modulus chain that leave enough noise budget for the match polynomial of `radius`.
+
+    `packing_density` is the number of entries that have to fit into one packed block,
+    the degree is at least that large because it equals the number of batching slots.
+    Without `plain_modulus_bits` the smallest usable plain modulus is picked, as every
+    bit of it costs noise budget on each multiplication.
+
+    Keys and datasets are bound to the parameters, so both have to be generated again
+    after the parameter file changes.
+    """
+
+    depth = match_depth(radius, product_tree)
+
+    for poly_modulus_degree in POLY_MODULUS_DEGREES:
+        if poly_modulus_degree < packing_density:
+            continue
+
+        if plain_modulus_bits is None:
+            plain_bits = minimum_plain_modulus_bits(poly_modulus_degree)
+        else:
+            plain_bits = plain_modulus_bits
+
+        max_bits = seal.CoeffModulus.MaxBitCount(poly_modulus_degree, SECURITY_LEVELS[security])
+
+        # Smallest data modulus whose estimated budget still covers the depth
+        data_bits = plain_bits
+        while (
+            estimate_remaining_budget(data_bits, plain_bits, poly_modulus_degree, depth)
+            < MIN_REMAINING_BITS
+        ):
+            data_bits += 1
+
+        chain = coeff_modulus_chain(data_bits)
+
+        if sum(chain) <= max_bits:
+            return {
+                "poly_modulus_degree": poly_modulus_degree,
+                "coeff_modulus_bits": chain,
+                "plain_modulus_bits": plain_bits,
+                "security": security,
+                "radius": radius,
+                "packing_density": packing_density,
+            }
+
+    raise ValueError(
+        f"No supported parameters leave enough noise budget for radius {radius} (depth {depth})"
+    )
+
+
+def save_parameters(parameters: dict, path: str = PARAMETERS_FILE) -> None:
+    with open(path, "w") as f:
+        f.write(json.dumps(parameters, indent=4))
@@ -0,0 +1,68 @@
+import queue
+import threading
+import seal
+
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+# Masks drawn ahead of the queries by the background thread of a pool
+MASK_POOL_SIZE = 64
+
+
+class PlaintextCache:
+    def __init__(self) -> None:
+        """
+        Cache of the plaintext constants of the match polynomial. A constant polynomial
+        is the same value in every batching slot, so the shift offsets can be built once
+        and shared by all queries and threads (SEAL only reads them).
+        """
+
+        self.constants: dict[int, seal.Plaintext] = {}
+        self.lock = threading.Lock()
+
+    def constant(self, value: int) -> seal.Plaintext:
+        plain = self.constants.get(value)
+
+        if plain is None:
+            with self.lock:
+                plain = self.constants.setdefault(value, seal.Plaintext(hex(value)[2::]))
+
+        return plain
+
+
+class MaskPool(Generic[T]):
+    def __init__(self, generate: Callable[[], T], size: int = MASK_POOL_SIZE) -> None:
+        """
+        Pool of random masks produced by `generate` on a background thread, so drawing
+        the randomness is off the critical path of the evaluation. Every
+        mask is handed out once, reusing a mask would let the client subtract it away.
+
+        The thread is started by the first `take`, processes that never mask results
+        do not pay for it.
+        """
+
+        self.generate = generate
+        self.masks: queue.Queue = queue.Queue(maxsize=size)
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def fill(self) -> None:
+        while True:
+            self.masks.put(self.generate())
+
+    def take(self) -> T:
+        """
+        This function returns a fresh mask, generated inline when the pool runs dry.
+        """
+
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.fill, daemon=True)
+                    self.thread.start()
+
+        try:
+            return self.masks.get_nowait()
+        except queue.Empty:
+            return self.generate()
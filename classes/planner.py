@@ -0,0 +1,223 @@
+import threading
+
+# Priors of the cost model in seconds per result ciphertext, used until evaluations
+# were observed. An entry at radius 2 takes about 2.5 ms (see the analysis in the
+# README), a packed block and an entry of a batch pay for encoding a random pad on
+# top of that.
+ENTRY_SECONDS = 0.0025
+BLOCK_SECONDS = 0.004
+
+# Fixed cost of dispatching the chunks of a query to the process pool
+PARALLEL_OVERHEAD = 0.05
+
+# Weight of a new observation in the moving averages of the cost model
+SMOOTHING = 0.2
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, plan: "QueryPlan") -> None:
+        super().__init__(
+            f"Query would take an estimated {plan.seconds:.2f} seconds, "
+            f"the budget is {plan.budget:.2f} seconds"
+        )
+
+        self.plan = plan
+
+
+class QueryPlan:
+    def __init__(
+        self,
+        strategy: str,
+        candidates: int,
+        estimated_candidates: int,
+        results: int,
+        seconds: float,
+        response_bytes: int,
+        budget: float | None,
+    ) -> None:
+        """
+        Evaluation strategy chosen for a query ("entry", "packed", "parallel" or "batch")
+        with the predicted number of result ciphertexts, FHE evaluation time and response
+        size.
+        """
+
+        self.strategy = strategy
+        self.candidates = candidates
+        self.estimated_candidates = estimated_candidates
+        self.results = results
+        self.seconds = seconds
+        self.response_bytes = response_bytes
+        self.budget = budget
+
+    def to_dict(self) -> dict:
+        return {
+            "strategy": self.strategy,
+            "candidates": self.candidates,
+            "estimated_candidates": self.estimated_candidates,
+            "results": self.results,
+            "seconds": round(self.seconds, 4),
+            "response_bytes": self.response_bytes,
+            "budget": self.budget,
+        }
+
+
+class QueryPlanner:
+    def __init__(self, result_bytes: int, budget: float | None = None) -> None:
+        """
+        Cost-based planner of the FHE evaluation. The cost of a strategy is the number of
+        result ciphertexts it produces times the seconds per result, learned as moving
+        averages of the evaluated queries. The cheapest strategy is chosen, and queries
+        whose cheapest plan exceeds `budget` seconds are rejected before any FHE work.
+
+        `result_bytes` is the prior size of a serialized result ciphertext.
+        """
+
+        self.budget = budget
+        self.result_bytes = result_bytes
+
+        self.costs: dict[str, float] = {
+            "entry": ENTRY_SECONDS,
+            "packed": BLOCK_SECONDS,
+            "parallel": ENTRY_SECONDS,
+            "batch": BLOCK_SECONDS,
+        }
+
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def estimate_candidates(
+        index, count: int, medicines: list[int], side_effects: list[int]
+    ) -> int:
+        """
+        This function estimates the size of the optimized dataset from the lengths of the
+        posting lists alone, assuming that IDs occur independently of each other. An
+        entry matches a set of IDs unless it misses every one of them.
+        """
+
+        if count == 0:
+            return 0
+
+        def match_probability(postings: dict, ids: list[int]) -> float:
+            miss = 1.0
+
+            for i in set(ids):
+                miss *= 1 - len(postings.get(i, ())) / count
+
+            return 1 - miss
+
+        return round(
+            count
+            * match_probability(index.medicines, medicines)
+            * match_probability(index.side_effects, side_effects)
+        )
+
+    def plan(
+        self,
+        mode: str,
+        candidates: int,
+        estimated_candidates: int,
+        blocks: int | None,
+        workers: int | None,
+        concurrent: bool = False,
+    ) -> QueryPlan:
+        """
+        This function chooses the strategy of a query with `candidates` entries in its
+        optimized dataset. `blocks` is the number of results of the packed evaluation
+        (None without a packed dataset) and `workers` the size of the process pool
+        (None without one). With `concurrent` other queries are being evaluated, which
+        the inline evaluation would share the GIL with, so it is only an option without
+        a process pool.
+
+        The requested `mode` limits the choice, "entry" keeps one result per entry,
+        "packed" uses the packed dataset when there is one and "auto" lets the cost
+        model decide.
+        """
+
+        with self.lock:
+            costs = dict(self.costs)
+            result_bytes = self.result_bytes
+
+        options: dict[str, tuple[int, float]] = {}
+
+        if mode != "packed" or blocks is None:
+            if workers is None or not concurrent:
+                options["entry"] = (candidates, candidates * costs["entry"])
+
+            if workers is not None:
+                seconds = PARALLEL_OVERHEAD + candidates * costs["parallel"] / workers
+                options["parallel"] = (candidates, seconds)
+
+        if mode != "entry" and blocks is not None:
+            options["packed"] = (blocks, blocks * costs["packed"])
+
+        # Cheapest first, the smaller response breaks ties
+        strategy = min(options, key=lambda option: (options[option][1], options[option][0]))
+        results, seconds = options[strategy]
+
+        return self.check_budget(
+            QueryPlan(
+                strategy,
+                candidates,
+                estimated_candidates,
+                results,
+                seconds,
+                results * result_bytes,
+                self.budget,
+            )
+        )
+
+    def plan_batch(self, candidates: int, estimated_candidates: int, results: int) -> QueryPlan:
+        """
+        This function plans a batch query, whose `candidates` are the sizes of the
+        optimized datasets of all patients summed up. The patients of a group share one
+        result ciphertext per entry of the union of their optimized datasets, which
+        gives the `results` of the batch.
+        """
+
+        with self.lock:
+            seconds = results * self.costs["batch"]
+            result_bytes = self.result_bytes
+
+        return self.check_budget(
+            QueryPlan(
+                "batch",
+                candidates,
+                estimated_candidates,
+                results,
+                seconds,
+                results * result_bytes,
+                self.budget,
+            )
+        )
+
+    def check_budget(self, plan: QueryPlan) -> QueryPlan:
+        if self.budget is not None and plan.seconds > self.budget:
+            raise BudgetExceeded(plan)
+
+        return plan
+
+    def observe(
+        self, strategy: str, results: int, seconds: float, result_bytes: int, workers: int = 1
+    ) -> None:
+        """
+        This function updates the cost model with an evaluated query. Parallel costs are
+        kept per entry and worker, so they carry over to pools of another size.
+        """
+
+        if results == 0:
+            return
+
+        if strategy == "parallel":
+            seconds = max(0.0, seconds - PARALLEL_OVERHEAD) * workers
+
+        with self.lock:
+            self.costs[strategy] += SMOOTHING * (seconds / results - self.costs[strategy])
+            self.result_bytes += round(SMOOTHING * (result_bytes / results - self.result_bytes))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "seconds_per_result": dict(self.costs),
+                "result_bytes": self.result_bytes,
+                "budget": self.budget,
+            }
@@ -0,0 +1,325 @@
+import io
+import os
+import re
+import sys
+import time
+import pstats
+import random
+import secrets
+import cProfile
+import functools
+import threading
+import contextlib
+
+from typing import Iterable, Iterator
+
+# Directory of the profiles, one .prof and one .txt summary per profiled request
+PROFILE_DIR = "profiles"
+
+# Request header that asks for a profile of the request
+PROFILE_HEADER = "X-Profile"
+
+# Functions listed in the summary
+TOP_FUNCTIONS = 25
+
+# Methods of the hot path whose cumulative time is listed in the summary on its own
+HOT_PATHS = [
+    "optimize_dataset",
+    "filter_candidates",
+    "plan_query",
+    "prepare_ciphertexts",
+    "FHE_difference_radius_tree",
+    "FHE_difference_radius_packed",
+    "radius_product",
+    "product_tree_multiply",
+    "pad_slots",
+    "finalize_result",
+    "search",
+    "search_iter",
+    "prepare_query",
+    "decrypt_results",
+    "fetch_entries",
+]
+
+# Labels pstats gives to C functions, with the module or type that owns the function:
+# "<method 'name' of 'type' objects>", "<built-in method module.name>" and "<module.name>"
+NATIVE_LABELS = [
+    re.compile(r"<method '\w+' of '(?P<owner>[\w.]+)' objects>"),
+    re.compile(r"<built-in method (?P<owner>[\w.]+)\.\w+>"),
+    re.compile(r"<(?P<owner>[\w.]+)\.\w+>"),
+]
+
+# Since Python 3.12 cProfile profiles every thread of the process, not only the one
+# that enabled it
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+class RequestProfile:
+    def __init__(self, profiler: "Profiler", request_id: str, enabled: bool) -> None:
+        """
+        Profile of one request. The work of a request runs on several threads (the handler
+        and the evaluation pool of the server), so every thread that runs a `section` gets
+        its own `cProfile.Profile` and they are merged by `finish`.
+
+        Since Python 3.12 a profile cannot be limited to one thread. The first section
+        profiles every thread of the process until it ends, including threads that serve
+        other requests meanwhile, and sections of other threads run unprofiled.
+
+        A disabled profile is a no-op, so callers do not have to check whether the
+        request was sampled.
+        """
+
+        self.profiler = profiler
+        self.request_id = request_id
+        self.enabled = enabled
+
+        self.profiles: dict[int, cProfile.Profile] = {}
+        self.active: set[int] = set()
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def section(self):
+        thread = threading.get_ident()
+
+        # Nested sections are covered by the outer one
+        if not self.enabled or thread in self.active:
+            yield
+            return
+
+        profile = self.profiles.setdefault(thread, cProfile.Profile())
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 a profile covers all threads, the one enabled already does
+            profile = None
+
+        if profile is not None:
+            self.active.add(thread)
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.active.discard(thread)
+
+    def wrap(self, iterable: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        This function profiles the production of every item on the thread that consumes
+        the iterator, e.g. the evaluation of a streamed result.
+        """
+
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+
+        while True:
+            with self.section():
+                item = next(iterator, None)
+
+            if item is None:
+                return
+
+            yield item
+
+    def headers(self) -> dict:
+        """
+        This function returns the request headers that ask the server to profile its
+        side of the request under the same ID.
+        """
+
+        if not self.enabled:
+            return {}
+
+        return {PROFILE_HEADER: "1", "X-Request-Id": self.request_id}
+
+    def finish(self) -> None:
+        if not self.enabled:
+            return
+
+        self.enabled = False
+
+        try:
+            profiles = [profile for profile in self.profiles.values() if profile.getstats()]
+
+            if profiles:
+                self.profiler.write(self, profiles, time.perf_counter() - self.start_time)
+        finally:
+            self.profiler.lock.release()
+
+
+class Profiler:
+    def __init__(
+        self, sample_rate: float = 0.0, directory: str = PROFILE_DIR, allow_header: bool = False
+    ) -> None:
+        """
+        Opt-in per-request profiling. A `sample_rate` share of the requests is profiled
+        with cProfile, and with `allow_header` also every request that carries the
+        `PROFILE_HEADER`. Profiles are written to `directory`, named by the request ID.
+
+        cProfile adds its overhead to the profiled request only, the others run as usual.
+        Only one request is profiled at a time, requests sampled meanwhile are skipped,
+        so the profiles of concurrent requests do not mix.
+        """
+
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.allow_header = allow_header
+
+        self.lock = threading.Lock()
+
+        self.profiled = 0
+        self.skipped = 0
+
+    def start(self, request_id: str | None = None, requested: bool = False) -> RequestProfile:
+        """
+        This function decides whether the request is profiled and returns its profile.
+        """
+
+        sampled = (requested and self.allow_header) or random.random() < self.sample_rate
+        request_id = request_id or secrets.token_hex(8)
+
+        if sampled and not self.lock.acquire(blocking=False):
+            self.skipped += 1
+            sampled = False
+
+        return RequestProfile(self, request_id, sampled)
+
+    def write(
+        self, profile: RequestProfile, profiles: list[cProfile.Profile], wall_time: float
+    ) -> None:
+        """
+        This function merges the profiles of all threads of the request and writes the raw
+        profile (for `pstats` or snakeviz) and a readable summary of it.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Only letters, digits and dashes of a client supplied ID end up in the file name
+        name = "".join(c for c in profile.request_id if c.isalnum() or c == "-")[:64] or "request"
+        path = os.path.join(self.directory, name)
+
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(f"{path}.prof")
+
+        with open(f"{path}.txt", "w") as f:
+            f.write(summarize(stats, profile.request_id, wall_time))
+
+        self.profiled += 1
+
+        print(f"[i] Wrote the profile of request {profile.request_id} to: {path}.prof")
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "allow_header": self.allow_header,
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+        }
+
+
+@functools.cache
+def seal_names() -> tuple[frozenset[str], frozenset[str]]:
+    """
+    This function returns the names of the modules of the SEAL bindings and the names
+    of their classes, plain and qualified by the module.
+    """
+
+    try:
+        import seal
+    except ImportError:
+        return frozenset({"seal"}), frozenset()
+
+    classes = [value for value in vars(seal).values() if isinstance(value, type)]
+
+    modules = {seal.__name__.split(".")[0]}
+    modules.update(cls.__module__.split(".")[0] for cls in classes)
+
+    types = {cls.__qualname__ for cls in classes}
+    types.update(f"{cls.__module__}.{cls.__qualname__}" for cls in classes)
+
+    return frozenset(modules), frozenset(types)
+
+
+def native_owner(name: str) -> str | None:
+    """
+    This function returns the module or type that owns a C function by its pstats label,
+    None for builtins without one.
+    """
+
+    for label in NATIVE_LABELS:
+        match = label.fullmatch(name)
+
+        if match is not None:
+            return match["owner"]
+
+    return None
+
+
+def classify(function: tuple[str, int, str]) -> str:
+    """
+    This function tells SEAL calls ("seal"), other native code such as NumPy or
+    builtins ("native") and Python code ("python") apart by their pstats key. A C
+    function belongs to SEAL when its owner is a class or a module of the bindings.
+    """
+
+    filename, _, name = function
+
+    if filename != "~":
+        return "python"
+
+    owner = native_owner(name)
+
+    if owner is None:
+        return "native"
+
+    modules, types = seal_names()
+
+    return "seal" if owner in types or owner.split(".")[0] in modules else "native"
+
+
+def summarize(stats: pstats.Stats, request_id: str, wall_time: float) -> str:
+    """
+    This function returns the summary of a request profile: the time spent inside SEAL,
+    in other native code and in Python itself, the cumulative time of the hot path
+    methods and the functions with the most own time.
+    """
+
+    split = {"seal": 0.0, "native": 0.0, "python": 0.0}
+    hot_paths: dict[str, float] = {}
+
+    for function, (_, _, own_time, cumulative_time, _) in stats.stats.items():
+        split[classify(function)] += own_time
+
+        if function[0] != "~" and function[2] in HOT_PATHS:
+            hot_paths[function[2]] = hot_paths.get(function[2], 0.0) + cumulative_time
+
+    profiled = sum(split.values())
+
+    lines = [
+        f"Request {request_id}",
+        f"Wall time: {wall_time:.4f} s, profiled: {profiled:.4f} s",
+        "",
+    ]
+
+    if PROFILES_ALL_THREADS:
+        lines[-1:-1] = ["Python 3.12+: includes every thread, also other concurrent requests"]
+
+    for kind, own_time in split.items():
+        share = own_time / profiled * 100 if profiled else 0.0
+        lines.append(f"{kind:>8}: {own_time:.4f} s ({share:.1f} %)")
+
+    lines += ["", "Hot paths (cumulative):"]
+    lines += [
+        f"{name:>32}: {cumulative_time:.4f} s"
+        for name, cumulative_time in sorted(hot_paths.items(), key=lambda item: -item[1])
+    ]
+
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("tottime").print_stats(TOP_FUNCTIONS)
+
+    return "\n".join(lines) + "\n\n" + output.getvalue()
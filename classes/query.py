@@ -1,12 +1,49 @@
 import json
+import seal
+
+from classes.wire import pack_frames, unpack_frames
 
 
 class Query:
-    def __init__(self, medicines: list[int], side_effects: list[int], encrypted_m: str) -> None:
+    def __init__(
+        self,
+        medicines: list[int],
+        side_effects: list[int],
+        encrypted_m: str | bytes,
+        mode: str = "entry",
+    ) -> None:
         self.medicines = medicines
         self.side_effects = side_effects
+        # Hex string when sent as JSON, raw bytes when sent in the binary protocol
         self.encrypted_m = encrypted_m
 
+        # Evaluation mode, "entry" (one ciphertext per entry), "packed" (one per block) or
+        # "auto" (chosen by the query planner of the server)
+        self.mode = mode
+
+        # Deserialized `encrypted_m`, parsed on first use
+        self.ciphertext_m: seal.Ciphertext | None = None
+
+    def ciphertext(self, context: seal.SEALContext) -> seal.Ciphertext:
+        """
+        Returns the encrypted `m` as a `seal.Ciphertext`, deserializing it only once per query
+        """
+
+        if self.ciphertext_m is None:
+            self.ciphertext_m = context.from_cipher_str(self.ciphertext_bytes())
+
+        return self.ciphertext_m
+
+    def ciphertext_bytes(self) -> bytes:
+        """
+        Returns the serialized encrypted `m` as raw bytes
+        """
+
+        if isinstance(self.encrypted_m, str):
+            return bytes.fromhex(self.encrypted_m)
+
+        return self.encrypted_m
+
     @classmethod
     def deserialize(cls, serialized_query: str) -> "Query":
         """
@@ -20,6 +57,23 @@ class Query:
             medicines=data["medicines"],
             side_effects=data["side_effects"],
             encrypted_m=data["encrypted_m"],
+            mode=data.get("mode", "entry"),
+        )
+
+    @classmethod
+    def deserialize_binary(cls, serialized_query: bytes) -> "Query":
+        """
+        This class method recreates a query object from the binary POST data, see `serialize_binary`.
+        """
+
+        header, encrypted_m = unpack_frames(serialized_query)
+        data = json.loads(header)
+
+        return cls(
+            medicines=data["medicines"],
+            side_effects=data["side_effects"],
+            encrypted_m=encrypted_m,
+            mode=data.get("mode", "entry"),
         )
 
     def serialize(self) -> str:
@@ -27,10 +81,27 @@ class Query:
         Serializes the query object into string using json library
         """
 
+        encrypted_m = self.encrypted_m
+        if isinstance(encrypted_m, bytes):
+            encrypted_m = encrypted_m.hex()
+
         return json.dumps(
             {
                 "medicines": self.medicines,
                 "side_effects": self.side_effects,
-                "encrypted_m": self.encrypted_m,
+                "encrypted_m": encrypted_m,
+                "mode": self.mode,
             }
         )
+
+    def serialize_binary(self) -> bytes:
+        """
+        Serializes the query object into two frames, a JSON header with the plaintext
+        parameters and the raw serialized ciphertext
+        """
+
+        header = json.dumps(
+            {"medicines": self.medicines, "side_effects": self.side_effects, "mode": self.mode}
+        )
+
+        return pack_frames([header.encode("utf-8"), self.ciphertext_bytes()])
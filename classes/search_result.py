@@ -0,0 +1,41 @@
+import json
+
+
+class SearchResult:
+    def __init__(
+        self,
+        indexes: list[int],
+        result_count: int,
+        timings: dict[str, float],
+        stats: dict | None = None,
+    ) -> None:
+        """
+        Outcome of `Client.search`. `indexes` point into the optimized dataset of the query,
+        `entries` hold the decrypted data fetched for them and `timings` the duration of
+        every phase in seconds. `stats` holds the transferred byte sizes, the number of
+        result ciphertexts and the noise budget sampled from the first of them.
+        """
+
+        self.indexes = indexes
+        self.result_count = result_count
+        self.timings = timings
+        self.stats = stats or {}
+        self.entries: list[dict] = []
+
+    @property
+    def found(self) -> bool:
+        return len(self.indexes) > 0
+
+    def stats_json(self) -> str:
+        """
+        Returns the timings and stats of the search as pretty printed JSON
+        """
+
+        return json.dumps({"timings": self.timings, **self.stats}, indent=4)
+
+    def to_json(self) -> str:
+        """
+        Returns the fetched entries as pretty printed JSON
+        """
+
+        return json.dumps(self.entries, indent=4)
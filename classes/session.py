@@ -0,0 +1,61 @@
+import time
+import secrets
+import threading
+
+from collections import OrderedDict
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 1024, ttl: float = 600) -> None:
+        """
+        Per-query state of the server (e.g. the snapshot and the optimized dataset a query
+        was filtered from), keyed by an opaque query handle. Sessions expire
+        after `ttl` seconds and the oldest ones are dropped above `max_sessions`.
+        """
+
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+
+        self.sessions: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, state: object) -> str:
+        """
+        This function stores the state of a query and returns its handle.
+        """
+
+        handle = secrets.token_hex(16)
+
+        with self.lock:
+            self.expire()
+
+            self.sessions[handle] = (time.monotonic(), state)
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+        return handle
+
+    def get(self, handle: str) -> object | None:
+        with self.lock:
+            self.expire()
+
+            session = self.sessions.get(handle)
+
+        return session[1] if session is not None else None
+
+    def expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+
+        # Sessions are ordered by creation time, so only the head has to be checked
+        while self.sessions:
+            handle, (created, _) = next(iter(self.sessions.items()))
+
+            if created >= deadline:
+                break
+
+            del self.sessions[handle]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.sessions)
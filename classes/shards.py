@@ -0,0 +1,292 @@
+import json
+import queue
+import bisect
+import threading
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Iterator
+from classes.wire import BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, decode_results_stream
+
+# Marks the end of the ciphertexts of a shard
+SHARD_END = object()
+
+
+class ShardError(Exception):
+    def __init__(self, endpoint: str, status: int, content_type: str, body: bytes) -> None:
+        """
+        Answer of a shard other than 200. The coordinator passes client errors (4xx) of
+        the shards on to its client unchanged.
+        """
+
+        message = body.decode(errors="replace")
+        super().__init__(f"Shard {endpoint} answered with status {status}: {message}")
+
+        self.endpoint = endpoint
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+
+    @classmethod
+    def from_response(cls, endpoint: str, response: requests.Response) -> "ShardError":
+        content_type = response.headers.get("Content-Type", JSON_CONTENT_TYPE)
+
+        return cls(endpoint, response.status_code, content_type, response.content)
+
+
+class ShardResult:
+    def __init__(self, endpoint: str, response: requests.Response) -> None:
+        """
+        Streamed answer of one shard. The header is read right away, the ciphertexts are
+        drained into a queue by `drain` on their own thread, so every shard keeps sending
+        while the coordinator forwards the results of the shards before it.
+        """
+
+        self.endpoint = endpoint
+        self.response = response
+        self.handle = response.headers.get("X-Query-Handle")
+
+        # Size of the optimized dataset and evaluation plan of the shard
+        self.candidates = int(response.headers.get("X-Candidates", 0))
+        self.plan = json.loads(response.headers.get("X-Query-Plan", "null"))
+
+        self.header, self.frames = decode_results_stream(response.iter_content(chunk_size=None))
+        self.ciphertexts: queue.Queue = queue.Queue()
+
+    def drain(self) -> None:
+        try:
+            for frame in self.frames:
+                self.ciphertexts.put(frame)
+        except Exception as e:
+            self.ciphertexts.put(e)
+        finally:
+            self.ciphertexts.put(SHARD_END)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while (item := self.ciphertexts.get()) is not SHARD_END:
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+
+    def close(self) -> None:
+        # Stops the shard's stream, `drain` ends with the error of the closed connection
+        self.response.close()
+
+
+class ShardPool:
+    def __init__(self, endpoints: list[str]) -> None:
+        """
+        Backend servers of a sharded deployment, every one serving a range of the dataset
+        (see `Database.shard_range`). Queries are sent to all shards at once and the
+        answers are merged in the order of `endpoints`, which has to follow the order
+        of the shards.
+        """
+
+        self.endpoints = [endpoint.rstrip("/") for endpoint in endpoints]
+
+        # Persistent HTTPS connections to the shards, shared by the handler threads
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=64)
+        )
+
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(endpoints))
+
+    def post(
+        self,
+        endpoint: str,
+        path: str,
+        body: bytes,
+        content_type: str,
+        headers: dict | None = None,
+    ) -> requests.Response:
+        response = self.session.post(
+            endpoint + path,
+            data=body,
+            headers={
+                "Content-Type": content_type,
+                "Accept": BINARY_CONTENT_TYPE,
+                **(headers or {}),
+            },
+            stream=True,
+        )
+
+        if response.status_code != 200:
+            error = ShardError.from_response(endpoint, response)
+            response.close()
+
+            raise error
+
+        return response
+
+    def scatter(
+        self, path: str, body: bytes, content_type: str, headers: dict | None = None
+    ) -> list[ShardResult]:
+        """
+        This function sends the query to every shard and returns their answers once all
+        headers arrived. The ciphertexts keep streaming in the background. `headers`
+        are added to the requests, e.g. to profile the query on the shards as well.
+
+        When a shard fails, the answers of all the others are closed and the error is
+        raised, the `ShardError` of a client error (4xx) first.
+        """
+
+        def query(endpoint: str) -> ShardResult:
+            response = self.post(endpoint, path, body, content_type, headers)
+
+            try:
+                return ShardResult(endpoint, response)
+            except BaseException:
+                response.close()
+                raise
+
+        futures = [self.executor.submit(query, endpoint) for endpoint in self.endpoints]
+
+        results: list[ShardResult] = []
+        errors: list[Exception] = []
+
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            for result in results:
+                result.close()
+
+            client_errors = [
+                e for e in errors if isinstance(e, ShardError) and 400 <= e.status < 500
+            ]
+
+            raise (client_errors or errors)[0]
+
+        for result in results:
+            threading.Thread(target=result.drain, daemon=True).start()
+
+        return results
+
+    @staticmethod
+    def gather(results: list[ShardResult]) -> Iterator[bytes]:
+        try:
+            for result in results:
+                yield from result
+        finally:
+            # Also when a shard failed or the client went away midway
+            for result in results:
+                result.close()
+
+    @staticmethod
+    def merge(results: list[ShardResult]) -> tuple[dict, list[tuple[str, str, int]]]:
+        """
+        This function merges the headers of the shards into the header of one response.
+        The optimized dataset of the response is the concatenation of those of the shards.
+
+        Packed results of some shards are merged with entry results of the others by
+        sending every entry result as a block with the single slot 0.
+
+        The function also returns the parts of the optimized dataset, (endpoint, handle,
+        size) per shard, which route fetches back to the shards.
+        """
+
+        parts = [(result.endpoint, result.handle, result.candidates) for result in results]
+
+        if all(result.header["mode"] == "entry" for result in results):
+            return {"mode": "entry"}, parts
+
+        slots: list[list[int]] = []
+
+        for result in results:
+            if result.header["mode"] == "packed":
+                slots.extend(result.header["slots"])
+            else:
+                slots.extend([[0]] * result.candidates)
+
+        return {"mode": "packed", "slots": slots}, parts
+
+    @staticmethod
+    def merge_batch(results: list[ShardResult]) -> tuple[dict, list[list[tuple[str, str, int]]]]:
+        """
+        This function merges the batch headers of the shards. The result positions of every
+        patient are shifted by the number of results of the shards before, and the parts of
+        the optimized dataset are returned per patient.
+        """
+
+        patients: list[dict] = [{"results": []} for _ in results[0].header["patients"]]
+        parts: list[list[tuple[str, str, int]]] = [[] for _ in patients]
+
+        offset = 0
+
+        for result in results:
+            count = 0
+
+            for patient, shard_patient, patient_parts in zip(
+                patients, result.header["patients"], parts
+            ):
+                positions: list[int] = shard_patient["results"]
+
+                patient["results"].extend(offset + position for position in positions)
+                patient_parts.append(
+                    (result.endpoint, shard_patient["handle"], len(positions))
+                )
+
+                # Every result of a shard belongs to at least one of its patients
+                count = max([count] + [position + 1 for position in positions])
+
+            offset += count
+
+        return {"mode": "batch", "patients": patients}, parts
+
+    def fetch(
+        self,
+        path: str,
+        parts: list[tuple[str, str, int]],
+        indexes: list[int],
+        fields: list[str] | None = None,
+    ) -> list[dict]:
+        """
+        This function splits the indexes into the optimized dataset of a merged response
+        by shard and fetches the entries from the shards that own them. The entries are
+        returned shard by shard, which is the order of sorted indexes.
+        """
+
+        requests_by_shard: list[list[int]] = [[] for _ in parts]
+        bounds = [0]
+
+        for *_, size in parts:
+            bounds.append(bounds[-1] + size)
+
+        for index in indexes:
+            if not 0 <= index < bounds[-1]:
+                raise IndexError(f"Index {index} out of range")
+
+            shard = bisect.bisect_right(bounds, index) - 1
+            requests_by_shard[shard].append(index - bounds[shard])
+
+        def fetch_shard(shard: int) -> list[dict]:
+            endpoint, handle, _ = parts[shard]
+            body = json.dumps(
+                {"handle": handle, "indexes": requests_by_shard[shard], "fields": fields}
+            )
+
+            response = self.session.post(
+                endpoint + path, data=body, headers={"Content-Type": JSON_CONTENT_TYPE}
+            )
+
+            if response.status_code != 200:
+                raise ShardError.from_response(endpoint, response)
+
+            return json.loads(response.text)
+
+        shards = [shard for shard, shard_indexes in enumerate(requests_by_shard) if shard_indexes]
+
+        return [entry for entries in self.executor.map(fetch_shard, shards) for entry in entries]
+
+    def metrics(self) -> dict:
+        def fetch_metrics(endpoint: str) -> dict:
+            return self.session.get(endpoint + "/metrics").json()
+
+        return dict(zip(self.endpoints, self.executor.map(fetch_metrics, self.endpoints)))
@@ -0,0 +1,181 @@
+import json
+import struct
+
+from typing import Iterable, Iterator
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-seal-frames"
+
+# Every frame is prefixed with its length as a little endian uint32
+FRAME_HEADER = struct.Struct("<I")
+
+
+def pack_frames(frames: list[bytes]) -> bytes:
+    """
+    This function joins the frames into one length-prefixed binary message.
+    """
+
+    return b"".join(FRAME_HEADER.pack(len(frame)) + frame for frame in frames)
+
+
+def unpack_frames(data: bytes) -> list[bytes]:
+    """
+    This function splits a binary message back into its frames.
+    """
+
+    frames: list[bytes] = []
+    position = 0
+
+    while position < len(data):
+        if position + FRAME_HEADER.size > len(data):
+            raise ValueError("Truncated frame header")
+
+        (length,) = FRAME_HEADER.unpack_from(data, position)
+        position += FRAME_HEADER.size
+
+        if position + length > len(data):
+            raise ValueError("Truncated frame")
+
+        frames.append(data[position : position + length])
+        position += length
+
+    return frames
+
+
+class FrameReader:
+    def __init__(self) -> None:
+        """
+        Incremental frame parser for streamed responses, frames may be split across
+        any number of network chunks.
+        """
+
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        This function appends the received bytes and returns every frame completed by them.
+        """
+
+        self.buffer.extend(data)
+
+        frames: list[bytes] = []
+        position = 0
+
+        while len(self.buffer) - position >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, position)
+
+            if len(self.buffer) - position - FRAME_HEADER.size < length:
+                break
+
+            position += FRAME_HEADER.size
+            frames.append(bytes(self.buffer[position : position + length]))
+            position += length
+
+        del self.buffer[:position]
+
+        return frames
+
+    def finish(self) -> None:
+        if self.buffer:
+            raise ValueError("Truncated frame")
+
+
+def iter_frames(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    This function turns a stream of network chunks into a stream of frames.
+    """
+
+    reader = FrameReader()
+
+    for chunk in chunks:
+        yield from reader.feed(chunk)
+
+    reader.finish()
+
+
+def encode_results_json(results: dict) -> bytes:
+    """
+    This function serializes the search results as JSON with hex encoded ciphertexts.
+    Entry mode results are a plain list of ciphertexts, packed results also carry
+    the slots of every block and batch results the result positions of every patient.
+    """
+
+    if results["mode"] == "packed":
+        return json.dumps(
+            {
+                "mode": "packed",
+                "results": [
+                    {"ciphertext": ciphertext.hex(), "slots": slots}
+                    for ciphertext, slots in zip(results["ciphertexts"], results["slots"])
+                ],
+            }
+        ).encode("utf-8")
+
+    if results["mode"] == "batch":
+        return json.dumps(
+            {
+                "mode": "batch",
+                "patients": results["patients"],
+                "ciphertexts": [ciphertext.hex() for ciphertext in results["ciphertexts"]],
+            }
+        ).encode("utf-8")
+
+    return json.dumps([ciphertext.hex() for ciphertext in results["ciphertexts"]]).encode("utf-8")
+
+
+def decode_results_json(data: bytes) -> dict:
+    """
+    This function parses the JSON search results back to the form returned by `Database.search`.
+    """
+
+    results = json.loads(data)
+
+    if isinstance(results, dict) and results.get("mode") == "batch":
+        results["ciphertexts"] = [bytes.fromhex(ciphertext) for ciphertext in results["ciphertexts"]]
+
+        return results
+
+    if isinstance(results, dict) and results.get("mode") == "packed":
+        return {
+            "mode": "packed",
+            "ciphertexts": [bytes.fromhex(result["ciphertext"]) for result in results["results"]],
+            "slots": [result["slots"] for result in results["results"]],
+        }
+
+    return {"mode": "entry", "ciphertexts": [bytes.fromhex(result) for result in results]}
+
+
+def encode_results_binary(results: dict) -> bytes:
+    """
+    This function serializes the search results as frames. The first frame is a small
+    JSON header with the mode (and the slots of packed blocks), every following frame
+    is one raw SEAL serialized ciphertext.
+    """
+
+    header = {key: value for key, value in results.items() if key != "ciphertexts"}
+
+    return pack_frames([json.dumps(header).encode("utf-8")] + results["ciphertexts"])
+
+
+def encode_results_stream(header: dict, ciphertexts: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    This function is the streaming variant of `encode_results_binary`, it yields the
+    header frame first and then one frame per ciphertext as they are produced.
+    """
+
+    yield pack_frames([json.dumps(header).encode("utf-8")])
+
+    for ciphertext in ciphertexts:
+        yield pack_frames([ciphertext])
+
+
+def decode_results_stream(chunks: Iterable[bytes]) -> tuple[dict, Iterator[bytes]]:
+    """
+    This function reads the header frame of a streamed response and returns it
+    together with an iterator over the remaining ciphertext frames.
+    """
+
+    frames = iter_frames(chunks)
+
+    return json.loads(next(frames)), frames
+
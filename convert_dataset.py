@@ -0,0 +1,29 @@
+import json
+import argparse
+from classes.columnar import write_columnar
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert the JSON dataset to the binary columnar format")
+
+    parser.add_argument("--input", default="dataset.json", help="JSON dataset to convert")
+    parser.add_argument("--output", default="dataset.bin", help="Binary columnar dataset to write")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print(f"[i] Loading dataset from a file: {args.input}")
+
+    with open(args.input, "r") as f:
+        dataset = json.load(f)
+
+    write_columnar(dataset, args.output)
+
+    print(f"[+] Wrote {len(dataset)} entries to a file: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
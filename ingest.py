@@ -0,0 +1,73 @@
+import os
+import json
+import argparse
+from classes.client import Client
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Medicine Side Effects Dataset Ingestion")
+
+    parser.add_argument("endpoint", help="Ingest endpoint, e.g. https://127.0.0.1:8000/ingest")
+    parser.add_argument(
+        "--append",
+        help='JSON file with a list of records to append, each with "name", "age", "gender", '
+        '"medicines", "side_effects" and "treatment"',
+    )
+    parser.add_argument(
+        "--update",
+        help='JSON file with a list of {"index", "record"} replacing the entries on those positions',
+    )
+    parser.add_argument(
+        "--delete",
+        type=lambda x: [int(i) for i in x.split(",")],
+        default=[],
+        help="Comma-separated positions of the entries to delete",
+    )
+
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("INGEST_TOKEN"),
+        help="Ingest token of the server, defaults to the INGEST_TOKEN environment variable",
+    )
+
+    args = parser.parse_args()
+
+    if not (args.append or args.update or args.delete):
+        parser.error("one of --append, --update or --delete is required")
+
+    if not args.token:
+        parser.error("the ingest token is required, pass --token or set INGEST_TOKEN")
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # The keys of the dataset are needed to encrypt the records
+    client: Client = Client(generate=False)
+
+    change: dict = {"delete": args.delete}
+
+    if args.append:
+        with open(args.append, "r") as f:
+            change["append"] = client.prepare_entries(json.load(f))
+
+    if args.update:
+        with open(args.update, "r") as f:
+            updates: list[dict] = json.load(f)
+
+        entries = client.prepare_entries([update["record"] for update in updates])
+        change["update"] = [
+            {"index": update["index"], "entry": entry} for update, entry in zip(updates, entries)
+        ]
+
+    print("[*] Sending the changes...")
+    result = client.ingest(args.endpoint, change, args.token)
+
+    print(f"[+] Appended entries on positions: {result['appended']}")
+    print(f"[i] The dataset now holds {result['entries']} positions")
+
+
+if __name__ == "__main__":
+    main()
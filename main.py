@@ -1,39 +1,149 @@
-import time
+import sys
+import json
 import argparse
+import requests
+import contextlib
 from classes.client import Client
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Medicine Side Effects Search")
 
-    # Required arguments
+    # Required arguments, the patient is read from stdin in the interactive mode
     parser.add_argument("endpoint", help="Query system endpoint")
-    parser.add_argument("--age", type=int, required=True, help="Patients's age")
-    parser.add_argument(
-        "--gender", choices=["male", "female"], required=True, help="Patients's gender"
-    )
+    parser.add_argument("--age", type=int, help="Patients's age")
+    parser.add_argument("--gender", choices=["male", "female"], help="Patients's gender")
 
     # At least one value must be supplied for each list
     parser.add_argument(
         "--medicine-ids",
-        required=True,
         type=lambda x: [int(i) for i in x.split(",")],
         help="Comma-separated list of medicine IDs",
     )
     parser.add_argument(
         "--side-effect-ids",
-        required=True,
         type=lambda x: [int(i) for i in x.split(",")],
         help="Comma-separated list of side effect IDs",
     )
     parser.add_argument("--outfile", type=str, help="Enable output to file")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "entry", "packed"],
+        default="auto",
+        help="FHE evaluation mode, packed compares a whole block of entries per ciphertext "
+        "and auto lets the server choose the cheapest",
+    )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--protocol",
+        choices=["json", "binary"],
+        default="json",
+        help="Wire protocol, binary sends raw length-prefixed ciphertexts instead of hex in JSON",
+    )
+
+    parser.add_argument(
+        "--decrypt-workers",
+        type=int,
+        default=0,
+        help="Decrypt the results in a pool of this size (0 decrypts on the main thread)",
+    )
+    parser.add_argument(
+        "--decrypt-pool",
+        choices=["process", "thread"],
+        default="process",
+        help="Kind of the decryption pool",
+    )
+    parser.add_argument(
+        "--fields",
+        type=lambda x: x.split(","),
+        help="Comma-separated fields of the found entries to fetch, all of them by default",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the phase timings, transferred sizes and noise budget of the query",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the search with cProfile, also on the server if it allows the header",
+    )
+
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        help="Keep the client warm and answer one JSON patient per line of stdin",
+    )
+
+    args = parser.parse_args()
+
+    if not args.interactive:
+        missing = [
+            option
+            for option, value in [
+                ("--age", args.age),
+                ("--gender", args.gender),
+                ("--medicine-ids", args.medicine_ids),
+                ("--side-effect-ids", args.side_effect_ids),
+            ]
+            if value is None
+        ]
+
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    return args
+
+
+def interactive(client: Client, args) -> None:
+    """
+    This function answers queries until stdin is closed. Every line is a JSON object
+    with "age", "gender", "medicines", "side_effects" and optionally "mode", every
+    answer is one JSON line with the found entries and the timings. Progress output
+    goes to stderr, so stdout only carries the answers.
+    """
+
+    print("[i] Client ready, reading patients from stdin", file=sys.stderr)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        try:
+            patient = json.loads(line)
+
+            with contextlib.redirect_stdout(sys.stderr):
+                result = client.search_patient(
+                    args.endpoint,
+                    patient["medicines"],
+                    patient["side_effects"],
+                    patient["age"],
+                    patient["gender"],
+                    patient.get("mode", args.mode),
+                    args.protocol,
+                    args.fields,
+                )
+
+            answer = {"found": result.found, "entries": result.entries, "timings": result.timings}
+        except (ValueError, KeyError) as e:
+            answer = {"error": str(e)}
+        except requests.RequestException as e:
+            # The server is unreachable or the connection broke, the next patient may succeed
+            answer = {"error": f"Request failed: {e}"}
+
+        print(json.dumps(answer), flush=True)
 
 
 def main():
-    client: Client = Client()
     args = parse_args()
+    client: Client = Client(
+        args.decrypt_workers, args.decrypt_pool, profile_rate=1.0 if args.profile else 0.0
+    )
+
+    if args.interactive:
+        interactive(client, args)
+        return
 
     endpoint = args.endpoint
     age = args.age
@@ -41,28 +151,34 @@ def main():
     medicines = args.medicine_ids
     side_effects = args.side_effect_ids
     outfile = args.outfile
+    mode = args.mode
+    protocol = args.protocol
 
     print("\n[i] Supplied information:")
     print(f"\tAge: {age}")
     print(f"\tGender: {gender}")
     print(f"\tMedicine IDs: {medicines}")
     print(f"\tSide Effect IDs: {side_effects}")
-
-    start_time = time.time()
-
-    print("[*] Preparing query")
-    query = client.prepare_query(medicines, side_effects, age, gender)
+    print(f"\tMode: {mode}")
 
     print("[*] Querying the information...")
-    result = client.search(endpoint, query.serialize())
+    result = client.search_patient(
+        endpoint, medicines, side_effects, age, gender, mode, protocol, args.fields
+    )
+
+    print(f"[i] Query finished after a total of {result.timings['total']:.2f} seconds")
 
-    end_time = time.time()
-    elapsed_time = end_time - start_time
+    if args.stats:
+        print(f"[i] Query stats:\n\n{result.stats_json()}\n")
 
-    print(f"[i] Query finished after a total of {elapsed_time:.2f} seconds")
+    if not result.found:
+        print("[x] Entry not found")
+        exit(1)
 
     print("[+] Finished successfully")
 
+    result = result.to_json()
+
     if outfile:
         with open(outfile, "w") as f:
             f.write(result)
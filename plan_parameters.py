@@ -0,0 +1,48 @@
+import argparse
+from classes.noise import match_depth
+from classes.parameters import PARAMETERS_FILE, plan_parameters, save_parameters
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plan BFV parameters for the age radius")
+
+    parser.add_argument("--radius", type=int, default=2, help="Age radius of the match")
+    parser.add_argument(
+        "--packing-density",
+        type=int,
+        default=1,
+        help="Number of entries that have to fit into one packed block",
+    )
+    parser.add_argument(
+        "--security", type=int, choices=[128, 192, 256], default=128, help="Security level in bits"
+    )
+    parser.add_argument(
+        "--plain-modulus-bits",
+        type=int,
+        help="Size of the plain modulus, the smallest usable one is picked by default",
+    )
+    parser.add_argument("--output", default=PARAMETERS_FILE, help="Parameter file to write")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    parameters = plan_parameters(
+        args.radius, args.packing_density, args.security, args.plain_modulus_bits
+    )
+
+    print(f"[i] Radius {args.radius} needs multiplicative depth {match_depth(args.radius)}")
+    print(f"\tPoly modulus degree: {parameters['poly_modulus_degree']}")
+    print(f"\tCoeff modulus bits: {parameters['coeff_modulus_bits']}")
+    print(f"\tPlain modulus bits: {parameters['plain_modulus_bits']}")
+
+    save_parameters(parameters, args.output)
+
+    print(f"[+] Wrote parameters to a file: {args.output}")
+    print("[!] Keys and datasets have to be generated again for the new parameters")
+
+
+if __name__ == "__main__":
+    main()
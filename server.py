@@ -1,81 +1,434 @@
+import os
+import hmac
 import json
+import queue
+import argparse
+import threading
 import urllib.parse
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator
 import ssl
 
+from classes.batch_query import BatchQuery
 from classes.database import Database
+from classes.metrics import Metrics
+from classes.planner import BudgetExceeded
+from classes.profiling import PROFILE_DIR, PROFILE_HEADER, Profiler
 from classes.query import Query
+from classes.session import SessionStore
+from classes.shards import ShardError, ShardPool
+from classes.wire import (
+    BINARY_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    encode_results_binary,
+    encode_results_json,
+    encode_results_stream,
+)
 
 IP_ADDRESS = "127.0.0.1"
 PORT = 8000
 CERT_FILE = "/tmp/certificate.pem"
 KEY_FILE = "/tmp/private_key.pem"
 
+# Seconds an idle keep-alive connection is kept open
+KEEP_ALIVE_TIMEOUT = 30
+
+# Ciphertexts computed ahead of the network while streaming
+STREAM_QUEUE_SIZE = 16
+STREAM_END = object()
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """
+    This function parses a shard given as I/N, counted from 1, into (index, count).
+    """
+
+    shard, shards = (int(i) for i in value.split("/"))
+
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"shard {value} is not in 1/N to N/N")
+
+    return shard - 1, shards
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Medicine Side Effects Search Server")
+
+    parser.add_argument(
+        "--parallel-workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Evaluate large optimized datasets, and queries that arrive while others are "
+        "running, in a process pool of this size (defaults to the number of cores, "
+        "0 disables it)",
+    )
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on")
+    parser.add_argument(
+        "--profile-rate",
+        type=float,
+        default=0.0,
+        help="Profile this share of the POST requests with cProfile (0 disables it)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=PROFILE_DIR,
+        help="Directory the request profiles are written to",
+    )
+    parser.add_argument(
+        "--profile-header",
+        action="store_true",
+        help=f"Also profile every request that sends the {PROFILE_HEADER} header",
+    )
+    parser.add_argument(
+        "--query-budget",
+        type=float,
+        help="Reject queries whose FHE evaluation is estimated to take longer (seconds)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Serve only shard I of N of the dataset, given as I/N counted from 1",
+    )
+    parser.add_argument(
+        "--shards",
+        type=lambda x: x.split(","),
+        help="Run as the coordinator of the comma-separated shard servers, in shard order",
+    )
+    parser.add_argument(
+        "--ingest-token",
+        default=os.environ.get("INGEST_TOKEN"),
+        help="Bearer token the data owner sends to /ingest, defaults to the INGEST_TOKEN "
+        "environment variable. Without a token the endpoint is disabled",
+    )
+
+    return parser.parse_args()
+
 
 class Server:
-    def __init__(self) -> None:
-        self.database = Database()
-        self.database.load_dataset()
+    def __init__(
+        self,
+        parallel_workers: int = 0,
+        database: Database | None = None,
+        shard: tuple[int, int] | None = None,
+        query_budget: float | None = None,
+        profiler: Profiler | None = None,
+        ingest_token: str | None = None,
+    ) -> None:
+        # A database loaded by the caller is used as is, e.g. by the benchmark
+        if database is None:
+            database = Database(shard=shard, query_budget=query_budget)
+            database.load_dataset()
+
+        self.database = database
+        self.metrics = database.metrics
+        self.profiler = profiler or Profiler()
+
+        if parallel_workers > 0:
+            self.database.enable_parallel(parallel_workers)
+
+        # Snapshots and optimized datasets of the queries, referenced by the handle
+        # returned to the client
+        self.sessions = SessionStore()
+
+        # Changes of the dataset are only accepted from the data owner holding this token
+        self.ingest_token = ingest_token
+
+        # Threads producing the streamed responses, see `stream`. The SEAL bindings hold
+        # the GIL, so they overlap sending with evaluation but add no CPU parallelism,
+        # which comes from the process pool of `--parallel-workers`
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    def stream(self, iterable: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        This function runs the FHE evaluation behind `iterable` on a thread of the
+        executor and yields its output on the calling thread, so sending a result
+        overlaps with computing the next one.
+        """
+
+        items: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        cancelled = threading.Event()
+
+        def offer(item) -> bool:
+            # Give up once the request handler is gone
+            while not cancelled.is_set():
+                try:
+                    items.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+
+            return False
+
+        def produce() -> None:
+            try:
+                for item in iterable:
+                    if not offer(item):
+                        return
+            finally:
+                offer(STREAM_END)
+
+        future = self.executor.submit(produce)
+
+        try:
+            while (item := items.get()) is not STREAM_END:
+                yield item
+        finally:
+            cancelled.set()
+
+        # Re-raise errors of the evaluation
+        future.result()
 
     class ServerHTTPHandler(BaseHTTPRequestHandler):
-        def __init__(self, request, client_address, server, database, *args, **kwargs):
-            self.database = database
+        # Needed for chunked transfer encoding and keep-alive connections
+        protocol_version = "HTTP/1.1"
+
+        # Idle keep-alive connections are closed after this many seconds
+        timeout = KEEP_ALIVE_TIMEOUT
+
+        def __init__(self, request, client_address, server, app, *args, **kwargs):
+            self.app = app
+            self.database = app.database
             super().__init__(request, client_address, server, *args, **kwargs)
 
         def do_POST(self):
-            if self.path.startswith("/query"):
+            # Sampled requests are profiled from parsing the body to sending the last result
+            self.profile = self.app.profiler.start(
+                self.headers.get("X-Request-Id"), PROFILE_HEADER in self.headers
+            )
+
+            try:
+                with self.profile.section():
+                    self.route_post()
+            finally:
+                self.profile.finish()
+
+        def route_post(self):
+            if urllib.parse.urlparse(self.path).path.endswith("/fetch"):
+                self.fetch_handler()
+            elif self.path.startswith("/query"):
                 self.post_handler()
+            elif self.path.startswith("/batch"):
+                self.batch_handler()
+            elif self.path.startswith("/ingest"):
+                self.ingest_handler()
             else:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Not Found")
+                # The body was not read, so the connection can not be reused
+                self.close_connection = True
+                self.send_body(404, "text/plain", b"Not Found")
 
         def do_GET(self):
-            if self.path.startswith("/query"):
+            # Data of batch matches is fetched with the handle of the patient
+            if self.path.startswith("/query") or self.path.startswith("/batch"):
                 self.get_handler()
+            elif self.path.startswith("/metrics"):
+                self.metrics_handler()
             else:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Not Found")
+                self.send_body(404, "text/plain", b"Not Found")
 
-        def post_handler(self):
-            # Set the response status code
-            self.send_response(200)
+        def send_body(
+            self, status: int, content_type: str, body: bytes, headers: dict | None = None
+        ):
+            """
+            This function sends a complete response, every response carries its length
+            so the connection can be kept open.
+            """
+
+            self.send_response(status)
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
 
-            # Set the response headers
-            self.send_header("Content-type", "text/html")
             self.end_headers()
+            self.wfile.write(body)
 
-            # Read the POST data
+        def send_chunked(
+            self,
+            status: int,
+            content_type: str,
+            chunks: Iterable[bytes],
+            headers: dict | None = None,
+        ):
+            """
+            This function sends the response with chunked transfer encoding, every chunk is
+            flushed to the client as soon as it is available.
+            """
+
+            self.send_response(status)
+            self.send_header("Content-type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+
+            self.end_headers()
+
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+
+        def read_post_data(self) -> bytes:
             content_length = int(self.headers["Content-Length"])
-            post_data = self.rfile.read(content_length)
 
-            # Parse and decode the POST data
-            post_data = urllib.parse.unquote(post_data.decode("utf-8"))
+            self.app.metrics.increment("queries")
+            self.app.metrics.observe("query_bytes", content_length)
+
+            return self.rfile.read(content_length)
+
+        def post_handler(self):
+            # Read the POST data
+            post_data = self.read_post_data()
+
+            try:
+                # Deserialize the query, binary queries are raw frames, JSON ones may be URL encoded
+                with self.database.metrics.phase("deserialize"):
+                    if self.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+                        query = Query.deserialize_binary(post_data)
+                    else:
+                        query = Query.deserialize(urllib.parse.unquote(post_data.decode("utf-8")))
+
+                # Filter, evaluate and fetch the same dataset, whatever is ingested meanwhile
+                snapshot = self.database.snapshot
+
+                # Filter the dataset and keep the optimized dataset for the follow-up GET request
+                candidates = self.database.optimize_dataset(query, snapshot)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_malformed_query(e)
+                return
+
+            # Counted as running until the last result is sent, see `Database.plan_query`
+            with self.database.evaluating():
+                try:
+                    plan = self.database.plan_query(query, candidates, snapshot)
+                except BudgetExceeded as e:
+                    self.send_budget_exceeded(e)
+                    return
+
+                handle = self.app.sessions.create((snapshot, candidates))
+
+                header, ciphertexts = self.database.search_iter(query, candidates, plan, snapshot)
+
+                # The size of the optimized dataset lets a coordinator route fetches back here
+                headers = {
+                    "X-Query-Handle": handle,
+                    "X-Candidates": str(len(candidates)),
+                    "X-Query-Plan": json.dumps(plan.to_dict()),
+                }
+
+                self.send_results(header, ciphertexts, headers)
+
+        def batch_handler(self):
+            post_data = self.read_post_data()
+
+            try:
+                with self.database.metrics.phase("deserialize"):
+                    if self.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+                        batch = BatchQuery.deserialize_binary(post_data)
+                    else:
+                        batch = BatchQuery.deserialize(
+                            urllib.parse.unquote(post_data.decode("utf-8"))
+                        )
+
+                snapshot = self.database.snapshot
+
+                # Every patient gets its own handle for fetching the data of its matches
+                candidates = self.database.batch_candidates(batch, snapshot)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_malformed_query(e)
+                return
 
-            # Deserialize the query
-            query = Query.deserialize(post_data)
+            # Batches are evaluated inline, but still keep concurrent queries off this core
+            with self.database.evaluating():
+                try:
+                    plan = self.database.plan_batch(batch, candidates, snapshot)
+                except BudgetExceeded as e:
+                    self.send_budget_exceeded(e)
+                    return
+
+                header, ciphertexts = self.database.search_batch_iter(
+                    batch, candidates, plan, snapshot
+                )
+
+                for patient, patient_candidates in zip(header["patients"], candidates):
+                    patient["handle"] = self.app.sessions.create((snapshot, patient_candidates))
+
+                plan_header = {"X-Query-Plan": json.dumps(plan.to_dict())}
+                self.send_results(header, ciphertexts, plan_header)
+
+        def send_malformed_query(self, e: Exception):
+            """
+            This function answers a query that can not be parsed or filtered (bad JSON, a
+            missing field or wrong number of frames) with 400, which a coordinator passes
+            on to its client.
+            """
+
+            error = json.dumps({"error": f"Malformed query: {e}"}).encode("utf-8")
+            self.send_body(400, JSON_CONTENT_TYPE, error)
+
+        def send_budget_exceeded(self, e: BudgetExceeded):
+            """
+            This function rejects a query over the query budget with 413 and the plan that
+            exceeded it, so clients can tell it from a malformed query.
+            """
+
+            self.database.metrics.increment("rejected")
+
+            error = json.dumps({"error": str(e), "plan": e.plan.to_dict()}).encode("utf-8")
+            self.send_body(413, JSON_CONTENT_TYPE, error)
+
+        def send_results(
+            self, header: dict, ciphertexts: Iterator[bytes], headers: dict | None = None
+        ):
+            """
+            This function evaluates the results and sends them in the protocol requested
+            by the client. Only streamed responses evaluate on a thread of the executor,
+            complete responses are evaluated on the handler thread before they are sent.
+            """
 
-            # Clear the optimized dataset, next query has to have a fresh instance
-            self.database.optimized_dataset.clear()
+            metrics = self.app.metrics
 
-            # Search the database using the query
-            results = self.database.search(query)
+            # The evaluation may run on the executor, outside the section of the handler
+            ciphertexts = self.profile.wrap(ciphertexts)
+
+            if self.profile.enabled:
+                headers = {**(headers or {}), "X-Request-Id": self.profile.request_id}
+
+            # Binary results are streamed to HTTP/1.1 clients one ciphertext at a time
+            if BINARY_CONTENT_TYPE in self.headers.get("Accept", ""):
+                if self.request_version == "HTTP/1.1":
+                    # Overlaps with the evaluation, so this phase covers the whole response
+                    with metrics.phase("network"):
+                        chunks = encode_results_stream(header, self.app.stream(ciphertexts))
+                        self.send_chunked(200, BINARY_CONTENT_TYPE, chunks, headers)
+                else:
+                    results = {**header, "ciphertexts": list(ciphertexts)}
+
+                    with metrics.phase("network"):
+                        self.send_body(
+                            200, BINARY_CONTENT_TYPE, encode_results_binary(results), headers
+                        )
+
+                return
+
+            # Evaluate all results, nothing is sent before the last one
+            results = {**header, "ciphertexts": list(ciphertexts)}
 
             # Serialize the results
-            serialized_result = json.dumps(results)
+            with metrics.phase("encode"):
+                serialized_result = encode_results_json(results)
+
+            metrics.observe("response_bytes", len(serialized_result))
 
             # Set the response content
-            self.wfile.write(serialized_result.encode("utf-8"))
+            with metrics.phase("network"):
+                self.send_body(200, JSON_CONTENT_TYPE, serialized_result, headers)
 
         def get_handler(self):
-            # Set the response status code
-            self.send_response(200)
-
-            # Set the response headers
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-
             # Parse the query parameters from the URL
             parsed_url = urllib.parse.urlparse(self.path)
             query_params = urllib.parse.parse_qs(parsed_url.query)
@@ -83,40 +436,308 @@ class Server:
             # Extract indexes from the query and return data based on the indexes
             if "indexes" in query_params:
                 try:
+                    session = self.app.sessions.get(query_params.get("handle", [""])[0])
+
+                    if session is None:
+                        raise ValueError("Unknown or expired query handle")
+
+                    snapshot, candidates = session
                     indexes = json.loads(query_params["indexes"][0])
-                    restult: str = self.database.get_data(indexes)
 
-                    self.wfile.write(restult.encode("utf-8"))
-                except ValueError as e:
+                    with self.database.metrics.phase("fetch"):
+                        restult: str = self.database.get_data(
+                            indexes, candidates, snapshot=snapshot
+                        )
+
+                    self.send_body(200, JSON_CONTENT_TYPE, restult.encode("utf-8"))
+                except (ValueError, IndexError) as e:
                     # If there's an error in parsing the JSON or processing the data
-                    self.send_response(400)
-                    self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+                    error = json.dumps({"error": str(e)}).encode("utf-8")
+                    self.send_body(400, JSON_CONTENT_TYPE, error)
             else:
                 # If 'indexes' parameter is not present
-                self.send_response(400)
-                self.wfile.write(b"Missing required parameter: numbers")
+                self.send_body(400, "text/plain", b"Missing required parameter: indexes")
+
+        def fetch_handler(self):
+            """
+            This function returns the data of the found entries of a query. The body is a JSON
+            object with the query "handle", the "indexes" into its optimized dataset and
+            optionally the "fields" to return.
+            """
+
+            content_length = int(self.headers["Content-Length"])
+            post_data = self.rfile.read(content_length)
+
+            try:
+                request = json.loads(post_data)
+
+                session = self.app.sessions.get(request.get("handle", ""))
+
+                if session is None:
+                    raise ValueError("Unknown or expired query handle")
+
+                snapshot, candidates = session
+
+                with self.database.metrics.phase("fetch"):
+                    result: str = self.database.get_data(
+                        request["indexes"], candidates, request.get("fields"), snapshot
+                    )
+
+                self.send_body(200, JSON_CONTENT_TYPE, result.encode("utf-8"))
+            except (ValueError, IndexError, KeyError, TypeError) as e:
+                error = json.dumps({"error": str(e)}).encode("utf-8")
+                self.send_body(400, JSON_CONTENT_TYPE, error)
+
+        def ingest_handler(self):
+            """
+            This function applies a change of the dataset sent by the data owner, see
+            `Database.ingest`, and returns the positions of the appended entries. The
+            request has to carry the ingest token of the server as a Bearer token.
+            """
+
+            if not self.authorize_ingest():
+                return
+
+            content_length = int(self.headers["Content-Length"])
+            post_data = self.rfile.read(content_length)
+
+            try:
+                with self.database.metrics.phase("ingest"):
+                    positions = self.database.ingest(json.loads(post_data))
+
+                self.database.metrics.increment("ingests")
 
-    def start_server(self):
-        server_address = (IP_ADDRESS, PORT)
+                result = {"appended": positions, "entries": len(self.database.snapshot.dataset)}
+                self.send_body(200, JSON_CONTENT_TYPE, json.dumps(result).encode("utf-8"))
+            except (ValueError, IndexError, KeyError, TypeError) as e:
+                error = json.dumps({"error": str(e)}).encode("utf-8")
+                self.send_body(400, JSON_CONTENT_TYPE, error)
+
+        def authorize_ingest(self) -> bool:
+            """
+            This function checks the Bearer token of an ingest request and answers it with
+            403 when the server has no ingest token or 401 when the token does not match.
+            The body of a rejected request is never read, so the connection is closed.
+            """
+
+            token = self.app.ingest_token
+
+            if token is None:
+                status, message = 403, "Ingesting is disabled, start the server with --ingest-token"
+            else:
+                supplied = self.headers.get("Authorization", "").removeprefix("Bearer ")
+
+                if hmac.compare_digest(supplied.encode(), token.encode()):
+                    return True
+
+                status, message = 401, "Missing or invalid ingest token"
+
+            self.database.metrics.increment("ingests_rejected")
+
+            error = json.dumps({"error": message}).encode("utf-8")
+            self.send_body(status, JSON_CONTENT_TYPE, error, {"Connection": "close"})
+
+            return False
+
+        def metrics_handler(self):
+            """
+            This function returns the collected per-phase timings, observed sizes,
+            counters and the state of the ciphertext cache as JSON.
+            """
+
+            metrics = {
+                **self.database.metrics.snapshot(),
+                "cache": self.database.ciphertexts.stats(),
+                "filters": self.database.filters.stats(),
+                "planner": self.database.planner.stats(),
+                "profiler": self.app.profiler.stats(),
+                "sessions": len(self.app.sessions),
+            }
+
+            self.send_body(200, JSON_CONTENT_TYPE, json.dumps(metrics, indent=4).encode("utf-8"))
+
+    def create_httpd(self, port: int = PORT) -> ThreadingHTTPServer:
+        """
+        This function returns the HTTPS server bound to `port`, 0 picks a free port.
+        """
+
+        server_address = (IP_ADDRESS, port)
 
         # Create an SSL context
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ssl_context.load_cert_chain(certfile=CERT_FILE, keyfile=KEY_FILE)
 
-        httpd = HTTPServer(
+        httpd = ThreadingHTTPServer(
             server_address,
             lambda request, client_address, server: self.ServerHTTPHandler(
-                request, client_address, server, self.database
+                request, client_address, server, self
             ),
         )
 
         httpd.socket = ssl_context.wrap_socket(httpd.socket, server_side=True)
 
-        print(f"Server listening on port {PORT}...")
+        return httpd
+
+    def start_server(self, port: int = PORT):
+        httpd = self.create_httpd(port)
+
+        print(f"Server listening on port {port}...")
 
         httpd.serve_forever()
 
 
+class Coordinator(Server):
+    def __init__(self, shards: list[str], profiler: Profiler | None = None) -> None:
+        """
+        Front server of a sharded deployment. It holds no dataset, every query is sent to
+        all shard servers (`server.py --shard I/N`) and their results are merged into one
+        response, so clients talk to the coordinator as to a single server. Fetches of
+        the found entries are routed back to the shards that own them.
+        """
+
+        self.shards = ShardPool(shards)
+        self.database = None
+        self.metrics = Metrics()
+        self.profiler = profiler or Profiler()
+
+        # Parts of the merged optimized datasets, see `ShardPool.merge`
+        self.sessions = SessionStore()
+
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+        print(f"[i] Coordinating {len(shards)} shards")
+
+    # Same name as the handler of `Server`, so `create_httpd` serves this one
+    class ServerHTTPHandler(Server.ServerHTTPHandler):
+        def post_handler(self):
+            self.scatter_handler(batch=False)
+
+        def batch_handler(self):
+            self.scatter_handler(batch=True)
+
+        def scatter_handler(self, batch: bool):
+            post_data = self.read_post_data()
+            content_type = self.headers.get("Content-Type", JSON_CONTENT_TYPE)
+
+            try:
+                with self.app.metrics.phase("scatter"):
+                    results = self.app.shards.scatter(
+                        self.path, post_data, content_type, self.profile.headers()
+                    )
+            except (ShardError, ValueError, OSError) as e:
+                self.send_shard_error(e)
+                return
+
+            headers = {"X-Query-Plan": json.dumps({"shards": [result.plan for result in results]})}
+
+            if batch:
+                header, parts = self.app.shards.merge_batch(results)
+
+                for patient, patient_parts in zip(header["patients"], parts):
+                    patient["handle"] = self.app.sessions.create(patient_parts)
+            else:
+                header, parts = self.app.shards.merge(results)
+                headers["X-Query-Handle"] = self.app.sessions.create(parts)
+                headers["X-Candidates"] = str(sum(size for *_, size in parts))
+
+            self.send_results(header, self.app.shards.gather(results), headers)
+
+        def get_handler(self):
+            parsed_url = urllib.parse.urlparse(self.path)
+            query_params = urllib.parse.parse_qs(parsed_url.query)
+
+            if "indexes" not in query_params:
+                self.send_body(400, "text/plain", b"Missing required parameter: indexes")
+                return
+
+            self.route_fetch(
+                parsed_url.path.rstrip("/") + "/fetch",
+                query_params.get("handle", [""])[0],
+                json.loads(query_params["indexes"][0]),
+            )
+
+        def fetch_handler(self):
+            content_length = int(self.headers["Content-Length"])
+
+            try:
+                request = json.loads(self.rfile.read(content_length))
+            except ValueError as e:
+                error = json.dumps({"error": str(e)}).encode("utf-8")
+                self.send_body(400, JSON_CONTENT_TYPE, error)
+                return
+
+            self.route_fetch(
+                urllib.parse.urlparse(self.path).path,
+                request.get("handle", ""),
+                request.get("indexes"),
+                request.get("fields"),
+            )
+
+        def route_fetch(
+            self, path: str, handle: str, indexes: list[int], fields: list[str] | None = None
+        ):
+            try:
+                parts = self.app.sessions.get(handle)
+
+                if parts is None:
+                    raise ValueError("Unknown or expired query handle")
+
+                with self.app.metrics.phase("fetch"):
+                    entries = self.app.shards.fetch(path, parts, indexes, fields)
+
+                self.send_body(200, JSON_CONTENT_TYPE, json.dumps(entries).encode("utf-8"))
+            except (ShardError, OSError) as e:
+                self.send_shard_error(e)
+            except (ValueError, IndexError, KeyError, TypeError) as e:
+                error = json.dumps({"error": str(e)}).encode("utf-8")
+                self.send_body(400, JSON_CONTENT_TYPE, error)
+
+        def send_shard_error(self, e: Exception):
+            """
+            This function answers with the client error (4xx) of a shard unchanged, e.g.
+            a malformed query or one over the query budget. Every other failure of the
+            shards is answered with 502.
+            """
+
+            if isinstance(e, ShardError) and 400 <= e.status < 500:
+                self.send_body(e.status, e.content_type, e.body)
+                return
+
+            error = json.dumps({"error": str(e)}).encode("utf-8")
+            self.send_body(502, JSON_CONTENT_TYPE, error)
+
+        def ingest_handler(self):
+            # The body is not read, so the connection can not be reused
+            self.close_connection = True
+
+            error = {"error": "Changes are ingested by the shard that serves the entries"}
+            self.send_body(400, JSON_CONTENT_TYPE, json.dumps(error).encode("utf-8"))
+
+        def metrics_handler(self):
+            metrics = {
+                **self.app.metrics.snapshot(),
+                "profiler": self.app.profiler.stats(),
+                "sessions": len(self.app.sessions),
+                "shards": self.app.shards.metrics(),
+            }
+
+            self.send_body(200, JSON_CONTENT_TYPE, json.dumps(metrics, indent=4).encode("utf-8"))
+
+
 if __name__ == "__main__":
-    server: Server = Server()
-    server.start_server()
+    args = parse_args()
+
+    profiler = Profiler(args.profile_rate, args.profile_dir, args.profile_header)
+
+    if args.shards:
+        server: Server = Coordinator(args.shards, profiler)
+    else:
+        server = Server(
+            args.parallel_workers,
+            shard=args.shard,
+            query_budget=args.query_budget,
+            profiler=profiler,
+            ingest_token=args.ingest_token,
+        )
+
+    server.start_server(args.port)
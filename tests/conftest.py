@@ -0,0 +1,34 @@
+import random
+import pytest
+
+
+@pytest.fixture
+def random_entries():
+    """
+    Factory of random entries in the format of `dataset.json`. Medicine and side effect
+    IDs are drawn from the inclusive `medicines` and `side_effects` ranges, a small range
+    makes entries and queries share IDs. Entries may list an ID twice, like generated
+    datasets do.
+    """
+
+    def generate(
+        count: int,
+        seed: int = 0,
+        medicines: tuple[int, int] = (1, 8),
+        side_effects: tuple[int, int] = (1, 5),
+    ) -> list[dict]:
+        rng = random.Random(seed)
+
+        return [
+            {
+                "name": rng.randbytes(rng.randint(0, 12)).hex(),
+                "age": rng.randint(1, 99),
+                "medicines": [rng.randint(*medicines) for _ in range(rng.randint(0, 4))],
+                "side_effects": [rng.randint(*side_effects) for _ in range(rng.randint(0, 3))],
+                "treatment": rng.randbytes(rng.randint(1, 8)).hex(),
+                "encrypted_m": rng.randbytes(rng.randint(1, 300)).hex(),
+            }
+            for _ in range(count)
+        ]
+
+    return generate
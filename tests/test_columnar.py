@@ -0,0 +1,133 @@
+import os
+import numpy as np
+import pytest
+
+from classes.columnar import MAGIC, ColumnarDataset, write_columnar
+
+# IDs above 255 catch truncated value columns
+ID_RANGES = {"medicines": (1, 500), "side_effects": (1, 50)}
+
+
+def assert_matches(dataset: ColumnarDataset, entries: list[dict]) -> None:
+    assert len(dataset) == len(entries)
+
+    for index, entry in enumerate(entries):
+        record = dataset[index]
+
+        assert dict(record) == {k: v for k, v in entry.items() if k != "encrypted_m"}
+        assert dataset.ciphertext(index) == bytes.fromhex(entry["encrypted_m"])
+
+    assert [dict(record) for record in dataset] == [dict(dataset[i]) for i in range(len(entries))]
+
+
+@pytest.fixture
+def columnar_file(tmp_path, random_entries):
+    entries = random_entries(64, **ID_RANGES)
+    path = str(tmp_path / "dataset.bin")
+
+    write_columnar(entries, path)
+
+    return entries, path
+
+
+def test_from_records_round_trip(random_entries):
+    entries = random_entries(64, **ID_RANGES)
+
+    assert_matches(ColumnarDataset.from_records(entries), entries)
+
+
+def test_mmap_round_trip(columnar_file):
+    entries, path = columnar_file
+    dataset = ColumnarDataset(path)
+
+    assert dataset.path == path
+    assert_matches(dataset, entries)
+
+    # Every column starts aligned, so numpy can view the mapping without copying
+    for column in dataset.columns.values():
+        assert column.ctypes.data % column.dtype.itemsize == 0
+
+
+def test_mmap_matches_in_memory_columns(columnar_file):
+    entries, path = columnar_file
+
+    mapped = ColumnarDataset(path)
+    in_memory = ColumnarDataset.from_records(entries)
+
+    for name, column in in_memory.columns.items():
+        assert np.array_equal(mapped.columns[name], column)
+        assert mapped.columns[name].dtype == column.dtype
+
+
+def test_file_is_padded_to_the_alignment(columnar_file):
+    _, path = columnar_file
+
+    assert os.path.getsize(path) % 8 == 0
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "dataset.json"
+    path.write_bytes(b"[" + b" " * len(MAGIC) + b"]")
+
+    with pytest.raises(ValueError):
+        ColumnarDataset(str(path))
+
+
+@pytest.mark.parametrize("mapped", [False, True])
+def test_select(columnar_file, mapped):
+    entries, path = columnar_file
+    dataset = ColumnarDataset(path) if mapped else ColumnarDataset.from_records(entries)
+
+    dataset.select(10, 40)
+    assert_matches(dataset, entries[10:40])
+
+    # A selection is relative to the previous one
+    dataset.select(5, 15)
+    assert_matches(dataset, entries[15:25])
+
+    with pytest.raises(IndexError):
+        dataset[10]
+
+
+def test_csr_columns_of_a_selection(random_entries):
+    entries = random_entries(50, **ID_RANGES)
+
+    dataset = ColumnarDataset.from_records(entries)
+    dataset.select(20, 30)
+
+    offsets, values = dataset.csr_columns("medicines")
+
+    assert offsets[0] == 0
+    assert len(offsets) == 11
+
+    for index, entry in enumerate(entries[20:30]):
+        assert values[offsets[index] : offsets[index + 1]].tolist() == entry["medicines"]
+
+
+def test_empty_selection(random_entries):
+    dataset = ColumnarDataset.from_records(random_entries(5))
+    dataset.select(2, 2)
+
+    assert len(dataset) == 0
+    assert list(dataset) == []
+
+    offsets, values = dataset.csr_columns("side_effects")
+    assert offsets.tolist() == [0]
+    assert len(values) == 0
+
+
+def test_non_hex_fields_are_stored_as_text():
+    entry = {
+        "name": "test",
+        "age": 42,
+        "medicines": [1],
+        "side_effects": [],
+        "treatment": "none",
+        "encrypted_m": "00ff",
+    }
+
+    dataset = ColumnarDataset.from_records([entry])
+
+    assert dataset.blob("names", 0) == b"test"
+    assert dataset.blob("treatments", 0) == b"none"
+    assert dataset.ciphertext(0) == b"\x00\xff"
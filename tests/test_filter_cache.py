@@ -0,0 +1,127 @@
+import random
+import pytest
+
+from classes.columnar import ColumnarDataset
+from classes.filter_cache import FilterCache
+from classes.index import InvertedIndex
+
+# Few IDs, so queries repeat and share subsets
+ID_RANGES = {"medicines": (1, 20), "side_effects": (1, 10)}
+
+
+def build_index(entries: list[dict]) -> InvertedIndex:
+    return InvertedIndex.build_columnar(ColumnarDataset.from_records(entries))
+
+
+def brute_force(entries: list[dict], medicines: list[int], side_effects: list[int]) -> list[int]:
+    return [
+        position
+        for position, entry in enumerate(entries)
+        if set(entry["medicines"]) & set(medicines)
+        and set(entry["side_effects"]) & set(side_effects)
+    ]
+
+
+def random_queries(count: int, seed: int) -> list[tuple[list[int], list[int]]]:
+    rng = random.Random(seed)
+
+    return [
+        (
+            [rng.randint(1, 22) for _ in range(rng.randint(0, 6))],
+            [rng.randint(1, 11) for _ in range(rng.randint(0, 4))],
+        )
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize(
+    "cache",
+    [
+        FilterCache(),
+        FilterCache(max_entries=3),
+        FilterCache(memory_budget=256),
+        FilterCache(ttl=-1),
+    ],
+    ids=["default", "few_entries", "small_budget", "expired"],
+)
+def test_matches_brute_force(cache, random_entries):
+    entries = random_entries(500, seed=0, **ID_RANGES)
+    index = build_index(entries)
+
+    for medicines, side_effects in random_queries(300, seed=1):
+        candidates = cache.filter(index, medicines, side_effects)
+
+        assert candidates.tolist() == brute_force(entries, medicines, side_effects)
+
+    stats = cache.stats()
+
+    assert stats["memory_used"] <= cache.memory_budget
+    assert stats["cached"] <= cache.max_entries
+
+
+def test_repeated_queries_hit_regardless_of_order_and_duplicates(random_entries):
+    entries = random_entries(200, seed=2, **ID_RANGES)
+    index = build_index(entries)
+    cache = FilterCache()
+
+    first = cache.filter(index, [3, 1, 2], [5, 4])
+    second = cache.filter(index, [1, 2, 3, 3], [4, 5, 5])
+
+    assert second is first
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+    # Shared between queries, so it must not be changed in place
+    with pytest.raises(ValueError):
+        first[:] = 0
+
+
+def test_union_reuses_cached_subsets(random_entries):
+    entries = random_entries(300, seed=3, **ID_RANGES)
+    index = build_index(entries)
+    cache = FilterCache()
+
+    cache.filter(index, [1, 2, 3], [1, 2])
+    candidates = cache.filter(index, [1, 2, 3, 4, 5], [1, 2, 3])
+
+    assert cache.stats()["subset_hits"] == 2
+    assert candidates.tolist() == brute_force(entries, [1, 2, 3, 4, 5], [1, 2, 3])
+
+
+def test_cleared_when_the_index_changes(random_entries):
+    entries = random_entries(200, seed=4, **ID_RANGES)
+    cache = FilterCache()
+
+    cache.filter(build_index(entries), [1, 2], [1, 2])
+
+    # The same query on an updated index must not be answered from the old one
+    changed = {"medicines": [1], "side_effects": [1]}
+    updated_entries = entries + [changed] * 5
+    index = build_index(entries).updated([], [(len(entries) + i, changed) for i in range(5)])
+
+    candidates = cache.filter(index, [1, 2], [1, 2])
+
+    assert candidates.tolist() == brute_force(updated_entries, [1, 2], [1, 2])
+    assert cache.stats()["hits"] == 0
+
+
+def test_queries_of_a_replaced_index_never_read_its_successor(random_entries):
+    entries = random_entries(200, seed=5, **ID_RANGES)
+    old = build_index(entries)
+
+    changed = {"medicines": [1, 2], "side_effects": [1]}
+    new = old.updated([], [(len(entries) + i, changed) for i in range(5)])
+
+    cache = FilterCache()
+
+    # A query of the new snapshot switches the cache to the new index and caches unions
+    cache.filter(new, [1, 2, 3], [1, 2])
+    cache.filter(new, [1, 2], [1, 2])
+
+    # A query that still runs on the old snapshot
+    for ids in [(1, 2), (1, 2, 3, 4)]:
+        expected = old.union(old.medicines, list(ids))
+        assert cache.union(old, "medicines", ids).tolist() == expected.tolist()
+
+    candidates = cache.filter(old, [1, 2], [1, 2])
+    assert candidates.tolist() == brute_force(entries, [1, 2], [1, 2])
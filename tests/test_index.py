@@ -0,0 +1,75 @@
+import random
+import numpy as np
+
+from classes.columnar import ColumnarDataset
+from classes.index import InvertedIndex
+
+
+def brute_force_postings(entries: list[dict], field: str) -> dict[int, list[int]]:
+    postings: dict[int, list[int]] = {}
+
+    for position, entry in enumerate(entries):
+        for i in sorted(set(entry[field])):
+            postings.setdefault(i, []).append(position)
+
+    return postings
+
+
+def as_lists(postings: dict[int, np.ndarray]) -> dict[int, list[int]]:
+    return {i: positions.tolist() for i, positions in postings.items()}
+
+
+def test_posting_lists_match_the_entries(random_entries):
+    entries = random_entries(200)
+    index = InvertedIndex.build_columnar(ColumnarDataset.from_records(entries))
+
+    assert as_lists(index.medicines) == brute_force_postings(entries, "medicines")
+    assert as_lists(index.side_effects) == brute_force_postings(entries, "side_effects")
+
+
+def test_posting_lists_of_a_selected_range_start_at_zero(random_entries):
+    entries = random_entries(100)
+
+    dataset = ColumnarDataset.from_records(entries)
+    dataset.select(30, 70)
+
+    index = InvertedIndex.build_columnar(dataset)
+
+    assert as_lists(index.medicines) == brute_force_postings(entries[30:70], "medicines")
+
+
+def test_filter_matches_brute_force(random_entries):
+    entries = random_entries(300, seed=1)
+    index = InvertedIndex.build_columnar(ColumnarDataset.from_records(entries))
+
+    rng = random.Random(2)
+
+    for _ in range(50):
+        medicines = [rng.randint(1, 9) for _ in range(rng.randint(0, 3))]
+        side_effects = [rng.randint(1, 6) for _ in range(rng.randint(0, 3))]
+
+        expected = [
+            position
+            for position, entry in enumerate(entries)
+            if set(entry["medicines"]) & set(medicines)
+            and set(entry["side_effects"]) & set(side_effects)
+        ]
+
+        assert index.filter(medicines, side_effects).tolist() == expected
+
+
+def test_updated_index_leaves_the_original_unchanged(random_entries):
+    entries = random_entries(50)
+    index = InvertedIndex.build_columnar(ColumnarDataset.from_records(entries))
+    before = as_lists(index.medicines)
+
+    changed = {"medicines": [42], "side_effects": [1]}
+    appended = {"medicines": [42, 1], "side_effects": [2]}
+
+    updated = index.updated([(3, entries[3])], [(3, changed), (50, appended)])
+
+    assert as_lists(index.medicines) == before
+
+    expected = entries[:3] + [changed] + entries[4:] + [appended]
+    assert as_lists(updated.medicines) == brute_force_postings(expected, "medicines")
+    assert as_lists(updated.side_effects) == brute_force_postings(expected, "side_effects")
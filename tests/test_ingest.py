@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+import pytest
+
+seal = pytest.importorskip("seal")
+
+from classes.database import Database  # noqa: E402
+from classes.overlay import DatasetOverlay  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Keys, parameters and the journal live in the work directory
+    monkeypatch.chdir(tmp_path)
+
+    return Database()
+
+
+@pytest.fixture
+def encrypt(database):
+    keygen = seal.KeyGenerator(database.context)
+    encryptor = seal.Encryptor(database.context, keygen.create_public_key())
+
+    def encrypt_m(m: int) -> str:
+        return encryptor.encrypt(seal.Plaintext(hex(m)[2:])).to_string().hex()
+
+    return encrypt_m
+
+
+@pytest.fixture
+def entries(random_entries, encrypt):
+    entries = random_entries(6)
+
+    for entry in entries:
+        entry["encrypted_m"] = encrypt(128 + entry["age"])
+
+    return entries
+
+
+def test_ingest_publishes_a_new_snapshot(database, entries, encrypt):
+    database.load_records(entries[:4])
+    before = database.snapshot
+
+    appended = dict(entries[4], medicines=[99], side_effects=[99])
+    updated = dict(entries[5], medicines=[99, 1], side_effects=[99])
+
+    positions = database.ingest(
+        {"append": [appended], "update": [{"index": 1, "entry": updated}], "delete": [2]}
+    )
+
+    after = database.snapshot
+
+    assert positions == [4]
+    assert isinstance(after.dataset, DatasetOverlay)
+    assert after.index.filter([99], [99]).tolist() == [1, 4]
+
+    # Queries that captured the previous snapshot still see the old entries
+    assert before.index.filter([99], [99]).tolist() == []
+    assert len(before.dataset) == 4
+
+    entries_json = database.get_data([0, 1, 2], np.array([1, 2, 4]), snapshot=after)
+    assert json.loads(entries_json)[1] is None
+    assert json.loads(entries_json)[2]["medicines"] == [99]
+
+    assert database.entry_ciphertext(after.dataset, 4) is not None
+
+
+def test_ingest_is_journaled_and_replayed(database, entries):
+    with open("dataset.json", "w") as f:
+        json.dump(entries[:4], f)
+
+    database.load_dataset()
+    database.ingest({"append": [entries[4]], "delete": [0]})
+
+    restarted = Database()
+    restarted.load_dataset()
+
+    assert len(restarted.snapshot.dataset) == 5
+    assert restarted.snapshot.dataset[0] is None
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        [],
+        {"append": {}},
+        {"append": ["entry"]},
+        {"append": [{"medicines": [1], "side_effects": [1]}]},
+        {"append": [{"encrypted_m": "00", "medicines": 5, "side_effects": [1]}]},
+        {"append": [{"encrypted_m": "00", "medicines": [1], "side_effects": ["1"]}]},
+        {"append": [{"encrypted_m": "00", "medicines": [True], "side_effects": [1]}]},
+        {"append": [{"encrypted_m": "zz", "medicines": [1], "side_effects": [1]}]},
+        {"append": [{"encrypted_m": "00ff", "medicines": [1], "side_effects": [1]}]},
+        {"update": [{"index": "1"}]},
+        {"delete": [1.5]},
+    ],
+)
+def test_invalid_changes_are_rejected_before_anything_changes(database, entries, change):
+    database.load_records(entries[:4])
+    snapshot = database.snapshot
+
+    with pytest.raises(ValueError):
+        database.ingest(change)
+
+    assert database.snapshot is snapshot
+    assert not os.path.exists(database.journal_file)
+
+
+def test_out_of_range_positions_are_not_journaled(database, entries):
+    database.load_records(entries[:4])
+
+    with pytest.raises(IndexError):
+        database.ingest({"append": [entries[4]], "delete": [4]})
+
+    assert len(database.snapshot.dataset) == 4
+    assert not os.path.exists(database.journal_file)
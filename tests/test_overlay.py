@@ -0,0 +1,96 @@
+import pytest
+
+from classes.columnar import ColumnarDataset
+from classes.overlay import DatasetOverlay
+
+
+@pytest.fixture
+def base(random_entries):
+    entries = random_entries(10)
+
+    return entries, ColumnarDataset.from_records(entries)
+
+
+def record(entry: dict) -> dict:
+    return {key: value for key, value in entry.items() if key != "encrypted_m"}
+
+
+def test_reads_through_to_the_base(base):
+    entries, dataset = base
+    overlay = DatasetOverlay(dataset)
+
+    assert len(overlay) == 10
+    assert [dict(entry) for entry in overlay] == [record(entry) for entry in entries]
+    assert [overlay.key(i) for i in range(10)] == list(range(10))
+    assert overlay.ciphertext(3) == bytes.fromhex(entries[3]["encrypted_m"])
+
+    with pytest.raises(IndexError):
+        overlay[10]
+
+
+def test_changes_keep_positions(base, random_entries):
+    entries, dataset = base
+    new = random_entries(2, seed=1)
+
+    overlay = DatasetOverlay(dataset)
+    overlay.set(2, new[0])
+    overlay.set(5, None)
+
+    assert overlay.append(new[1]) == 10
+    assert len(overlay) == 11
+
+    assert overlay[2] is new[0]
+    assert overlay[5] is None
+    assert overlay[10] is new[1]
+    assert dict(overlay[4]) == record(entries[4])
+
+    assert [i for i in range(11) if overlay.overlaid(i)] == [2, 5, 10]
+    assert overlay.ciphertext(2) == bytes.fromhex(new[0]["encrypted_m"])
+    assert overlay.ciphertext(10) == bytes.fromhex(new[1]["encrypted_m"])
+
+    with pytest.raises(IndexError):
+        overlay.ciphertext(5)
+
+
+def test_every_change_gets_a_new_key(base, random_entries):
+    _, dataset = base
+    new = random_entries(3, seed=2)
+
+    overlay = DatasetOverlay(dataset)
+    overlay.set(1, new[0])
+    first = overlay.key(1)
+
+    overlay.set(1, new[1])
+    second = overlay.key(1)
+
+    position = overlay.append(new[2])
+    appended = overlay.key(position)
+
+    overlay.set(position, new[0])
+
+    # Cached ciphertexts of earlier versions are never mistaken for the current one
+    assert len({1, first, second, appended, overlay.key(position)}) == 5
+
+
+def test_copy_leaves_the_original_unchanged(base, random_entries):
+    entries, dataset = base
+    new = random_entries(2, seed=3)
+
+    overlay = DatasetOverlay(dataset)
+    overlay.set(0, new[0])
+
+    copy = overlay.copy()
+    copy.set(0, None)
+    copy.set(1, new[1])
+    copy.append(new[1])
+
+    assert overlay[0] is new[0]
+    assert dict(overlay[1]) == record(entries[1])
+    assert len(overlay) == 10
+
+    assert copy[0] is None
+    assert copy[1] is new[1]
+    assert len(copy) == 11
+
+    # Versions continue from the original, so the replaced entry gets another key
+    assert copy.key(0) != overlay.key(0)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from classes.index import InvertedIndex
+from classes.planner import (
+    BLOCK_SECONDS,
+    ENTRY_SECONDS,
+    PARALLEL_OVERHEAD,
+    SMOOTHING,
+    BudgetExceeded,
+    QueryPlanner,
+)
+
+
+def test_entry_mode_never_packs():
+    plan = QueryPlanner(1000).plan("entry", 1000, 1000, blocks=10, workers=None)
+
+    assert plan.strategy == "entry"
+    assert plan.results == 1000
+    assert plan.seconds == pytest.approx(1000 * ENTRY_SECONDS)
+    assert plan.response_bytes == 1000 * 1000
+
+
+def test_packed_mode_packs_even_when_it_is_slower():
+    plan = QueryPlanner(1000).plan("packed", 2, 2, blocks=2, workers=4)
+
+    assert plan.strategy == "packed"
+    assert plan.seconds == pytest.approx(2 * BLOCK_SECONDS)
+
+
+def test_packed_mode_without_packed_dataset_falls_back():
+    plan = QueryPlanner(1000).plan("packed", 5, 5, blocks=None, workers=None)
+
+    assert plan.strategy == "entry"
+
+
+def test_auto_mode_chooses_the_cheapest_strategy():
+    planner = QueryPlanner(1000)
+
+    # Few candidates, the pool overhead and the packing pads do not pay off
+    assert planner.plan("auto", 2, 2, blocks=2, workers=8).strategy == "entry"
+
+    # Many candidates in few blocks
+    assert planner.plan("auto", 4096, 4096, blocks=2, workers=8).strategy == "packed"
+
+    # Many candidates spread over almost as many blocks
+    plan = planner.plan("auto", 4096, 4096, blocks=4000, workers=8)
+
+    assert plan.strategy == "parallel"
+    assert plan.seconds == pytest.approx(PARALLEL_OVERHEAD + 4096 * ENTRY_SECONDS / 8)
+
+
+def test_budget_rejects_before_any_work():
+    planner = QueryPlanner(1000, budget=1.0)
+
+    assert planner.plan("entry", 400, 400, blocks=None, workers=None).strategy == "entry"
+
+    with pytest.raises(BudgetExceeded) as error:
+        planner.plan("entry", 401, 401, blocks=None, workers=None)
+
+    assert error.value.plan.seconds > 1.0
+    assert error.value.plan.budget == 1.0
+
+
+def test_budget_applies_to_the_cheapest_plan():
+    planner = QueryPlanner(1000, budget=1.0)
+
+    # Too slow one by one, but the packed dataset fits the budget
+    plan = planner.plan("auto", 4096, 4096, blocks=16, workers=None)
+    assert plan.strategy == "packed"
+
+    with pytest.raises(BudgetExceeded):
+        planner.plan("entry", 4096, 4096, blocks=16, workers=None)
+
+
+def test_batch_budget():
+    planner = QueryPlanner(1000, budget=1.0)
+
+    plan = planner.plan_batch(candidates=900, estimated_candidates=900, results=250)
+
+    assert plan.strategy == "batch"
+    assert plan.seconds == pytest.approx(250 * BLOCK_SECONDS)
+    assert plan.response_bytes == 250 * 1000
+
+    with pytest.raises(BudgetExceeded):
+        planner.plan_batch(candidates=900, estimated_candidates=900, results=251)
+
+
+def test_observations_move_the_cost_model():
+    planner = QueryPlanner(1000, budget=1.0)
+
+    assert planner.plan("auto", 100, 100, blocks=None, workers=None).strategy == "entry"
+
+    # Entries turn out to be much slower than the prior
+    planner.observe("entry", 100, 10.0, 100 * 2000)
+
+    cost = ENTRY_SECONDS + SMOOTHING * (0.1 - ENTRY_SECONDS)
+    assert planner.stats()["seconds_per_result"]["entry"] == pytest.approx(cost)
+    assert planner.stats()["result_bytes"] == 1200
+
+    with pytest.raises(BudgetExceeded):
+        planner.plan("auto", 100, 100, blocks=None, workers=None)
+
+    # Empty queries carry no information
+    planner.observe("entry", 0, 5.0, 0)
+    assert planner.stats()["seconds_per_result"]["entry"] == pytest.approx(cost)
+
+
+def test_parallel_observations_are_per_worker():
+    planner = QueryPlanner(1000)
+    planner.observe("parallel", 100, PARALLEL_OVERHEAD + 0.1, 100 * 1000, workers=4)
+
+    cost = ENTRY_SECONDS + SMOOTHING * (0.1 * 4 / 100 - ENTRY_SECONDS)
+    assert planner.stats()["seconds_per_result"]["parallel"] == pytest.approx(cost)
+
+
+def test_estimate_candidates():
+    index = InvertedIndex()
+    index.medicines = {1: np.arange(50), 2: np.arange(50, 100)}
+    index.side_effects = {1: np.arange(0, 100, 2)}
+
+    # Half of the entries have medicine 1, half medicine 2 and half side effect 1, taken
+    # as independent: 100 * (1 - 0.5 * 0.5) * 0.5
+    assert QueryPlanner.estimate_candidates(index, 100, [1, 2], [1]) == 38
+    assert QueryPlanner.estimate_candidates(index, 100, [1], [1]) == 25
+    assert QueryPlanner.estimate_candidates(index, 100, [3], [1]) == 0
+    assert QueryPlanner.estimate_candidates(index, 0, [1], [1]) == 0
+
+
+def test_concurrent_queries_go_to_the_process_pool_whatever_their_size():
+    planner = QueryPlanner(1000)
+
+    # Alone on the server, a small query is cheaper inline
+    assert planner.plan("auto", 2, 2, blocks=None, workers=8).strategy == "entry"
+
+    # With others running, it would share the GIL with them
+    assert planner.plan("auto", 2, 2, None, 8, concurrent=True).strategy == "parallel"
+    assert planner.plan("entry", 2, 2, None, 8, concurrent=True).strategy == "parallel"
+
+    # Without a pool, or when the packed dataset is cheaper, nothing changes
+    assert planner.plan("auto", 2, 2, None, None, concurrent=True).strategy == "entry"
+    assert planner.plan("auto", 4096, 4096, 2, 8, concurrent=True).strategy == "packed"
@@ -0,0 +1,150 @@
+import json
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+pytest.importorskip("requests")
+
+from classes.shards import ShardError, ShardPool  # noqa: E402
+
+
+def shard_result(endpoint: str, candidates: int, header: dict) -> SimpleNamespace:
+    return SimpleNamespace(
+        endpoint=endpoint, handle=f"{endpoint}-handle", candidates=candidates, header=header
+    )
+
+
+def test_merge_entry_results():
+    results = [
+        shard_result("a", 3, {"mode": "entry"}),
+        shard_result("b", 0, {"mode": "entry"}),
+        shard_result("c", 2, {"mode": "entry"}),
+    ]
+
+    header, parts = ShardPool.merge(results)
+
+    assert header == {"mode": "entry"}
+    assert parts == [("a", "a-handle", 3), ("b", "b-handle", 0), ("c", "c-handle", 2)]
+
+
+def test_merge_packed_with_entry_results():
+    results = [
+        shard_result("a", 2, {"mode": "entry"}),
+        shard_result("b", 2, {"mode": "packed", "slots": [[0, 4], [2]]}),
+        shard_result("c", 1, {"mode": "entry"}),
+    ]
+
+    header, parts = ShardPool.merge(results)
+
+    # Every entry result becomes a block with the single slot 0
+    assert header == {"mode": "packed", "slots": [[0], [0], [0, 4], [2], [0]]}
+    assert [size for *_, size in parts] == [2, 2, 1]
+
+
+def test_merge_batch_shifts_result_positions():
+    results = [
+        shard_result(
+            "a",
+            0,
+            {
+                "mode": "batch",
+                "patients": [
+                    {"handle": "a0", "results": [0, 1]},
+                    {"handle": "a1", "results": [1, 2]},
+                ],
+            },
+        ),
+        shard_result(
+            "b",
+            0,
+            {
+                "mode": "batch",
+                "patients": [
+                    {"handle": "b0", "results": []},
+                    {"handle": "b1", "results": [0]},
+                ],
+            },
+        ),
+        shard_result(
+            "c",
+            0,
+            {
+                "mode": "batch",
+                "patients": [
+                    {"handle": "c0", "results": [0, 1]},
+                    {"handle": "c1", "results": [1]},
+                ],
+            },
+        ),
+    ]
+
+    header, parts = ShardPool.merge_batch(results)
+
+    # Shard "a" sent 3 results and shard "b" 1, so the results of "c" start at 4
+    assert header == {
+        "mode": "batch",
+        "patients": [{"results": [0, 1, 4, 5]}, {"results": [1, 2, 3, 5]}],
+    }
+    assert parts == [
+        [("a", "a0", 2), ("b", "b0", 0), ("c", "c0", 2)],
+        [("a", "a1", 2), ("b", "b1", 1), ("c", "c1", 1)],
+    ]
+
+
+class FakeSession:
+    def __init__(self, status_code: int = 200) -> None:
+        self.status_code = status_code
+        self.requests: list[tuple[str, dict]] = []
+
+    def post(self, url: str, data: str, headers: dict) -> SimpleNamespace:
+        body = json.loads(data)
+        self.requests.append((url, body))
+
+        entries = [{"shard": url, "index": index} for index in body["indexes"]]
+
+        return SimpleNamespace(
+            status_code=self.status_code,
+            text=json.dumps(entries),
+            content=b"{}",
+            headers={"Content-Type": "application/json"},
+        )
+
+
+def fake_pool(session: FakeSession) -> ShardPool:
+    pool = ShardPool.__new__(ShardPool)
+    pool.session = session
+    pool.executor = ThreadPoolExecutor(max_workers=2)
+
+    return pool
+
+
+def test_fetch_routes_indexes_to_their_shards():
+    session = FakeSession()
+    pool = fake_pool(session)
+
+    parts = [("a", "ha", 3), ("b", "hb", 0), ("c", "hc", 2)]
+    entries = pool.fetch("/data", parts, [0, 2, 3, 4])
+
+    assert entries == [
+        {"shard": "a/data", "index": 0},
+        {"shard": "a/data", "index": 2},
+        {"shard": "c/data", "index": 0},
+        {"shard": "c/data", "index": 1},
+    ]
+
+    # Shards without requested indexes are not asked
+    assert sorted(url for url, _ in session.requests) == ["a/data", "c/data"]
+    assert {body["handle"] for _, body in session.requests} == {"ha", "hc"}
+
+    with pytest.raises(IndexError):
+        pool.fetch("/data", parts, [5])
+
+
+def test_fetch_raises_shard_errors():
+    pool = fake_pool(FakeSession(status_code=404))
+
+    with pytest.raises(ShardError) as error:
+        pool.fetch("/data", [("a", "ha", 1)], [0])
+
+    assert error.value.status == 404
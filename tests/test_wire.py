@@ -0,0 +1,109 @@
+import random
+import pytest
+
+from classes.wire import (
+    FrameReader,
+    decode_results_json,
+    decode_results_stream,
+    encode_results_binary,
+    encode_results_json,
+    encode_results_stream,
+    iter_frames,
+    pack_frames,
+    unpack_frames,
+)
+
+FRAMES = [b"", b"a", bytes(range(256)) * 3, b"\x00" * 4, b"last"]
+
+RESULTS = [
+    {"mode": "entry", "ciphertexts": [b"\x01\x02", b"", b"\xff" * 100]},
+    {"mode": "packed", "ciphertexts": [b"\x01", b"\x02\x03"], "slots": [[0, 3], [1]]},
+    {"mode": "batch", "patients": [[0, 1], [], [1]], "ciphertexts": [b"\x04", b"\x05"]},
+]
+
+
+def split(data: bytes, positions: list[int]) -> list[bytes]:
+    bounds = [0] + sorted(positions) + [len(data)]
+
+    return [data[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+def test_pack_unpack_round_trip():
+    assert unpack_frames(pack_frames(FRAMES)) == FRAMES
+    assert unpack_frames(pack_frames([])) == []
+
+
+@pytest.mark.parametrize("cut", [1, 3, 5, 10])
+def test_unpack_rejects_truncated_messages(cut):
+    data = pack_frames([b"0123456789"])
+
+    with pytest.raises(ValueError):
+        unpack_frames(data[: len(data) - cut])
+
+
+def test_every_two_chunk_split():
+    data = pack_frames(FRAMES)
+
+    for position in range(len(data) + 1):
+        assert list(iter_frames(split(data, [position]))) == FRAMES
+
+
+def test_single_byte_chunks():
+    data = pack_frames(FRAMES)
+
+    assert list(iter_frames(data[i : i + 1] for i in range(len(data)))) == FRAMES
+
+
+def test_random_chunk_splits():
+    rng = random.Random(0)
+    data = pack_frames(FRAMES)
+
+    for _ in range(200):
+        positions = [rng.randint(0, len(data)) for _ in range(rng.randint(0, 20))]
+
+        assert list(iter_frames(split(data, positions))) == FRAMES
+
+
+def test_reader_keeps_incomplete_frames():
+    reader = FrameReader()
+    data = pack_frames([b"abc", b"defg"])
+
+    assert reader.feed(data[:5]) == []
+    assert reader.feed(data[5:9]) == [b"abc"]
+    assert reader.feed(data[9:]) == [b"defg"]
+
+    reader.finish()
+
+
+def test_truncated_stream_raises_at_the_end():
+    data = pack_frames([b"abc", b"defg"])
+
+    frames = iter_frames([data[:-1]])
+
+    assert next(frames) == b"abc"
+
+    with pytest.raises(ValueError):
+        next(frames)
+
+
+@pytest.mark.parametrize("results", RESULTS, ids=lambda results: results["mode"])
+def test_json_round_trip(results):
+    assert decode_results_json(encode_results_json(results)) == results
+
+
+@pytest.mark.parametrize("results", RESULTS, ids=lambda results: results["mode"])
+def test_stream_round_trip(results):
+    rng = random.Random(1)
+
+    header = {key: value for key, value in results.items() if key != "ciphertexts"}
+    data = b"".join(encode_results_stream(header, iter(results["ciphertexts"])))
+
+    # The stream is a valid binary message as well
+    assert data == encode_results_binary(results)
+
+    for _ in range(50):
+        positions = [rng.randint(0, len(data)) for _ in range(rng.randint(0, 10))]
+        decoded, ciphertexts = decode_results_stream(split(data, positions))
+
+        assert decoded == header
+        assert list(ciphertexts) == results["ciphertexts"]